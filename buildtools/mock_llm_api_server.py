@@ -7,7 +7,9 @@
 支持的端点
 - POST /v1/chat/completions（也兼容 POST /chat/completions）
 - GET /v1/models（也兼容 GET /models）
-- GET /health
+- GET /health（JSON 就绪/过载状态；过载时返回 503）
+- POST/GET /v1/files、GET/DELETE /v1/files/{id}、GET /v1/files/{id}/content（Batch 输入/输出文件）
+- POST/GET /v1/batches、GET /v1/batches/{id}、POST /v1/batches/{id}/cancel（OpenAI Batch API 模拟）
 
 请求行为（与 LinguaGacha 的提示词结构匹配）
 - `--task translation`（默认）：
@@ -19,10 +21,153 @@
   - 提取 `输入：` / `Input:` 之后的纯文本原文。
   - 为每行原文最多生成 1 条模拟术语，返回分析任务使用的 JSONLINE。
   - 若没有可提取术语，则返回 `<why>当前文本没有稳定术语</why>` + 空 JSONLINE。
+- `--task sakura`（对应 api_format=SakuraLLM）：
+  - 取最后一个 user 消息里 “将下面的日文文本（根据对应关系和备注）翻译成中文：” 之后的原文行。
+  - 返回与原文逐行对齐的纯文本中文译文（空行保留为空行），不带 JSONLINE 包装。
+  - 按 --sakura-tokens-per-s（默认 40，约 1.5 字/token）额外计算解码耗时，流式按块长度逐块计时。
+- `--task auto`：
+  - 逐请求判定任务，同一端点可同时承接翻译、分析与 Sakura 请求。
+  - 有 system prompt 时按其中的模板特征（分析提示词的 “提取术语” 前缀与输出示例、Sakura 固定身份句）判定，
+    结果按 system prompt 哈希缓存，命中后只多一次哈希；没有 system prompt 时看用户正文里的 jsonline 块与输入标记。
+  - /health 的 tasks 按任务汇总请求数、失败数、行数与 token，task_classifier 给出缓存命中情况。
+
+请求体读取
+- 同时支持 Content-Length 与 `Transfer-Encoding: chunked` 请求体，按 --ingest-chunk-bytes 分块读取。
+- chat 请求体达到 --stream-ingest-threshold（chunked 一律视为达到）时改走流式扫描：
+  边读边解析 JSON，messages 正文不落内存，只保留最后一个 jsonline 块 / 分析输入段，
+  单请求峰值内存由读取块大小和提取结果决定，而不是整个请求体。
+- 请求字节数达到 --offload-threshold（默认 256KiB）的 chat 请求，解析、提示词提取与响应生成都交给
+  --offload-workers 个工作线程，避免整段占住事件循环、拖慢其他连接的 SSE 节奏；小请求仍在事件循环里直接处理。
+  排队上限为 --offload-queue，排满时按削峰返回 503（shed 原因 offload_queue），/health 的 offload 给出计数与耗时。
+
+压缩
+- 请求体支持 Content-Encoding: gzip/deflate（含裸 deflate），边读边解压，解压后的字节数同样受 --max-body-bytes 限制，
+  流式扫描与缓冲解析都吃解压后的数据；其他编码返回 415。
+- --response-compression 按 Accept-Encoding 压缩非流式响应；--sse-compression 压缩流式响应，
+  每条 SSE 事件后 Z_SYNC_FLUSH，客户端逐条即可解出。小于 --compress-min-bytes 的响应不压缩，级别由 --compression-level 指定。
+- /health 的 compression 按方向（request/response）和编码汇总原始字节、压缩后字节、压缩比与编解码 CPU 毫秒，
+  访问日志记录每个请求的 request_encoding/response_encoding 与解压后的 body_bytes。
+
+长稳（soak）观测
+- --soak-interval 开启后按间隔采集 tracemalloc、打开的文件描述符、asyncio 任务数和存活 StreamWriter 数，
+  与上一采样的增量及按增长排序的 top-N 分配点写入 --soak-output（JSONL），并通过 GET /debug/soak 查看最新样本。
+- 用于区分长时间压测中的内存/句柄增长来自 mock 还是 LinguaGacha。
+
+链路追踪
+- 解析 W3C traceparent/tracestate（缺失时新建 trace），响应带 traceresponse 头。
+- --trace-output PATH 以 OTLP-JSON（每行一个 ExportTraceServiceRequest）导出服务端 span：
+  根 span 及 parse/generate/queue/stream（非流式为 respond）子 span，属性含 task、model、行数与 token 数，
+  可与 LinguaGacha 侧的 trace 离线合并。未采样（flags=00）的请求不导出。
+
+访问日志与 Server-Timing
+- --access-log PATH 写出 JSONL 访问日志（队列 + 后台线程，不阻塞事件循环），每个请求一行：
+  accept 时间、head/body 读完、生成 CPU 耗时、首字节/末字节（均为相对 accept 的毫秒）、收发字节、状态码、
+  task、model 和断开原因 disconnect_reason（complete/client_disconnect/http_error/shed/server_error）。
+- 每个响应都带 X-Request-Id 与 Server-Timing（head/body/gen/jitter/total）；流式响应的首/末字节耗时
+  放在 chunked trailer 的 Server-Timing 里，便于和客户端侧测量按请求对齐。
+
+性能剖析
+- --profile PREFIX 用 cProfile 包住事件循环线程，并以 --profile-sample-interval 采样调用栈；
+  退出（Ctrl+C/SIGTERM）或收到 SIGUSR1 时写出 PREFIX.pstats 与 PREFIX.collapsed（可直接喂给 flamegraph）。
+- --slow-callback-ms 开启 asyncio debug 慢回调告警，告警附带请求阶段（read_head/read_body/route/parse/generate/respond/stream），
+  按阶段的次数与耗时汇总在 /health 的 slow_callbacks 中。
+
+准入控制与削峰
+- --max-connections 限制并发连接数，--memory-budget-bytes 限制在途请求体与待写响应的总字节数。
+- 超限的新请求在读 body 之前直接返回 503 + Retry-After，/health 不受限制并报告 ok/overloaded。
+
+客户端断开
+- chat 请求读完后同时监听连接是否断开；客户端关闭（FIN）或重置连接（如 LinguaGacha 取消任务时中止连接）时
+  立即取消生成与抖动等待，释放协程、响应体和预算，不再拖满整个抖动时长。
+- 每个响应都带 Connection: close，正常客户端不会半关闭，因此请求体读完后再读到 EOF 即视为离开；
+  监听只等 EOF 信号、不读取套接字，请求之后到达的字节留在缓冲里不丢。
+- --allow-half-close 时 FIN 不算离开：发完请求后 shutdown(SHUT_WR) 的客户端照常拿到响应，
+  只有连接被重置或写回失败才确认离开（流式为下一块，非流式为抖动结束时）。
+- 这类请求记为 client_disconnect，/health 的 abandoned 按首字节前/流式中途分别计数。
+
+语料回放
+- --corpus PATH 从本地录制语料（JSONL，每行 {"src": 原文, "dst": 译文}）回放翻译任务的译文，
+  让输出字节量、行长方差和 CJK 转义开销接近真实流量；分析任务仍走合成输出。
+- 按原文哈希精确命中，未命中时在原文长度最接近的若干条记录中随机取一条；没有语料或语料为空时退回随机词表。
+- 语料与 PATH.idx 索引均通过 mmap 只读访问，多 GB 语料无需装进内存；索引在语料变化后的首次启动时重建。
+
+合成译文
+- 默认每行 4~10 个随机词；--output-length proportional 时按原文字符数 * 语言对扩展比生成，
+  让响应字节量随输入变化。原文语言按文字脚本判断（假名/谚文/汉字/其他），目标语言由 --vocabulary 决定
+  （en 为英文词表，cjk 为中文词表），内置扩展比可用 --expansion-ratio ja-en=2.5 覆盖。
+- 词表在模块加载时预拼好分隔符，每行用一次 random.choices(k=...) 批量抽词。
+
+思考（reasoning）模拟
+- --reasoning request 时按请求的 reasoning_effort（或 Responses 风格的 reasoning.effort）生成思考文本，
+  --reasoning always 时未携带档位的请求也按 --reasoning-default-effort 思考。
+- 思考长度随档位增长（minimal 64 → xhigh 8192 token，可用 --reasoning-scale 缩放），
+  流式先发 reasoning_content delta 再发正文，非流式放在 message.reasoning_content；
+  usage 中计入 completion_tokens，并在 completion_tokens_details.reasoning_tokens 单独列出。
+- --reasoning-tokens-per-s 给思考阶段额外计时，用于观察思考对首个正文 token 时间的影响。
+- 本服务只实现 OpenAI Chat Completions 协议，Anthropic thinking 块与 Gemini thought part 不在模拟范围内。
+
+前缀缓存模拟
+- --prefix-cache-tokens N 开启 prompt 前缀缓存：每条消息结束处算一次累计前缀摘要（role + 正文，与模型名一起作键），
+  请求命中的最长前缀即 cached_tokens，写在 usage.prompt_tokens_details.cached_tokens，
+  同时给出 Anthropic 风格的 cache_read_input_tokens。开启后 prompt_tokens 按全部消息估算，不再只算最后一条 user。
+- 只缓存累计不少于 --prefix-cache-min-tokens（默认 64）的前缀；按 token 预算做 LRU 淘汰，
+  空闲超过 --prefix-cache-ttl 秒（默认 300）过期。LinguaGacha 的翻译/分析 system prompt 约 300~450 token（按字符数/4 估算），
+  同一作业的请求因此从第二个起命中；要模拟 OpenAI 的 1024 token 门槛时显式传 --prefix-cache-min-tokens 1024。
+- --prefill-tokens-per-s 给首字节额外加上“未命中 token / 速率”的预填充耗时，命中越长首字节越早；
+  不设置时缓存只影响 usage 统计。
+- 访问日志的 cached_tokens 记录每个请求的命中量，/health 的 prefix_cache 给出条目、预算占用、命中与淘汰计数。
+
+工具调用（agent）模拟
+- --tool-rounds N 或 --tool-script PATH 开启后，带 tools 数组的请求按脚本返回 tool_calls：
+  当前步 = 最后一条 user 消息之后带 tool_calls 的 assistant 消息数，脚本走完后回到普通回答；
+  同一会话里用户每追问一次，脚本都从第一步重新开始。
+- 流式按真实服务的形状先发带 id/name 的 delta，参数 JSON 再拆成多段 arguments delta，finish_reason 为 tool_calls；
+  脚本未写 arguments 时按 tools 里的 parameters schema 合成参数。
+- 访问日志的 tool_calls 字段记录每次响应发出的调用数，便于按轮次统计 agent 回合延迟。
+
+内容故障注入
+- --content-fault MODE=PROB（可重复）让响应按概率带上质量问题，用来覆盖客户端的检查与重试路径：
+  untranslated（整批回显原文）、source_residue（某行残留原文字符）、repetition（某行失控重复，
+  足以触发流式退化检测）、swapped_keys（相邻两行 key 对调；分析任务为 src/dst 写反）、
+  missing_line（少一行）、extra_line（多一行）。
+- 各模式独立抽签，作用于翻译、Sakura 与分析输出，工具调用不受影响；
+  命中的模式写入访问日志的 content_faults，/health 的 content_faults 按模式计数。
+
+SSE 字节级分片
+- --sse-fragment MODE=PROB（可重复）让每条 SSE 消息按概率拆成多次写出（每片一个 chunk，片间 drain），
+  用来压测客户端流式解码器的增量解析与缓冲：byte（逐字节写出）、utf8（切在多字节 UTF-8 字符中间）、
+  json_string（切在 JSON 字符串字面量内部）、random（在 1~4 个随机字节偏移处切开）。
+- utf8 只对含多字节字符的消息生效（正文需配合 --vocabulary cjk），没有可切位置的消息原样写出且不计数。
+- 每条消息按上述顺序依次抽签，命中第一个即采用；切分发生在压缩之前，开启 --sse-compression 时每片各自 SYNC_FLUSH，
+  解压后的切分位置不变。
+- 访问日志的 sse_fragments 记录每个模式切开的消息数，/health 的 sse_fragments 累计消息数与额外写次数。
 
 网络抖动
 - 每个请求模拟抖动（默认 2~20 秒，可通过 --min-jitter/--max-jitter 调整）；
   流式场景会把总抖动拆分到多段 SSE 消息上。
+- 抖动与 SSE 间隔等待统一交给哈希时间轮（--timer-tick-ms，默认 10ms），每个 tick 成批唤醒到期的流，
+  只挂一个 loop 定时器；等待时间向上取整到 tick。--timer-tick-ms 0 退回每次等待一个 asyncio.sleep。
+
+Batch API 模拟
+- multipart 上传 purpose=batch 的 JSONL（每行 custom_id/method/url/body），创建 batch 后在后台逐行复用
+  chat 生成逻辑（强制非流式、不计抖动），完成后以 output_file_id / error_file_id 提供结果 JSONL。
+- 状态按 validating -> in_progress -> finalizing -> completed 推进；输入有非法行时整批 failed 并在 errors 列出行号，
+  cancel 后以 cancelled 结束并保留已完成部分的输出。
+- --batch-capacity-rps 是所有 batch 共享的处理速率（<= 0 不限速），--batch-max-active 限制同时处理的 batch 数，
+  --batch-min-duration 是从创建到完成的最短时长，用来模拟提交后排队的等待。
+- 文件只保存在内存里；输入文件受 --max-body-bytes 约束，大批量时需要同时调大。/health 的 batches 给出按状态的计数。
+
+Unix 域套接字
+- --unix-socket PATH 额外在 Unix 域套接字上监听，加 --no-tcp 则只开 UDS；两个监听器共用路由、准入和统计。
+- 同机压测时可借此把客户端引擎自身开销与回环 TCP 协议栈开销分开：
+   curl -s --unix-socket /tmp/mock-llm.sock http://localhost/health
+
+进程内启动（测试与基准矩阵）
+- await start_mock_server(MockServerConfig(...)) 在当前事件循环里启动，port=0 时由系统分配临时端口；
+  返回的 MockServer 提供 base_url、stats()（与 /health 同款快照）和 close()，也可 async with。
+- 同步代码用 MockServerThread(config) 在后台线程里跑独立事件循环，with 退出时关闭。
+- pytest：在 conftest.py 写 mock_llm_server = make_pytest_fixture()（默认无抖动），
+  配合 @pytest.mark.parametrize("mock_llm_server", [{"task": "analysis"}], indirect=True) 切换配置。
 
 一键启动示例（独立本地调试）
 1) 启动（本机回环，端口 8000）
@@ -69,36 +214,154 @@
    uv run python buildtools/mock_llm_api_server.py --log-level DEBUG
 
 参数示意（节选）
-- --backlog: asyncio.start_server(..., backlog=...) 的 backlog；高并发下过小会更容易出现连接排队/拒绝。
+- --backlog: loop.create_server(..., backlog=...) 的 backlog；高并发下过小会更容易出现连接排队/拒绝。
 - --stream-chunk-lines: 流式模式每个 SSE chunk 携带的 JSONLINE 行数；越大消息越少但首块可能更“粗”。
 - --read-timeout: 单连接读取超时（秒），用于兜底卡死连接/模拟慢客户端。
 - --max-header-bytes/--max-body-bytes: 请求头/体的上限，避免压测时异常请求撑爆内存。
+- --max-connections/--memory-budget-bytes/--retry-after: 准入上限与 503 的 Retry-After 秒数，0 表示不限制。
+- --ingest-chunk-bytes: 单次从 socket 读取请求体的最大字节数。
+- --stream-ingest-threshold: 流式扫描的 Content-Length 阈值（字节），0 表示全部 chat 请求都流式扫描，-1 关闭。
 """
 
 from __future__ import annotations
 
 import argparse
+import array
 import asyncio
+import codecs
+import collections
+import concurrent.futures
+import contextvars
+import cProfile
+import dataclasses
+import functools
 import hashlib
 import json
 import logging
+import math
+import mmap
+import os
+import pathlib
+import queue
 import random
 import re
+import signal
+import struct
+import sys
+import threading
 import time
+import tracemalloc
 import uuid
-from dataclasses import dataclass
-from typing import Any
+import weakref
+import zlib
+from collections.abc import AsyncIterator, Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import Any, Self
+from urllib.parse import parse_qs, urlsplit
+
+
+@dataclass(frozen=True)
+class ChatRequestPayload:
+    """保存 chat 请求体解析结果，缓冲解析与流式扫描共用同一形状。"""
+
+    data: dict[str, Any]
+    request_text: str
+    prompt_tokens: int
+    body_digest: bytes
+    task: str | None = None
+    # 每条消息结束处的 (累计前缀摘要, 累计 token 数)，只在开启前缀缓存时计算
+    prefix_chain: tuple[tuple[bytes, int], ...] = ()
 
 
 @dataclass(frozen=True)
 class HttpRequest:
-    """保存一次已解析 HTTP 请求的最小字段。"""
+    """保存一次已解析 HTTP 请求的最小字段。
+
+    流式扫描的 chat 请求不保留 body，只在 payload 中携带提取结果。
+    """
 
     method: str
     target: str
     version: str
     headers: dict[str, str]
     body: bytes
+    payload: ChatRequestPayload | None = None
+
+
+@dataclass(frozen=True)
+class MockServerConfig:
+    """服务运行参数；命令行参数在启动时一次性收敛到这里。
+
+    默认值与命令行默认值一致，进程内启动时只需覆盖关心的字段。
+    """
+
+    read_timeout_s: float = 30.0
+    allow_half_close: bool = False
+    max_header_bytes: int = 64 * 1024
+    max_body_bytes: int = 16 * 1024 * 1024
+    ingest_chunk_bytes: int = 64 * 1024
+    stream_ingest_threshold: int = 1024 * 1024
+    min_jitter_s: float = 2.0
+    max_jitter_s: float = 20.0
+    stream_chunk_lines: int = 10
+    seed: int | None = None
+    task: str = "translation"
+    max_connections: int = 0
+    memory_budget_bytes: int = 1024 * 1024 * 1024
+    retry_after_s: int = 1
+    soak_interval_s: float = 0.0
+    soak_output: str | None = None
+    soak_top_n: int = 10
+    access_log: str | None = None
+    trace_output: str | None = None
+    profile_output: str | None = None
+    profile_sample_interval_s: float = 0.005
+    slow_callback_s: float = 0.0
+    timer_tick_s: float = 0.01
+    offload_threshold_bytes: int = 256 * 1024
+    offload_workers: int = 2
+    offload_queue: int = 64
+    response_compression: bool = False
+    sse_compression: bool = False
+    compression_level: int = 6
+    compress_min_bytes: int = 1024
+    corpus_path: str | None = None
+    output_model: OutputModel = field(default_factory=lambda: OutputModel())
+    reasoning_mode: str = "off"
+    reasoning_default_effort: str = "medium"
+    reasoning_scale: float = 1.0
+    reasoning_tokens_per_s: float = 0.0
+    tool_script: tuple[dict[str, Any], ...] = ()
+    sakura_tokens_per_s: float = 40.0
+    content_faults: tuple[tuple[str, float], ...] = ()
+    sse_fragments: tuple[tuple[str, float], ...] = ()
+    batch_capacity_rps: float = 100.0
+    batch_max_active: int = 2
+    batch_min_duration_s: float = 5.0
+    prefix_cache_tokens: int = 0
+    prefix_cache_ttl_s: float = 300.0
+    prefix_cache_min_tokens: int = 64
+    prefill_tokens_per_s: float = 0.0
+
+
+@dataclass(frozen=True)
+class ChatReply:
+    """生成阶段的产物：非流式是一个响应体和总等待，流式是编码好的 SSE 消息和逐条间隔。"""
+
+    stream: bool
+    messages: list[bytes]
+    delays_s: list[float]
+    content_encoding: str | None = None
+
+
+@dataclass(frozen=True)
+class TraceContext:
+    """W3C trace context：来自 traceparent/tracestate，缺省时由服务端新建。"""
+
+    trace_id: str
+    parent_span_id: str | None
+    sampled: bool
+    tracestate: str
 
 
 @dataclass(frozen=True)
@@ -112,12 +375,21 @@ class TranslationRequestEntry:
 class HttpError(Exception):
     """携带 HTTP 状态码和公开错误消息的请求异常。"""
 
-    def __init__(self, status: int, message: str) -> None:
+    def __init__(
+        self,
+        status: int,
+        message: str,
+        *,
+        error_type: str = "invalid_request_error",
+        headers: dict[str, str] | None = None,
+    ) -> None:
         """保存 HTTP 状态码和错误文本，便于路由层统一写响应。"""
 
         super().__init__(message)
         self.status = status
         self.message = message
+        self.error_type = error_type
+        self.headers = headers or {}
 
 
 class ClientDisconnected(Exception):
@@ -144,14 +416,37 @@ STATUS_REASON: dict[int, str] = {
     400: "Bad Request",
     404: "Not Found",
     405: "Method Not Allowed",
+    409: "Conflict",
     411: "Length Required",
     413: "Payload Too Large",
+    415: "Unsupported Media Type",
     431: "Request Header Fields Too Large",
     500: "Internal Server Error",
+    503: "Service Unavailable",
 }
 
 TASK_TRANSLATION: str = "translation"
 TASK_ANALYSIS: str = "analysis"
+TASK_SAKURA: str = "sakura"
+TASK_AUTO: str = "auto"
+# auto 模式按 system prompt 中的模板特征判定任务，未命中即视为翻译
+TASK_SYSTEM_MARKERS: tuple[tuple[str, str], ...] = (
+    ("你是一个轻小说翻译模型", TASK_SAKURA),
+    ("从内容文本中提取术语", TASK_ANALYSIS),
+    ("extract terms from the source text", TASK_ANALYSIS),
+    ('"dst":"<术语译文>"', TASK_ANALYSIS),
+    ('"dst":"<Translated Term>"', TASK_ANALYSIS),
+)
+TASK_SYSTEM_PROBE_CHARS: int = 64 * 1024
+TASK_CLASSIFIER_CACHE_SIZE: int = 1024
+SYSTEM_ROLES: tuple[str, ...] = ("system", "developer")
+# 与 WorkUnitPromptBuilder.generate_prompt_sakura 的两种固定提示词一致
+SAKURA_INPUT_PREFIXES: tuple[str, ...] = (
+    "将下面的日文文本翻译成中文：",
+    "将下面的日文文本根据对应关系和备注翻译成中文：",
+)
+# Sakura（Qwen 系分词）中文输出大约 1.5 字/token，用于按吐字速度计时
+SAKURA_CHARS_PER_TOKEN: float = 1.5
 ANALYSIS_EMPTY_RESULT: str = "<why>当前文本没有稳定术语</why>\n```jsonline\n\n```\n"
 ANALYSIS_INPUT_PREFIXES: tuple[str, ...] = ("输入：", "Input:")
 ANALYSIS_TERM_TYPES: tuple[str, ...] = (
@@ -169,6 +464,210 @@ ANALYSIS_LATIN_TERM_PATTERN: re.Pattern[str] = re.compile(r"[A-Za-z][A-Za-z0-9_-
 ANALYSIS_CJK_TERM_PATTERN: re.Pattern[str] = re.compile(
     r"[A-Za-z0-9\u3040-\u30ff\u4e00-\u9fff]{2,}"
 )
+CHAT_COMPLETIONS_PATHS: tuple[str, ...] = ("/v1/chat/completions", "/chat/completions")
+BATCH_ENDPOINTS: tuple[str, ...] = ("/v1/chat/completions",)
+BATCH_COMPLETION_WINDOWS: tuple[str, ...] = ("24h",)
+BATCH_INPUT_PURPOSE: str = "batch"
+BATCH_OUTPUT_PURPOSE: str = "batch_output"
+BATCH_MAX_REQUESTS: int = 50_000
+# 限速时每片请求覆盖的时长；片越小节奏越平滑，线程池切换越频繁
+BATCH_SLICE_S: float = 0.1
+BATCH_LIST_LIMIT: int = 20
+JSON_STRING_SPECIAL_PATTERN: re.Pattern[str] = re.compile(r'["\\]')
+JSON_STRING_RUN_PATTERN: re.Pattern[str] = re.compile(
+    r'(?:[^"\\]+|\\["\\/bfnrt]|\\u[0-9a-fA-F]{4})+'
+)
+JSON_PARTIAL_ESCAPE_PATTERN: re.Pattern[str] = re.compile(r"\\(?:u[0-9a-fA-F]{0,3})?")
+JSON_HIGH_SURROGATE_TAIL_PATTERN: re.Pattern[str] = re.compile(
+    r"\\u[dD][89abAB][0-9a-fA-F]{2}$"
+)
+JSON_LITERAL_PATTERN: re.Pattern[str] = re.compile(r"[-+0-9.eEa-z]+")
+SHED_REASON_CONNECTIONS: str = "connections"
+SHED_REASON_MEMORY: str = "memory"
+SHED_REASON_OFFLOAD: str = "offload_queue"
+# 预算占用超过该比例、或最近刚拒绝过请求时，/health 报告 overloaded
+OVERLOAD_BUDGET_RATIO: float = 0.9
+OVERLOAD_RECENT_SHED_S: float = 1.0
+TRACEPARENT_PATTERN: re.Pattern[str] = re.compile(
+    r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(?:-.*)?$"
+)
+OTLP_SPAN_KIND_INTERNAL: int = 1
+OTLP_SPAN_KIND_SERVER: int = 2
+OTLP_STATUS_OK: int = 1
+OTLP_STATUS_ERROR: int = 2
+OTLP_SCOPE_NAME: str = "mock_llm_api_server"
+TEXT_VOCABULARY_WORDS: dict[str, tuple[tuple[str, ...], str]] = {
+    "en": (
+        (
+            "amber",
+            "atlas",
+            "breeze",
+            "cascade",
+            "cipher",
+            "crystal",
+            "dawn",
+            "ember",
+            "fable",
+            "frost",
+            "harbor",
+            "hollow",
+            "horizon",
+            "ivy",
+            "jolt",
+            "kernel",
+            "lantern",
+            "lattice",
+            "lumen",
+            "marble",
+            "meadow",
+            "mosaic",
+            "nebula",
+            "needle",
+            "octave",
+            "oracle",
+            "pebble",
+            "prairie",
+            "quartz",
+            "ripple",
+            "saffron",
+            "sail",
+            "silk",
+            "sketch",
+            "solace",
+            "spark",
+            "tide",
+            "timber",
+            "velvet",
+            "whisper",
+            "witness",
+            "zenith",
+        ),
+        " ",
+    ),
+    "cjk": (
+        (
+            "琥珀",
+            "地图",
+            "微风",
+            "瀑布",
+            "密码",
+            "水晶",
+            "黎明",
+            "余烬",
+            "寓言",
+            "霜雪",
+            "港湾",
+            "空谷",
+            "地平线",
+            "常春藤",
+            "震动",
+            "核心",
+            "灯笼",
+            "格子",
+            "微光",
+            "大理石",
+            "草地",
+            "镶嵌",
+            "星云",
+            "针尖",
+            "八度",
+            "神谕",
+            "卵石",
+            "草原",
+            "石英",
+            "涟漪",
+            "藏红花",
+            "风帆",
+            "丝绸",
+            "素描",
+            "慰藉",
+            "火花",
+            "潮汐",
+            "木材",
+            "天鹅绒",
+            "低语",
+            "见证",
+            "顶点",
+            "的",
+            "了",
+            "在",
+        ),
+        "",
+    ),
+}
+VOCABULARY_LANGUAGE: dict[str, str] = {"en": "en", "cjk": "zh"}
+# 目标字符数 / 原文字符数，取常见游戏文本译文长度的经验值
+DEFAULT_EXPANSION_RATIOS: dict[str, float] = {
+    "ja-en": 2.2,
+    "zh-en": 2.8,
+    "ko-en": 2.0,
+    "en-en": 1.0,
+    "ja-zh": 0.8,
+    "ko-zh": 0.7,
+    "en-zh": 0.35,
+    "zh-zh": 1.0,
+}
+LANGUAGE_KANA_PATTERN: re.Pattern[str] = re.compile(r"[\u3040-\u30ff]")
+LANGUAGE_HANGUL_PATTERN: re.Pattern[str] = re.compile(r"[\uac00-\ud7af]")
+LANGUAGE_HAN_PATTERN: re.Pattern[str] = re.compile(r"[\u4e00-\u9fff]")
+REASONING_MODE_OFF: str = "off"
+REASONING_MODE_REQUEST: str = "request"
+REASONING_MODE_ALWAYS: str = "always"
+# 各档位的平均思考 token 数，实际值再乘 --reasoning-scale 并加 ±20% 波动
+REASONING_EFFORT_TOKENS: dict[str, int] = {
+    "none": 0,
+    "minimal": 64,
+    "low": 256,
+    "medium": 1024,
+    "high": 4096,
+    "xhigh": 8192,
+}
+REASONING_DELTA_CHARS: int = 64
+TOOL_ARGUMENT_DELTA_CHARS: int = 16
+TIMER_WHEEL_SLOTS: int = 1024
+# 关闭时断开连接后等连接任务自行收尾的上限，超时的再取消
+SHUTDOWN_GRACE_S: float = 2.0
+# 请求体与响应都只支持 zlib 系编码；br/zstd 需要第三方库
+CONTENT_ENCODINGS: tuple[str, ...] = ("gzip", "deflate")
+CONTENT_ENCODING_ALIASES: dict[str, str] = {"x-gzip": "gzip"}
+FAULT_UNTRANSLATED: str = "untranslated"
+FAULT_SOURCE_RESIDUE: str = "source_residue"
+FAULT_REPETITION: str = "repetition"
+FAULT_SWAPPED_KEYS: str = "swapped_keys"
+FAULT_MISSING_LINE: str = "missing_line"
+FAULT_EXTRA_LINE: str = "extra_line"
+# 按此顺序施加：先做依赖原文逐行对齐的改写，最后再增删行
+CONTENT_FAULT_MODES: tuple[str, ...] = (
+    FAULT_UNTRANSLATED,
+    FAULT_SOURCE_RESIDUE,
+    FAULT_REPETITION,
+    FAULT_SWAPPED_KEYS,
+    FAULT_MISSING_LINE,
+    FAULT_EXTRA_LINE,
+)
+# 客户端退化检测连续 50 次重复即判定，这里留足余量保证必然触发
+FAULT_REPETITION_UNIT: str = "啊"
+FAULT_REPETITION_CHARS: int = 200
+FAULT_SOURCE_RESIDUE_CHARS: int = 4
+FRAGMENT_BYTE: str = "byte"
+FRAGMENT_UTF8: str = "utf8"
+FRAGMENT_JSON_STRING: str = "json_string"
+FRAGMENT_RANDOM: str = "random"
+# 按此顺序抽签，越激进的模式越靠前，一条消息只采用第一个命中的模式
+SSE_FRAGMENT_MODES: tuple[str, ...] = (
+    FRAGMENT_BYTE,
+    FRAGMENT_UTF8,
+    FRAGMENT_JSON_STRING,
+    FRAGMENT_RANDOM,
+)
+SSE_FRAGMENT_MAX_SPLITS: int = 4
+CORPUS_INDEX_MAGIC: bytes = b"LGCORPX1"
+CORPUS_INDEX_HEADER: struct.Struct = struct.Struct("=8sQQQ")
+CORPUS_NEAREST_WINDOW: int = 8
+# 连接任务各自持有的请求轨迹；慢回调归因、访问日志和 Server-Timing 共用
+REQUEST_TRACE: contextvars.ContextVar[RequestTrace | None] = contextvars.ContextVar(
+    "request_trace", default=None
+)
 
 
 def build_openai_error(
@@ -186,348 +685,2801 @@ def build_openai_error(
     }
 
 
-def normalize_header_name(name: str) -> str:
-    """HTTP header 名称统一转小写，便于后续字典读取。"""
+class ServerState:
+    """进程内共享的准入状态与计数器。
 
-    return name.strip().lower()
+    只在事件循环线程里读写，因此不加锁。预算覆盖在途请求体与待写响应，
+    超限时新请求直接 503，而不是继续排队把内存撑爆。
+    """
 
+    def __init__(self, config: MockServerConfig) -> None:
+        """按配置初始化连接上限、字节预算和计数器。"""
+
+        self.config = config
+        self.active_connections = 0
+        self.peak_connections = 0
+        self.total_connections = 0
+        self.total_requests = 0
+        self.budget_in_use = 0
+        self.budget_peak = 0
+        self.shed_counts: dict[str, int] = {
+            SHED_REASON_CONNECTIONS: 0,
+            SHED_REASON_MEMORY: 0,
+            SHED_REASON_OFFLOAD: 0,
+        }
+        self.last_shed_at = float("-inf")
+        # 弱引用集合：连接正常释放后自动消失，残留数量即潜在泄漏
+        self.live_writers: weakref.WeakSet[asyncio.StreamWriter] = weakref.WeakSet()
+        self.connection_tasks: weakref.WeakSet[asyncio.Task[Any]] = weakref.WeakSet()
+        self.soak: SoakMonitor | None = None
+        self.slow_callbacks: dict[str, dict[str, float]] = {}
+        self.access_log: BackgroundJsonlWriter | None = None
+        self.span_exporter: BackgroundJsonlWriter | None = None
+        self.corpus: ResponseCorpus | None = None
+        self.timer: TimingWheel | None = None
+        self.offload: OffloadPool | None = None
+        self.batches = BatchService(self)
+        self.task_classifier = TaskClassifier() if config.task == TASK_AUTO else None
+        self.prefix_cache = (
+            PrefixCache(
+                max_tokens=config.prefix_cache_tokens,
+                ttl_s=config.prefix_cache_ttl_s,
+                min_tokens=config.prefix_cache_min_tokens,
+            )
+            if config.prefix_cache_tokens > 0
+            else None
+        )
+        self.task_stats: dict[str, dict[str, int]] = {}
+        # 客户端在响应完成前离开的请求，按首字节前/流式中途区分
+        self.abandoned_counts: dict[str, int] = {
+            "before_first_byte": 0,
+            "mid_stream": 0,
+        }
+        self.compression: dict[str, dict[str, dict[str, float]]] = {
+            "request": {},
+            "response": {},
+        }
+        self.fault_counts: dict[str, int] = {
+            mode: 0 for mode, _ in config.content_faults
+        }
+        self.fragment_counts: dict[str, dict[str, int]] = {
+            mode: {"messages": 0, "extra_writes": 0} for mode, _ in config.sse_fragments
+        }
 
-def pick_user_prompt_text(messages: Any) -> str:
-    """从 messages 中取最后一个 user 文本，兼容缺失 role 的旧请求。"""
+    def close(self) -> None:
+        """停止后台写线程并释放语料映射。"""
+
+        if self.access_log is not None:
+            self.access_log.close()
+        if self.span_exporter is not None:
+            self.span_exporter.close()
+        if self.corpus is not None:
+            self.corpus.close()
+        if self.offload is not None:
+            self.offload.close()
+        self.batches.close()
+
+    def connection_opened(self) -> bool:
+        """登记新连接，返回是否仍在连接上限之内。"""
+
+        self.active_connections += 1
+        self.total_connections += 1
+        self.peak_connections = max(self.peak_connections, self.active_connections)
+        limit = self.config.max_connections
+        return limit <= 0 or self.active_connections <= limit
+
+    def connection_closed(self) -> None:
+        """连接结束时归还连接计数。"""
+
+        self.active_connections -= 1
+
+    def try_reserve(self, size: int) -> bool:
+        """尝试占用预算；未配置预算（<=0）时总是成功。"""
+
+        limit = self.config.memory_budget_bytes
+        if limit > 0 and self.budget_in_use + size > limit:
+            return False
+        self.budget_in_use += size
+        self.budget_peak = max(self.budget_peak, self.budget_in_use)
+        return True
 
-    if not isinstance(messages, list):
-        return ""
+    def release(self, size: int) -> None:
+        """归还预算。"""
 
-    for msg in reversed(messages):
-        if not isinstance(msg, dict):
-            continue
-        if msg.get("role") != "user":
-            continue
-        return coerce_message_text(msg.get("content"))
+        self.budget_in_use -= size
 
-    if messages and isinstance(messages[-1], dict):
-        return coerce_message_text(messages[-1].get("content"))
-    return ""
+    def record_shed(self, reason: str) -> HttpError:
+        """记录一次削峰拒绝，并返回带 Retry-After 的 503 错误。"""
 
+        self.shed_counts[reason] = self.shed_counts.get(reason, 0) + 1
+        self.last_shed_at = time.monotonic()
+        return HttpError(
+            503,
+            f"Server overloaded ({reason}), retry later",
+            error_type="server_error",
+            headers={"Retry-After": str(self.config.retry_after_s)},
+        )
 
-def coerce_message_text(content: Any) -> str:
-    """把 OpenAI 字符串或多段 text content 收敛成单个文本。"""
+    def is_overloaded(self) -> bool:
+        """连接打满、预算接近上限或刚刚发生过削峰时视为过载。"""
 
-    if isinstance(content, str):
-        return content
+        max_connections = self.config.max_connections
+        if max_connections > 0 and self.active_connections >= max_connections:
+            return True
+        budget = self.config.memory_budget_bytes
+        if budget > 0 and self.budget_in_use >= budget * OVERLOAD_BUDGET_RATIO:
+            return True
+        return time.monotonic() - self.last_shed_at < OVERLOAD_RECENT_SHED_S
 
-    # 兼容 OpenAI 的多段 content（如 [{"type":"text","text":"..."}]）
-    if isinstance(content, list):
-        parts: list[str] = []
-        for part in content:
-            if not isinstance(part, dict):
-                continue
-            if part.get("type") != "text":
-                continue
-            text = part.get("text")
-            if isinstance(text, str) and text:
-                parts.append(text)
-        return "".join(parts)
+    def snapshot(self) -> dict[str, Any]:
+        """导出 /health 使用的状态快照。"""
 
-    return str(content) if content is not None else ""
+        return {
+            "status": "overloaded" if self.is_overloaded() else "ok",
+            "connections": {
+                "active": self.active_connections,
+                "peak": self.peak_connections,
+                "total": self.total_connections,
+                "limit": self.config.max_connections,
+            },
+            "memory_budget": {
+                "in_use_bytes": self.budget_in_use,
+                "peak_bytes": self.budget_peak,
+                "limit_bytes": self.config.memory_budget_bytes,
+            },
+            "requests_total": self.total_requests,
+            "abandoned": dict(self.abandoned_counts),
+            "shed": dict(self.shed_counts),
+            "slow_callbacks": {
+                phase: dict(stats) for phase, stats in self.slow_callbacks.items()
+            },
+            **({"corpus": self.corpus.stats()} if self.corpus is not None else {}),
+            **({"timer_wheel": self.timer.stats()} if self.timer is not None else {}),
+            **({"offload": self.offload.stats()} if self.offload is not None else {}),
+            "tasks": {task: dict(stats) for task, stats in self.task_stats.items()},
+            "content_faults": dict(self.fault_counts),
+            "batches": self.batches.stats(),
+            "sse_fragments": {
+                mode: dict(stats) for mode, stats in self.fragment_counts.items()
+            },
+            "compression": {
+                direction: {
+                    encoding: {
+                        **stats,
+                        "ratio": round(stats["raw_bytes"] / stats["encoded_bytes"], 3)
+                        if stats["encoded_bytes"]
+                        else None,
+                        "cpu_ms": round(stats["cpu_ms"], 3),
+                    }
+                    for encoding, stats in by_encoding.items()
+                }
+                for direction, by_encoding in self.compression.items()
+            },
+            **(
+                {"task_classifier": self.task_classifier.stats()}
+                if self.task_classifier is not None
+                else {}
+            ),
+            **(
+                {"prefix_cache": self.prefix_cache.stats()}
+                if self.prefix_cache is not None
+                else {}
+            ),
+        }
 
+    def record_compression(self, trace: RequestTrace) -> None:
+        """按方向和编码累计原始/压缩字节与编解码 CPU，用来判断压缩是否划算。"""
 
-def extract_jsonline_block(text: str) -> str:
-    """提取最后一个 ```jsonline 代码块的内容。
+        for direction, encoding, raw_bytes, encoded_bytes, cpu_s in (
+            (
+                "request",
+                trace.request_encoding,
+                trace.body_bytes,
+                trace.bytes_in,
+                trace.request_codec_cpu_s,
+            ),
+            (
+                "response",
+                trace.response_encoding,
+                trace.response_raw_bytes,
+                trace.response_encoded_bytes,
+                trace.response_codec_cpu_s,
+            ),
+        ):
+            if encoding is None:
+                continue
+            stats = self.compression[direction].setdefault(
+                encoding,
+                {"count": 0, "raw_bytes": 0, "encoded_bytes": 0, "cpu_ms": 0.0},
+            )
+            stats["count"] += 1
+            stats["raw_bytes"] += raw_bytes
+            stats["encoded_bytes"] += encoded_bytes
+            stats["cpu_ms"] += cpu_s * 1000.0
+
+    def record_task(self, trace: RequestTrace) -> None:
+        """按任务累计请求数、失败数、行数和 token，auto 模式下用于区分混合负载。"""
+
+        for fault in trace.content_faults:
+            self.fault_counts[fault] = self.fault_counts.get(fault, 0) + 1
+        for mode, (messages, extra_writes) in trace.sse_fragments.items():
+            stats = self.fragment_counts.setdefault(
+                mode, {"messages": 0, "extra_writes": 0}
+            )
+            stats["messages"] += messages
+            stats["extra_writes"] += extra_writes
+        if trace.task is None:
+            return
+        stats = self.task_stats.setdefault(
+            trace.task,
+            {
+                "requests": 0,
+                "errors": 0,
+                "lines": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+            },
+        )
+        stats["requests"] += 1
+        if trace.status != 200 or trace.disconnect_reason != "complete":
+            stats["errors"] += 1
+        stats["lines"] += trace.line_count or 0
+        stats["prompt_tokens"] += trace.prompt_tokens or 0
+        stats["completion_tokens"] += trace.completion_tokens or 0
 
-    为什么取最后一个：提示词里通常包含“输出格式示例”的 jsonline 代码块，
-    真正的输入 JSONLINE 一般附在最后。
-    """
 
-    lines = text.splitlines()
-    blocks: list[tuple[str, list[str]]] = []
+class TaskClassifier:
+    """auto 模式的任务分类器，按 system prompt 哈希缓存结果。
 
-    in_block = False
-    current_lang = ""
-    current_lines: list[str] = []
+    同一作业的 system prompt 基本不变，命中缓存后每个请求只多一次哈希；
+    没有 system prompt 的请求按用户正文的提取结果判定，不进缓存。
+    卸载线程池和 batch 线程也会调用，查找、淘汰与计数都在锁内完成。
+    """
 
-    for line in lines:
-        stripped = line.strip()
-        if stripped.startswith("```"):
-            if not in_block:
-                current_lang = stripped[3:].strip().lower()
-                current_lines = []
-                in_block = True
-                continue
+    def __init__(self, max_entries: int = TASK_CLASSIFIER_CACHE_SIZE) -> None:
+        """初始化 LRU 缓存与命中计数。"""
+
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.cache: collections.OrderedDict[bytes, str] = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def classify(self, system_digest: bytes, system_probe: str) -> str:
+        """返回 system prompt 对应的任务，未缓存时扫描模板特征。"""
+
+        with self.lock:
+            task = self.cache.get(system_digest)
+            if task is not None:
+                self.cache.move_to_end(system_digest)
+                self.hits += 1
+                return task
+            self.misses += 1
+
+        # 扫描模板特征不需要持锁；并发未命中同一摘要时结果相同，重复写入无害
+        task = TASK_TRANSLATION
+        for marker, marker_task in TASK_SYSTEM_MARKERS:
+            if marker in system_probe:
+                task = marker_task
+                break
+        with self.lock:
+            self.cache[system_digest] = task
+            self.cache.move_to_end(system_digest)
+            if len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+        return task
+
+    def stats(self) -> dict[str, int]:
+        """导出 /health 使用的缓存统计。"""
+
+        with self.lock:
+            return {
+                "entries": len(self.cache),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
 
-            blocks.append((current_lang, current_lines))
-            in_block = False
-            current_lang = ""
-            current_lines = []
-            continue
 
-        if in_block:
-            current_lines.append(line)
+class PrefixCache:
+    """按消息前缀摘要缓存的 prompt 前缀，模拟服务端 KV cache 的命中、TTL 与淘汰。
 
-    for lang, payload_lines in reversed(blocks):
-        if lang.startswith("jsonline") or lang.startswith("jsonl"):
-            return "\n".join(payload_lines)
+    每个消息边界一条记录，按 token 数计入预算；嵌套前缀各自计费，比共享 KV 块的真实实现偏保守。
+    生成可能在工作线程或 batch 线程里执行，读写都在锁内完成。
+    """
 
-    return ""
+    def __init__(self, *, max_tokens: int, ttl_s: float, min_tokens: int) -> None:
+        """初始化 LRU 表、预算与命中计数。"""
 
+        self.max_tokens = max_tokens
+        self.ttl_s = ttl_s
+        self.min_tokens = min_tokens
+        self.lock = threading.Lock()
+        # (模型, 前缀摘要) -> (token 数, 最近使用时刻)，最久未用的在前
+        self.entries: collections.OrderedDict[tuple[str, bytes], tuple[int, float]] = (
+            collections.OrderedDict()
+        )
+        self.tokens = 0
+        self.hits = 0
+        self.misses = 0
+        self.cached_tokens = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def admit(self, model: str, chain: tuple[tuple[bytes, int], ...]) -> int:
+        """返回命中的最长前缀 token 数，并把本请求的各级前缀写入缓存。"""
+
+        now = time.monotonic()
+        with self.lock:
+            self.expire(now)
+            cached = 0
+            for digest, tokens in reversed(chain):
+                # 累计 token 单调不减，更短的前缀也不会够门槛
+                if tokens < self.min_tokens:
+                    break
+                if (model, digest) in self.entries:
+                    cached = tokens
+                    break
+            if cached:
+                self.hits += 1
+                self.cached_tokens += cached
+            else:
+                self.misses += 1
+
+            # 从长到短写入，最常被共享的短前缀最后触碰，淘汰时排在最后
+            for digest, tokens in reversed(chain):
+                if tokens < self.min_tokens or tokens > self.max_tokens:
+                    continue
+                key = (model, digest)
+                previous = self.entries.pop(key, None)
+                if previous is not None:
+                    self.tokens -= previous[0]
+                self.entries[key] = (tokens, now)
+                self.tokens += tokens
+            while self.tokens > self.max_tokens:
+                _, (tokens, _) = self.entries.popitem(last=False)
+                self.tokens -= tokens
+                self.evictions += 1
+        return cached
+
+    def expire(self, now: float) -> None:
+        """从最久未用的一端清掉空闲超过 TTL 的前缀；调用方持锁。"""
+
+        if self.ttl_s <= 0:
+            return
+        while self.entries:
+            key, (tokens, used_at) = next(iter(self.entries.items()))
+            if now - used_at < self.ttl_s:
+                return
+            del self.entries[key]
+            self.tokens -= tokens
+            self.expirations += 1
+
+    def stats(self) -> dict[str, int]:
+        """导出 /health 使用的缓存统计。"""
+
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "tokens": self.tokens,
+                "hits": self.hits,
+                "misses": self.misses,
+                "cached_tokens": self.cached_tokens,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
 
-def parse_jsonline_entries(jsonline_payload: str) -> list[TranslationRequestEntry]:
-    """解析单键 JSONLINE 输入，坏行直接跳过以模拟宽容模型服务。"""
 
-    entries: list[TranslationRequestEntry] = []
-    for raw_line in jsonline_payload.splitlines():
-        line = raw_line.strip()
-        if not line:
-            continue
-        try:
-            obj = json.loads(line)
-        except Exception:
-            continue
-        if isinstance(obj, dict) and len(obj) == 1:
-            key, value = next(iter(obj.items()))
-            entries.append(TranslationRequestEntry(key=str(key), value=value))
-    return entries
+def seal_prefix_message(prefix: Any, role: Any) -> bytes:
+    """消息正文喂进前缀摘要后补上 role 与分隔符，返回截至本条消息的前缀摘要。"""
 
+    prefix.update(b"\x00" + str(role).encode("utf-8", "surrogatepass") + b"\x1e")
+    return prefix.copy().digest()
 
-def extract_analysis_input_text(text: str) -> str:
-    """提取分析任务的输入正文。
 
-    为什么用最后一个前缀：
-    - system/user 拼接后的提示词里可能多次出现 “输入：/Input:”
-    - 真正的任务正文通常在最后一个标记之后
-    """
+def build_prefix_chain(messages: Any) -> tuple[tuple[bytes, int], ...]:
+    """缓冲路径：逐条消息累计前缀摘要与 token 数，口径与 ChatBodyScanner 一致。"""
 
-    last_index = -1
-    selected_prefix = ""
-    for prefix in ANALYSIS_INPUT_PREFIXES:
-        current_index = text.rfind(prefix)
-        if current_index > last_index:
-            last_index = current_index
-            selected_prefix = prefix
+    prefix = hashlib.blake2b(digest_size=16)
+    chars = 0
+    chain: list[tuple[bytes, int]] = []
+    for message in messages if isinstance(messages, list) else []:
+        if not isinstance(message, dict):
+            continue
+        text = coerce_message_text(message.get("content"))
+        prefix.update(text.encode("utf-8", "surrogatepass"))
+        chars += len(text)
+        chain.append((seal_prefix_message(prefix, message.get("role")), chars // 4))
+    return tuple(chain)
 
-    if last_index < 0:
-        return text.strip()
 
-    payload = text[last_index + len(selected_prefix) :]
-    return payload.lstrip("\r\n").strip()
+def classify_user_prompt(
+    has_jsonline: bool, has_sakura_marker: bool, has_analysis_marker: bool
+) -> str:
+    """没有 system prompt 时按用户正文里的结构判定任务。"""
 
+    if has_jsonline:
+        return TASK_TRANSLATION
+    if has_sakura_marker:
+        return TASK_SAKURA
+    if has_analysis_marker:
+        return TASK_ANALYSIS
+    return TASK_TRANSLATION
 
-def parse_analysis_input_lines(text: str) -> list[str]:
-    """按行规整分析输入，避免空白和代码块标记污染 mock 结果。"""
 
-    payload = extract_analysis_input_text(text)
-    normalized_lines: list[str] = []
-    for raw_line in payload.splitlines():
-        line = raw_line.strip()
-        if line == "":
-            continue
-        if line.startswith("```"):
-            continue
-        normalized_lines.append(line)
-    return normalized_lines
+def digest_system_texts(digests: list[bytes]) -> bytes:
+    """把各条 system 消息的摘要合成一个缓存键，缓冲与流式路径口径一致。"""
 
+    return hashlib.blake2b(b"".join(digests), digest_size=16).digest()
 
-def generate_random_text(
-    rng: random.Random, *, min_words: int = 4, max_words: int = 10
-) -> str:
-    """生成稳定词表内的随机译文，供压测时制造非空输出。"""
 
-    vocabulary = [
-        "amber",
-        "atlas",
-        "breeze",
-        "cascade",
-        "cipher",
-        "crystal",
-        "dawn",
-        "ember",
-        "fable",
-        "frost",
-        "harbor",
-        "hollow",
-        "horizon",
-        "ivy",
-        "jolt",
-        "kernel",
-        "lantern",
-        "lattice",
-        "lumen",
-        "marble",
-        "meadow",
-        "mosaic",
-        "nebula",
-        "needle",
-        "octave",
-        "oracle",
-        "pebble",
-        "prairie",
-        "quartz",
-        "ripple",
-        "saffron",
-        "sail",
-        "silk",
-        "sketch",
-        "solace",
-        "spark",
-        "tide",
-        "timber",
-        "velvet",
-        "whisper",
-        "witness",
-        "zenith",
-    ]
+class TimingWheel:
+    """哈希时间轮：流式间隔等待按 tick 归桶，每个 tick 一次性唤醒所有到期的流。
 
-    word_count = rng.randint(min_words, max_words)
-    return " ".join(rng.choice(vocabulary) for _ in range(word_count))
+    asyncio.sleep 为每次等待各建一个 TimerHandle 并进出一次定时器堆，
+    上千路流 × 几十个 chunk 时堆操作和零散唤醒会占满事件循环；
+    这里整轮只挂一个 loop 定时器，且只在有等待者时才跳动。
+    到期时间向上取整到 tick，精度损失不超过 tick_s。
+    """
 
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        tick_s: float,
+        slot_count: int = TIMER_WHEEL_SLOTS,
+    ) -> None:
+        """以当前时刻为第 0 个 tick 初始化空轮。"""
+
+        self.loop = loop
+        self.tick_s = tick_s
+        self.origin = loop.time()
+        # 槽位 = 到期 tick % 槽数；同一槽里不同圈的等待者按到期 tick 区分
+        self.slots: list[dict[int, list[asyncio.Future[None]]]] = [
+            {} for _ in range(slot_count)
+        ]
+        self.last_tick = 0
+        self.pending = 0
+        self.handle: asyncio.TimerHandle | None = None
+        self.next_tick: int | None = None
+        self.ticks = 0
+        self.wakeups = 0
+        self.max_batch = 0
+
+    def sleep(self, delay_s: float) -> asyncio.Future[None]:
+        """返回一个在 delay_s 后（向上取整到 tick）完成的 future。"""
+
+        due = math.ceil((self.loop.time() + delay_s - self.origin) / self.tick_s)
+        due = max(due, self.last_tick + 1)
+        future: asyncio.Future[None] = self.loop.create_future()
+        self.slots[due % len(self.slots)].setdefault(due, []).append(future)
+        self.pending += 1
+        if self.next_tick is None or due < self.next_tick:
+            self.schedule(due)
+        return future
+
+    def schedule(self, tick: int) -> None:
+        """把唯一的 loop 定时器挪到指定 tick。"""
+
+        if self.handle is not None:
+            self.handle.cancel()
+        self.next_tick = tick
+        self.handle = self.loop.call_at(self.origin + tick * self.tick_s, self.advance)
+
+    def advance(self) -> None:
+        """推进到当前 tick，唤醒途经各槽中已到期的等待者。"""
+
+        self.handle = None
+        self.next_tick = None
+        now_tick = int((self.loop.time() - self.origin) / self.tick_s)
+        if now_tick <= self.last_tick:
+            now_tick = self.last_tick + 1
+        # 事件循环卡顿超过一整圈时，每个槽只需扫一遍
+        span = min(now_tick - self.last_tick, len(self.slots))
+        batch = 0
+        for tick in range(now_tick - span + 1, now_tick + 1):
+            slot = self.slots[tick % len(self.slots)]
+            for due in [due for due in slot if due <= now_tick]:
+                for future in slot.pop(due):
+                    # 等待方已取消（客户端断开）时 future 已完成，直接跳过
+                    if not future.done():
+                        future.set_result(None)
+                    batch += 1
+        self.last_tick = now_tick
+        self.pending -= batch
+        self.ticks += 1
+        self.wakeups += batch
+        self.max_batch = max(self.max_batch, batch)
+        if self.pending > 0:
+            self.schedule(now_tick + 1)
+
+    def stats(self) -> dict[str, Any]:
+        """导出 /health 使用的计数。"""
 
-def choose_analysis_term_type(src_text: str) -> str:
-    """分析术语类型按文本哈希稳定映射，保证相同输入可复现。"""
+        return {
+            "tick_ms": round(self.tick_s * 1000.0, 3),
+            "pending": self.pending,
+            "ticks": self.ticks,
+            "wakeups": self.wakeups,
+            "max_batch": self.max_batch,
+        }
 
-    digest = hashlib.blake2b(src_text.encode("utf-8"), digest_size=2).digest()
-    index = int.from_bytes(digest, byteorder="big", signed=False)
-    return ANALYSIS_TERM_TYPES[index % len(ANALYSIS_TERM_TYPES)]
 
+async def pause(delay_s: float, timer: TimingWheel | None = None) -> None:
+    """响应路径上的等待：配置了时间轮时走时间轮，否则退回 asyncio.sleep。
 
-def extract_analysis_term_source(line: str) -> str | None:
-    """从原文行中取第一个较长连续词段，模拟术语抽取结果。"""
+    零等待不进时间轮：轮子至少推到下一个 tick，会给无抖动压测平白加上一个 tick 的延迟。
+    """
 
-    for pattern in (ANALYSIS_LATIN_TERM_PATTERN, ANALYSIS_CJK_TERM_PATTERN):
-        match = pattern.search(line)
-        if match is None:
-            continue
+    if timer is None or delay_s <= 0:
+        await asyncio.sleep(max(0.0, delay_s))
+    else:
+        await timer.sleep(delay_s)
 
-        candidate = match.group(0).strip("【】「」『』（）()[]<>")
-        if len(candidate) < 2:
-            continue
-        if len(candidate) > 6:
-            candidate = candidate[:6]
-        if candidate.isdigit():
-            continue
-        return candidate
 
-    return None
+class OffloadPool:
+    """大请求的解析与生成交给线程池，小请求仍在事件循环里直接处理。
 
+    几 MB 的 json.loads 或上千行 JSONLINE 拼接会整段占住事件循环，
+    其他连接的 SSE 节奏和首字节时间都被拖偏；放到工作线程后，事件循环线程
+    每个 GIL 切换间隔都能拿回执行权。用线程而不是进程：语料 mmap 与任务分类缓存
+    在进程内共享，跨进程需要序列化。排队加执行中的任务数有上限，排满按削峰返回 503。
+    计数只在事件循环线程里更新。
+    """
 
-def build_analysis_term_target(src_text: str, rng: random.Random) -> str:
-    """目标术语需要稳定且与原文不同，避免被分析链路当作无效同形词。"""
+    def __init__(
+        self, state: ServerState, *, workers: int, max_queue: int, threshold_bytes: int
+    ) -> None:
+        """创建线程池与计数器。"""
+
+        self.state = state
+        self.workers = workers
+        self.max_queue = max_queue
+        self.threshold_bytes = threshold_bytes
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="mock-llm-offload"
+        )
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.offloaded = 0
+        self.inline = 0
+        self.wait_s_total = 0.0
+        self.run_s_total = 0.0
+        self.max_run_s = 0.0
+
+    def should_offload(self, size: int) -> bool:
+        """请求字节数达到阈值时走线程池；阈值为负表示关闭。"""
+
+        return 0 <= self.threshold_bytes <= size
+
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """在线程池里执行 func，沿用当前请求的 contextvars。"""
+
+        if self.in_flight >= self.workers + self.max_queue:
+            raise self.state.record_shed(SHED_REASON_OFFLOAD)
+
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        submitted = time.monotonic()
+        timings: list[float] = []
+
+        def call() -> Any:
+            started = time.monotonic()
+            try:
+                return context.run(func, *args, **kwargs)
+            finally:
+                timings.extend((started, time.monotonic()))
+
+        def finished(_: concurrent.futures.Future[Any]) -> None:
+            # 客户端断开时等待方会被取消，但线程里的任务仍在跑，按实际结束时间释放名额
+            loop.call_soon_threadsafe(self.record_done, submitted, timings)
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        self.offloaded += 1
+        future = self.executor.submit(call)
+        future.add_done_callback(finished)
+        return await asyncio.wrap_future(future)
+
+    def record_done(self, submitted: float, timings: list[float]) -> None:
+        """在事件循环线程里归还名额并累计排队/执行耗时。"""
+
+        self.in_flight -= 1
+        if len(timings) == 2:
+            started, ended = timings
+            self.wait_s_total += started - submitted
+            self.run_s_total += ended - started
+            self.max_run_s = max(self.max_run_s, ended - started)
+
+    def stats(self) -> dict[str, Any]:
+        """导出 /health 使用的计数。"""
 
-    if src_text.isascii():
-        return "Mock-" + src_text.title()
-    return "译" + src_text + "-" + rng.choice(("A", "B", "C"))
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "threshold_bytes": self.threshold_bytes,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "offloaded": self.offloaded,
+            "inline": self.inline,
+            "rejected": self.state.shed_counts.get(SHED_REASON_OFFLOAD, 0),
+            "wait_s_total": round(self.wait_s_total, 6),
+            "run_s_total": round(self.run_s_total, 6),
+            "max_run_s": round(self.max_run_s, 6),
+        }
 
+    def close(self) -> None:
+        """停止线程池，不等待已取消请求残留的任务。"""
 
-def build_translation_actor_target(actor: Any) -> str | list[str] | None:
-    """按 actor/text 协议生成姓名译文，保留空数组槽位语义。"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
-    if isinstance(actor, str):
-        actor = actor.strip()
-        return None if not actor else "译名-" + actor
-    if isinstance(actor, list):
-        names = [
-            "译名-" + item.strip() if item.strip() else ""
-            for item in actor
-            if isinstance(item, str)
-        ]
-        return names if any(names) else None
-    return None
 
+@dataclass(frozen=True)
+class StoredFile:
+    """/v1/files 保存的一个文件；内容整体放在内存里。"""
 
-def build_translation_response_value(value: Any, rng: random.Random) -> Any:
-    """根据输入 value 形状生成同构翻译响应。"""
+    id: str
+    filename: str
+    purpose: str
+    created_at: int
+    content: bytes
+
+    def to_json(self) -> dict[str, Any]:
+        """OpenAI File 对象。"""
 
-    if isinstance(value, dict) and "actor" in value and "text" in value:
         return {
-            "actor": build_translation_actor_target(value.get("actor")),
-            "text": generate_random_text(rng),
+            "id": self.id,
+            "object": "file",
+            "bytes": len(self.content),
+            "created_at": self.created_at,
+            "filename": self.filename,
+            "purpose": self.purpose,
+            "status": "processed",
+            "status_details": None,
         }
-    return generate_random_text(rng)
-
-
-def build_jsonline_response(
-    entries: list[TranslationRequestEntry], rng: random.Random
-) -> str:
-    """把翻译条目写成 fenced JSONLINE 响应。"""
 
-    lines: list[str] = ["```jsonline"]
-    for entry in entries:
-        value = build_translation_response_value(entry.value, rng)
-        lines.append(
-            json.dumps({entry.key: value}, ensure_ascii=False, separators=(",", ":"))
-        )
-    lines.append("```")
-    return "\n".join(lines) + "\n"
 
+@dataclass(frozen=True)
+class BatchLine:
+    """batch 输入文件中校验通过的一行请求。"""
+
+    custom_id: str
+    body: dict[str, Any]
+
+
+class BatchJob:
+    """一个 batch 的状态；只在事件循环线程里修改。"""
+
+    def __init__(
+        self,
+        *,
+        input_file_id: str,
+        endpoint: str,
+        completion_window: str,
+        metadata: dict[str, str] | None,
+    ) -> None:
+        """创建处于 validating 状态的 batch。"""
+
+        self.id = f"batch_{uuid.uuid4().hex[:24]}"
+        self.input_file_id = input_file_id
+        self.endpoint = endpoint
+        self.completion_window = completion_window
+        self.metadata = metadata
+        self.status = "validating"
+        self.created_at = int(time.time())
+        self.created_mono = time.monotonic()
+        self.timestamps: dict[str, int] = {}
+        self.total = 0
+        self.completed = 0
+        self.failed = 0
+        self.errors: list[dict[str, Any]] = []
+        self.output_file_id: str | None = None
+        self.error_file_id: str | None = None
+        self.cancel_requested = False
+
+    def advance(self, status: str) -> None:
+        """切换状态并记下对应的 *_at 时间戳。"""
 
-def resolve_translation_response_entries(
-    request_text: str,
-) -> list[TranslationRequestEntry]:
-    """翻译模式统一解析输入 key/value，避免流式与非流式逻辑各维护一份。"""
+        self.status = status
+        self.timestamps[f"{status}_at"] = int(time.time())
 
-    jsonline_payload = extract_jsonline_block(request_text)
-    entries = parse_jsonline_entries(jsonline_payload)
-    if not entries:
-        non_empty_lines = [v for v in jsonline_payload.splitlines() if v.strip()]
-        if non_empty_lines:
-            entries = [
-                TranslationRequestEntry(key=str(i), value=line)
-                for i, line in enumerate(non_empty_lines)
-            ]
-        else:
-            # 兜底：没有解析到输入 JSONLINE 时，仍然返回 1 行，避免调用方卡死
-            entries = [TranslationRequestEntry(key="0", value="")]
+    def to_json(self) -> dict[str, Any]:
+        """OpenAI Batch 对象。"""
 
-    return entries
+        return {
+            "id": self.id,
+            "object": "batch",
+            "endpoint": self.endpoint,
+            "errors": {"object": "list", "data": self.errors} if self.errors else None,
+            "input_file_id": self.input_file_id,
+            "completion_window": self.completion_window,
+            "status": self.status,
+            "output_file_id": self.output_file_id,
+            "error_file_id": self.error_file_id,
+            "created_at": self.created_at,
+            "in_progress_at": self.timestamps.get("in_progress_at"),
+            "expires_at": self.created_at + 24 * 3600,
+            "finalizing_at": self.timestamps.get("finalizing_at"),
+            "completed_at": self.timestamps.get("completed_at"),
+            "failed_at": self.timestamps.get("failed_at"),
+            "expired_at": None,
+            "cancelling_at": self.timestamps.get("cancelling_at"),
+            "cancelled_at": self.timestamps.get("cancelled_at"),
+            "request_counts": {
+                "total": self.total,
+                "completed": self.completed,
+                "failed": self.failed,
+            },
+            "metadata": self.metadata,
+        }
 
 
-def build_translation_response_content(request_text: str, rng: random.Random) -> str:
-    """翻译模式继续沿用按输入 key 数量回填随机 JSONLINE 的旧语义。"""
+def parse_batch_input(
+    content: bytes, endpoint: str
+) -> tuple[list[BatchLine], list[dict[str, Any]]]:
+    """校验 batch 输入 JSONL；任何一行不合法时整批失败，错误带 1 起始的行号。"""
 
-    entries = resolve_translation_response_entries(request_text)
-    return build_jsonline_response(entries, rng)
+    lines: list[BatchLine] = []
+    errors: list[dict[str, Any]] = []
+    seen: set[str] = set()
+
+    def fail(line_no: int, code: str, message: str) -> None:
+        errors.append(
+            {"code": code, "message": message, "param": None, "line": line_no}
+        )
+
+    for line_no, raw in enumerate(content.splitlines(), start=1):
+        if not raw.strip():
+            continue
+        try:
+            item = json.loads(raw)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            fail(
+                line_no,
+                "invalid_json_line",
+                "This line is not parseable as valid JSON.",
+            )
+            continue
+        if not isinstance(item, dict):
+            fail(line_no, "invalid_json_line", "Each line must be a JSON object.")
+            continue
+        custom_id = item.get("custom_id")
+        body = item.get("body")
+        if not isinstance(custom_id, str) or not custom_id:
+            fail(line_no, "missing_required_parameter", "custom_id is required.")
+        elif custom_id in seen:
+            fail(line_no, "duplicate_custom_id", f"Duplicate custom_id: {custom_id}")
+        elif item.get("method") != "POST":
+            fail(line_no, "invalid_method", "Only POST is supported.")
+        elif item.get("url") != endpoint:
+            fail(
+                line_no,
+                "mismatched_url",
+                f"url must match the batch endpoint {endpoint}.",
+            )
+        elif not isinstance(body, dict):
+            fail(line_no, "invalid_request", "body must be a JSON object.")
+        else:
+            seen.add(custom_id)
+            lines.append(BatchLine(custom_id=custom_id, body=body))
+    if not lines and not errors:
+        fail(0, "empty_file", "The input file contains no requests.")
+    if len(lines) > BATCH_MAX_REQUESTS:
+        fail(
+            0,
+            "too_many_requests",
+            f"A batch may contain at most {BATCH_MAX_REQUESTS} requests.",
+        )
+    return lines, errors
+
+
+def run_batch_lines(
+    lines: list[BatchLine],
+    *,
+    config: MockServerConfig,
+    corpus: ResponseCorpus | None,
+    classifier: TaskClassifier | None,
+    prefix_cache: PrefixCache | None = None,
+) -> list[tuple[bool, str]]:
+    """在工作线程里逐行生成响应，返回 (是否成功, 输出 JSONL 行)。
+
+    复用 chat 的生成逻辑但强制非流式，抖动与解码等待交给 batch 的整体节奏，不逐行睡眠。
+    """
+
+    results: list[tuple[bool, str]] = []
+    for line in lines:
+        request = HttpRequest(
+            method="POST",
+            target=BATCH_ENDPOINTS[0],
+            version="HTTP/1.1",
+            headers={},
+            body=json.dumps({**line.body, "stream": False}, ensure_ascii=False).encode(
+                "utf-8"
+            ),
+        )
+        try:
+            reply = build_chat_reply(
+                request,
+                config=config,
+                corpus=corpus,
+                classifier=classifier,
+                prefix_cache=prefix_cache,
+            )
+        except HttpError as e:
+            status = e.status
+            body_text = json.dumps(
+                build_openai_error(e.message, error_type=e.error_type),
+                ensure_ascii=False,
+            )
+        else:
+            status = 200
+            # 响应体本身就是 JSON，直接拼进输出行，省一次解析和再序列化
+            body_text = reply.messages[0].decode("utf-8")
+        output_line = (
+            f'{{"id": "batch_req_{uuid.uuid4().hex[:24]}",'
+            f' "custom_id": {json.dumps(line.custom_id, ensure_ascii=False)},'
+            f' "response": {{"status_code": {status},'
+            f' "request_id": "req_{uuid.uuid4().hex[:24]}", "body": {body_text}}},'
+            ' "error": null}'
+        )
+        results.append((status == 200, output_line))
+    return results
+
+
+class BatchService:
+    """Batch API 的文件库与后台处理。
+
+    每个 batch 一个 asyncio 任务，生成逻辑放在单独的工作线程，不和在线请求抢事件循环。
+    --batch-capacity-rps 对所有 batch 共享：每片请求先在共享时间线上预约处理时段再执行。
+    """
+
+    def __init__(self, state: ServerState) -> None:
+        """初始化空文件库；工作线程在第一个 batch 到来时才创建。"""
+
+        self.state = state
+        self.config = state.config
+        self.files: dict[str, StoredFile] = {}
+        self.jobs: dict[str, BatchJob] = {}
+        self.tasks: set[asyncio.Task[None]] = set()
+        self.slots = asyncio.Semaphore(max(1, self.config.batch_max_active))
+        self.executor: concurrent.futures.ThreadPoolExecutor | None = None
+        self.next_free = 0.0
+        self.requests_processed = 0
+
+    def add_file(self, *, filename: str, purpose: str, content: bytes) -> StoredFile:
+        """保存一个文件并分配 file id。"""
+
+        stored = StoredFile(
+            id=f"file-{uuid.uuid4().hex[:24]}",
+            filename=filename,
+            purpose=purpose,
+            created_at=int(time.time()),
+            content=content,
+        )
+        self.files[stored.id] = stored
+        return stored
+
+    def get_file(self, file_id: str) -> StoredFile:
+        """按 id 取文件，不存在时 404。"""
+
+        stored = self.files.get(file_id)
+        if stored is None:
+            raise HttpError(404, f"No such File object: {file_id}")
+        return stored
+
+    def get_job(self, batch_id: str) -> BatchJob:
+        """按 id 取 batch，不存在时 404。"""
+
+        job = self.jobs.get(batch_id)
+        if job is None:
+            raise HttpError(404, f"No such Batch object: {batch_id}")
+        return job
+
+    def create(self, data: dict[str, Any]) -> BatchJob:
+        """校验创建参数并启动后台处理。"""
+
+        input_file_id = data.get("input_file_id")
+        endpoint = data.get("endpoint")
+        completion_window = data.get("completion_window")
+        metadata = data.get("metadata")
+        if not isinstance(input_file_id, str) or input_file_id not in self.files:
+            raise HttpError(400, f"Invalid input_file_id: {input_file_id!r}")
+        if self.files[input_file_id].purpose != BATCH_INPUT_PURPOSE:
+            raise HttpError(400, f"File {input_file_id} must have purpose 'batch'")
+        if endpoint not in BATCH_ENDPOINTS:
+            raise HttpError(400, f"Unsupported endpoint: {endpoint!r}")
+        if completion_window not in BATCH_COMPLETION_WINDOWS:
+            raise HttpError(
+                400, f"Unsupported completion_window: {completion_window!r}"
+            )
+        if metadata is not None and not isinstance(metadata, dict):
+            raise HttpError(400, "metadata must be an object")
+
+        job = BatchJob(
+            input_file_id=input_file_id,
+            endpoint=endpoint,
+            completion_window=completion_window,
+            metadata=metadata,
+        )
+        self.jobs[job.id] = job
+        # 后台任务不属于创建它的那次请求，换一个干净的上下文，避免把轨迹写到已结束的请求上
+        task = asyncio.create_task(self.run(job), context=contextvars.Context())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return job
+
+    def cancel(self, batch_id: str) -> BatchJob:
+        """请求取消；已处理的部分仍会写进输出文件。"""
+
+        job = self.get_job(batch_id)
+        if job.status in ("completed", "failed", "cancelled", "expired"):
+            raise HttpError(409, f"Cannot cancel a batch with status {job.status!r}")
+        if not job.cancel_requested:
+            job.cancel_requested = True
+            job.advance("cancelling")
+        return job
+
+    async def in_worker(
+        self, func: Callable[..., Any], *args: Any, **kwargs: Any
+    ) -> Any:
+        """在 batch 专用工作线程里执行 func。"""
+
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="mock-llm-batch"
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def reserve(self, count: int) -> None:
+        """在共享时间线上为 count 个请求预约处理时段，未轮到时先等待。"""
+
+        capacity = self.config.batch_capacity_rps
+        if capacity <= 0:
+            return
+        now = time.monotonic()
+        start = max(now, self.next_free)
+        self.next_free = start + count / capacity
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def run(self, job: BatchJob) -> None:
+        """后台任务入口：意外异常让 batch 以 failed 收尾，客户端轮询不会卡在中间状态。"""
+
+        try:
+            await self.process(job)
+        except Exception:
+            logging.getLogger(__name__).exception("Batch %s failed", job.id)
+            job.errors = [
+                {
+                    "code": "server_error",
+                    "message": "The batch failed due to an internal server error.",
+                    "param": None,
+                    "line": None,
+                }
+            ]
+            job.advance("failed")
+
+    async def process(self, job: BatchJob) -> None:
+        """validating -> in_progress -> finalizing -> completed/cancelled；非法输入直接 failed。"""
+
+        lines, errors = await self.in_worker(
+            parse_batch_input, self.files[job.input_file_id].content, job.endpoint
+        )
+        if errors:
+            job.errors = errors
+            job.advance("failed")
+            return
+
+        job.total = len(lines)
+        async with self.slots:
+            if not job.cancel_requested:
+                job.advance("in_progress")
+            capacity = self.config.batch_capacity_rps
+            slice_size = (
+                max(1, math.ceil(capacity * BATCH_SLICE_S)) if capacity > 0 else 64
+            )
+            outputs: list[str] = []
+            failures: list[str] = []
+            for start in range(0, len(lines), slice_size):
+                if job.cancel_requested:
+                    break
+                chunk = lines[start : start + slice_size]
+                await self.reserve(len(chunk))
+                results = await self.in_worker(
+                    run_batch_lines,
+                    chunk,
+                    config=self.config,
+                    corpus=self.state.corpus,
+                    classifier=self.state.task_classifier,
+                    prefix_cache=self.state.prefix_cache,
+                )
+                for ok, output_line in results:
+                    (outputs if ok else failures).append(output_line)
+                job.completed = len(outputs)
+                job.failed = len(failures)
+                self.requests_processed += len(chunk)
+
+        remaining_s = (
+            job.created_mono + self.config.batch_min_duration_s - time.monotonic()
+        )
+        if remaining_s > 0 and not job.cancel_requested:
+            await asyncio.sleep(remaining_s)
+
+        job.advance("finalizing")
+        if outputs:
+            job.output_file_id = self.add_file(
+                filename=f"{job.id}_output.jsonl",
+                purpose=BATCH_OUTPUT_PURPOSE,
+                content=("\n".join(outputs) + "\n").encode("utf-8"),
+            ).id
+        if failures:
+            job.error_file_id = self.add_file(
+                filename=f"{job.id}_error.jsonl",
+                purpose=BATCH_OUTPUT_PURPOSE,
+                content=("\n".join(failures) + "\n").encode("utf-8"),
+            ).id
+        job.advance("cancelled" if job.cancel_requested else "completed")
+
+    def stats(self) -> dict[str, Any]:
+        """导出 /health 使用的计数。"""
+
+        by_status: dict[str, int] = {}
+        for job in self.jobs.values():
+            by_status[job.status] = by_status.get(job.status, 0) + 1
+        return {
+            "files": len(self.files),
+            "file_bytes": sum(len(f.content) for f in self.files.values()),
+            "batches": by_status,
+            "requests_processed": self.requests_processed,
+            "capacity_rps": self.config.batch_capacity_rps,
+            "max_active": self.config.batch_max_active,
+        }
+
+    def close(self) -> None:
+        """取消后台 batch 并停止工作线程。"""
+
+        for task in self.tasks:
+            task.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class BudgetLease:
+    """单个连接持有的预算份额，连接结束时一次性归还。"""
+
+    def __init__(self, state: ServerState) -> None:
+        """绑定共享状态，初始不持有预算。"""
+
+        self.state = state
+        self.held = 0
+
+    def reserve(self, size: int) -> None:
+        """占用预算；超限时抛出 503，由路由层统一写回。"""
+
+        if size <= 0:
+            return
+        if not self.state.try_reserve(size):
+            raise self.state.record_shed(SHED_REASON_MEMORY)
+        self.held += size
+
+    def release_all(self) -> None:
+        """归还本连接持有的全部预算。"""
+
+        if self.held:
+            self.state.release(self.held)
+            self.held = 0
+
+
+def count_open_fds() -> int | None:
+    """统计进程打开的文件描述符数量；平台不支持时返回 None。"""
+
+    for fd_dir in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(fd_dir))
+        except OSError:
+            continue
+    return None
+
+
+class SoakMonitor:
+    """长稳压测的泄漏观测器。
+
+    按固定间隔采集 tracemalloc、文件描述符、asyncio 任务和存活 StreamWriter，
+    与上一采样比较得出增量，并按相对首个采样的增长排序分配点，用于判断
+    增长来自 mock 自身还是来自被测客户端。
+    """
+
+    def __init__(
+        self,
+        state: ServerState,
+        *,
+        interval_s: float,
+        output_path: str | None,
+        top_n: int,
+    ) -> None:
+        """保存采样参数；tracemalloc 在 run() 开始时才启动。"""
+
+        self.state = state
+        self.interval_s = interval_s
+        self.output_path = output_path
+        self.top_n = top_n
+        self.started_at = time.monotonic()
+        self.seq = 0
+        self.baseline: tracemalloc.Snapshot | None = None
+        self.previous_metrics: dict[str, int | None] = {}
+        self.latest: dict[str, Any] | None = None
+
+    def collect_metrics(self) -> dict[str, int | None]:
+        """采集可直接做差的标量指标。"""
+
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        return {
+            "requests_total": self.state.total_requests,
+            "connections_active": self.state.active_connections,
+            "open_fds": count_open_fds(),
+            "asyncio_tasks": len(asyncio.all_tasks()),
+            "live_stream_writers": len(self.state.live_writers),
+            "traced_memory_bytes": current_bytes,
+            "traced_memory_peak_bytes": peak_bytes,
+        }
+
+    def compare_snapshot(self, snapshot: tracemalloc.Snapshot) -> list[dict[str, Any]]:
+        """返回相对首个采样增长最多的分配点；在线程里执行，避免阻塞事件循环。"""
+
+        if self.baseline is None:
+            self.baseline = snapshot
+            return []
+
+        growth: list[dict[str, Any]] = []
+        for stat in snapshot.compare_to(self.baseline, "lineno")[: self.top_n]:
+            frame = stat.traceback[0]
+            growth.append(
+                {
+                    "site": f"{frame.filename}:{frame.lineno}",
+                    "size_diff_bytes": stat.size_diff,
+                    "count_diff": stat.count_diff,
+                    "size_bytes": stat.size,
+                    "count": stat.count,
+                }
+            )
+        return growth
+
+    async def sample(self) -> dict[str, Any]:
+        """采集一次样本，写入 JSONL 并更新 latest。"""
+
+        metrics = self.collect_metrics()
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            )
+        )
+        top_growth = await asyncio.to_thread(self.compare_snapshot, snapshot)
+
+        delta: dict[str, int | None] = {}
+        for name, value in metrics.items():
+            previous = self.previous_metrics.get(name)
+            if value is None or previous is None:
+                delta[name] = None
+            else:
+                delta[name] = value - previous
+        self.previous_metrics = metrics
+
+        record: dict[str, Any] = {
+            "seq": self.seq,
+            "ts": time.time(),
+            "elapsed_s": round(time.monotonic() - self.started_at, 3),
+            **metrics,
+            "delta": delta,
+            "top_growth": top_growth,
+        }
+        self.seq += 1
+        self.latest = record
+
+        if self.output_path:
+            line = json.dumps(record, ensure_ascii=False) + "\n"
+            await asyncio.to_thread(append_text_file, self.output_path, line)
+        return record
+
+    async def run(self) -> None:
+        """启动 tracemalloc 并按间隔持续采样，直到任务被取消。"""
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        while True:
+            try:
+                await self.sample()
+            except Exception:
+                logging.getLogger(__name__).exception("Soak sample failed")
+            await asyncio.sleep(self.interval_s)
+
+
+def append_text_file(path: str, text: str) -> None:
+    """以追加方式写入文本；每次重新打开，进程被强杀时也不丢已写样本。"""
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(text)
+
+
+def parse_trace_context(headers: dict[str, str]) -> TraceContext:
+    """解析 traceparent/tracestate；缺失或非法时开启新 trace（视为采样）。"""
+
+    tracestate = headers.get("tracestate", "").strip()
+    match = TRACEPARENT_PATTERN.match(headers.get("traceparent", "").strip().lower())
+    if match is not None:
+        version, trace_id, parent_span_id, flags = match.groups()
+        if version != "ff" and trace_id != "0" * 32 and parent_span_id != "0" * 16:
+            return TraceContext(
+                trace_id=trace_id,
+                parent_span_id=parent_span_id,
+                sampled=bool(int(flags, 16) & 0x01),
+                tracestate=tracestate,
+            )
+    # 非法 traceparent 按规范忽略，tracestate 也随之丢弃
+    return TraceContext(
+        trace_id=os.urandom(16).hex(),
+        parent_span_id=None,
+        sampled=True,
+        tracestate="",
+    )
+
+
+def build_otlp_attribute(key: str, value: Any) -> dict[str, Any]:
+    """把 Python 标量转成 OTLP-JSON 的 KeyValue。"""
+
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        # OTLP-JSON 规定 int64 以字符串编码
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def build_otlp_span(
+    *,
+    trace_id: str,
+    span_id: str,
+    parent_span_id: str | None,
+    name: str,
+    kind: int,
+    start_ns: int,
+    end_ns: int,
+    attributes: dict[str, Any],
+    status_code: int = OTLP_STATUS_OK,
+    tracestate: str = "",
+) -> dict[str, Any]:
+    """构造一个 OTLP-JSON Span 对象，值为 None 的属性会被省略。"""
+
+    span: dict[str, Any] = {
+        "traceId": trace_id,
+        "spanId": span_id,
+        "name": name,
+        "kind": kind,
+        "startTimeUnixNano": str(start_ns),
+        "endTimeUnixNano": str(max(start_ns, end_ns)),
+        "attributes": [
+            build_otlp_attribute(key, value)
+            for key, value in attributes.items()
+            if value is not None
+        ],
+        "status": {"code": status_code},
+    }
+    if parent_span_id:
+        span["parentSpanId"] = parent_span_id
+    if tracestate:
+        span["traceState"] = tracestate
+    return span
+
+
+def build_otlp_export_request(spans: list[dict[str, Any]]) -> dict[str, Any]:
+    """把 span 包成 ExportTraceServiceRequest，一行一个，和 collector 文件导出格式一致。"""
+
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        build_otlp_attribute("service.name", "mock-llm-api-server")
+                    ]
+                },
+                "scopeSpans": [{"scope": {"name": OTLP_SCOPE_NAME}, "spans": spans}],
+            }
+        ]
+    }
+
+
+class RequestTrace:
+    """单个连接的请求轨迹：阶段时间点、收发字节和访问日志字段。
+
+    时间点统一用 time.monotonic()，输出时换算成相对 accept 的毫秒数。
+    """
+
+    def __init__(self) -> None:
+        """在 accept 时创建，记录连接起点。"""
+
+        self.request_id = uuid.uuid4().hex[:16]
+        self.span_id = os.urandom(8).hex()
+        self.trace_context: TraceContext | None = None
+        self.accepted_at = time.time()
+        self.accepted_mono = time.monotonic()
+        self.marks: list[tuple[str, float]] = []
+        self.head_done_mono: float | None = None
+        self.body_done_mono: float | None = None
+        self.first_byte_mono: float | None = None
+        self.first_chunk_mono: float | None = None
+        self.last_byte_mono: float | None = None
+        self.generate_cpu_s: float | None = None
+        self.jitter_s: float | None = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # 解压后的请求体字节数；未压缩时与 bytes_in 一致
+        self.body_bytes = 0
+        self.request_encoding: str | None = None
+        self.request_codec_cpu_s = 0.0
+        self.response_encoding: str | None = None
+        self.response_raw_bytes = 0
+        self.response_encoded_bytes = 0
+        self.response_codec_cpu_s = 0.0
+        self.status: int | None = None
+        self.method = ""
+        self.path = ""
+        self.task: str | None = None
+        self.model: str | None = None
+        self.stream: bool | None = None
+        self.line_count: int | None = None
+        self.prompt_tokens: int | None = None
+        self.completion_tokens: int | None = None
+        self.reasoning_tokens: int | None = None
+        self.cached_tokens: int | None = None
+        self.tool_calls: int | None = None
+        self.content_faults: tuple[str, ...] = ()
+        # 模式 -> (被切开的消息数, 额外写次数)
+        self.sse_fragments: dict[str, tuple[int, int]] = {}
+        self.disconnect_reason = "complete"
+
+    def enter(self, phase: str) -> None:
+        """记录进入某阶段的时刻。"""
+
+        self.marks.append((phase, time.monotonic()))
+
+    def breakdown(self, start: float, end: float) -> dict[str, float]:
+        """统计 [start, end] 时间窗内各阶段占用的秒数。"""
+
+        result: dict[str, float] = {}
+        for index, (phase, phase_start) in enumerate(self.marks):
+            phase_end = self.marks[index + 1][1] if index + 1 < len(self.marks) else end
+            overlap = min(end, phase_end) - max(start, phase_start)
+            if overlap > 0:
+                result[phase] = result.get(phase, 0.0) + overlap
+        return result
+
+    def since_accept_ms(self, mono: float | None) -> float | None:
+        """把 monotonic 时间点换算成相对 accept 的毫秒数。"""
+
+        if mono is None:
+            return None
+        return round((mono - self.accepted_mono) * 1000.0, 3)
+
+    def mark_response_start(self, status: int) -> None:
+        """记录首字节时间与状态码。"""
+
+        self.status = status
+        if self.first_byte_mono is None:
+            self.first_byte_mono = time.monotonic()
+
+    def server_timing(self, *, final: bool) -> str:
+        """生成 Server-Timing 值；final=True 时额外包含首/末字节（用于 trailer）。"""
+
+        metrics: list[tuple[str, float | None]] = [
+            ("head", self.since_accept_ms(self.head_done_mono)),
+        ]
+        if self.head_done_mono is not None and self.body_done_mono is not None:
+            metrics.append(
+                ("body", round((self.body_done_mono - self.head_done_mono) * 1000.0, 3))
+            )
+        if self.generate_cpu_s is not None:
+            metrics.append(("gen", round(self.generate_cpu_s * 1000.0, 3)))
+        if self.jitter_s is not None:
+            metrics.append(("jitter", round(self.jitter_s * 1000.0, 3)))
+        if final:
+            metrics.append(("ttfb", self.since_accept_ms(self.first_byte_mono)))
+            metrics.append(("total", self.since_accept_ms(self.last_byte_mono)))
+        else:
+            metrics.append(("total", self.since_accept_ms(time.monotonic())))
+        return ", ".join(
+            f"{name};dur={value}" for name, value in metrics if value is not None
+        )
+
+    def find_mark(self, phase: str) -> tuple[float, float | None] | None:
+        """返回某阶段的开始时刻和下一阶段的开始时刻（即该阶段的结束）。"""
+
+        for index, (name, start) in enumerate(self.marks):
+            if name == phase:
+                end = self.marks[index + 1][1] if index + 1 < len(self.marks) else None
+                return start, end
+        return None
+
+    def traceresponse(self) -> str | None:
+        """返回 W3C traceresponse 头，让客户端能把自身 span 关联到服务端 span。"""
+
+        context = self.trace_context
+        if context is None:
+            return None
+        flags = "01" if context.sampled else "00"
+        return f"00-{context.trace_id}-{self.span_id}-{flags}"
+
+    def to_otlp_spans(self) -> list[dict[str, Any]]:
+        """按阶段时间点生成服务端 span：根 span 加 parse/generate/queue/stream 子 span。"""
+
+        context = self.trace_context
+        if context is None or not context.sampled:
+            return []
+
+        def to_ns(mono: float) -> int:
+            return int((self.accepted_at + (mono - self.accepted_mono)) * 1e9)
+
+        end_mono = self.last_byte_mono or time.monotonic()
+        attributes: dict[str, Any] = {
+            "http.request.method": self.method,
+            "url.path": self.path,
+            "http.response.status_code": self.status,
+            "mock.request_id": self.request_id,
+            "mock.task": self.task,
+            "gen_ai.request.model": self.model,
+            "mock.stream": self.stream,
+            "mock.line_count": self.line_count,
+            "gen_ai.usage.input_tokens": self.prompt_tokens,
+            "gen_ai.usage.output_tokens": self.completion_tokens,
+            "mock.bytes_in": self.bytes_in,
+            "mock.bytes_out": self.bytes_out,
+            "mock.disconnect_reason": self.disconnect_reason,
+        }
+        failed = self.disconnect_reason not in ("complete", "client_disconnect")
+        spans = [
+            build_otlp_span(
+                trace_id=context.trace_id,
+                span_id=self.span_id,
+                parent_span_id=context.parent_span_id,
+                name=f"{self.method} {self.path}",
+                kind=OTLP_SPAN_KIND_SERVER,
+                start_ns=to_ns(self.accepted_mono),
+                end_ns=to_ns(end_mono),
+                attributes=attributes,
+                status_code=OTLP_STATUS_ERROR if failed else OTLP_STATUS_OK,
+                tracestate=context.tracestate,
+            )
+        ]
+
+        child_attributes = {"mock.task": self.task, "gen_ai.request.model": self.model}
+        intervals: list[tuple[str, float | None, float | None, dict[str, Any]]] = []
+        generate = self.find_mark("generate")
+        if self.head_done_mono is not None:
+            parse_end = generate[0] if generate else self.body_done_mono
+            intervals.append(
+                (
+                    "parse",
+                    self.head_done_mono,
+                    parse_end,
+                    {"mock.bytes_in": self.bytes_in},
+                )
+            )
+        if generate is not None:
+            intervals.append(
+                (
+                    "generate",
+                    generate[0],
+                    generate[1],
+                    {
+                        "mock.line_count": self.line_count,
+                        "gen_ai.usage.output_tokens": self.completion_tokens,
+                    },
+                )
+            )
+        if self.stream:
+            # 流式：header 发出到首个 SSE 消息之间是模拟的排队/首 token 延迟
+            intervals.append(("queue", self.first_byte_mono, self.first_chunk_mono, {}))
+            intervals.append(
+                (
+                    "stream",
+                    self.first_chunk_mono,
+                    self.last_byte_mono,
+                    {"mock.bytes_out": self.bytes_out},
+                )
+            )
+        else:
+            respond = self.find_mark("respond")
+            intervals.append(
+                ("queue", respond[0] if respond else None, self.first_byte_mono, {})
+            )
+            intervals.append(
+                (
+                    "respond",
+                    self.first_byte_mono,
+                    self.last_byte_mono,
+                    {"mock.bytes_out": self.bytes_out},
+                )
+            )
+
+        for name, start, end, extra in intervals:
+            if start is None or end is None:
+                continue
+            spans.append(
+                build_otlp_span(
+                    trace_id=context.trace_id,
+                    span_id=os.urandom(8).hex(),
+                    parent_span_id=self.span_id,
+                    name=name,
+                    kind=OTLP_SPAN_KIND_INTERNAL,
+                    start_ns=to_ns(start),
+                    end_ns=to_ns(end),
+                    attributes={**child_attributes, **extra},
+                )
+            )
+        return spans
+
+    def to_access_record(self) -> dict[str, Any]:
+        """导出一行访问日志。"""
+
+        return {
+            "request_id": self.request_id,
+            "trace_id": None
+            if self.trace_context is None
+            else self.trace_context.trace_id,
+            "accepted_at": self.accepted_at,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "task": self.task,
+            "model": self.model,
+            "stream": self.stream,
+            "head_ms": self.since_accept_ms(self.head_done_mono),
+            "body_ms": self.since_accept_ms(self.body_done_mono),
+            "generate_cpu_ms": (
+                None
+                if self.generate_cpu_s is None
+                else round(self.generate_cpu_s * 1000.0, 3)
+            ),
+            "jitter_ms": None
+            if self.jitter_s is None
+            else round(self.jitter_s * 1000.0, 3),
+            "first_byte_ms": self.since_accept_ms(self.first_byte_mono),
+            "last_byte_ms": self.since_accept_ms(self.last_byte_mono),
+            "line_count": self.line_count,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "reasoning_tokens": self.reasoning_tokens,
+            "cached_tokens": self.cached_tokens,
+            "tool_calls": self.tool_calls,
+            "content_faults": list(self.content_faults),
+            "sse_fragments": {
+                mode: messages for mode, (messages, _) in self.sse_fragments.items()
+            },
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "body_bytes": self.body_bytes,
+            "request_encoding": self.request_encoding,
+            "response_encoding": self.response_encoding,
+            "disconnect_reason": self.disconnect_reason,
+        }
+
+
+class BackgroundJsonlWriter:
+    """队列 + 后台线程写出的 JSONL 文件，访问日志与 span 导出共用。
+
+    事件循环里只做一次入队；JSON 序列化和文件 IO 都在写线程里完成，
+    不会因为日志拖慢 SSE 节奏。
+    """
+
+    def __init__(self, path: str) -> None:
+        """打开日志文件并启动写线程。"""
+
+        self.path = path
+        self.queue: queue.SimpleQueue[dict[str, Any] | None] = queue.SimpleQueue()
+        self.thread = threading.Thread(
+            target=self.write_loop, name="mock-llm-jsonl-writer", daemon=True
+        )
+        self.thread.start()
+
+    def log(self, record: dict[str, Any]) -> None:
+        """入队一条记录，不阻塞调用方。"""
+
+        self.queue.put(record)
+
+    def write_loop(self) -> None:
+        """批量取出队列中的记录写入文件，队列空时才 flush。"""
+
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                record = self.queue.get()
+                while record is not None:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    try:
+                        record = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                f.flush()
+                if record is None:
+                    return
+
+    def close(self) -> None:
+        """写完剩余记录后停止写线程。"""
+
+        self.queue.put(None)
+        self.thread.join(timeout=5.0)
+
+
+def set_request_phase(phase: str) -> None:
+    """标记当前连接进入的请求阶段，供慢回调归因使用。"""
+
+    tracker = REQUEST_TRACE.get()
+    if tracker is not None:
+        tracker.enter(phase)
+
+
+class LoopProfiler:
+    """事件循环线程的性能剖析器。
+
+    cProfile 负责函数级 pstats；另起一个采样线程周期读取事件循环线程的栈，
+    生成 flamegraph 可用的 collapsed-stack 文本。两者都可在运行中多次导出。
+    """
+
+    def __init__(self, output_prefix: str, *, sample_interval_s: float) -> None:
+        """保存输出前缀和采样间隔；start() 必须在事件循环线程调用。"""
+
+        self.output_prefix = output_prefix
+        self.sample_interval_s = sample_interval_s
+        self.profile = cProfile.Profile()
+        self.stack_counts: collections.Counter[str] = collections.Counter()
+        self.stop_event = threading.Event()
+        self.sampler: threading.Thread | None = None
+        self.target_thread_id = 0
+
+    def start(self) -> None:
+        """在当前线程开启 cProfile，并启动栈采样线程。"""
+
+        self.target_thread_id = threading.get_ident()
+        self.profile.enable()
+        if self.sample_interval_s > 0:
+            self.sampler = threading.Thread(
+                target=self.sample_loop, name="mock-llm-stack-sampler", daemon=True
+            )
+            self.sampler.start()
+
+    def sample_loop(self) -> None:
+        """按间隔采样事件循环线程的调用栈。"""
+
+        while not self.stop_event.wait(self.sample_interval_s):
+            frame = sys._current_frames().get(self.target_thread_id)
+            if frame is None:
+                continue
+            labels: list[str] = []
+            while frame is not None:
+                code = frame.f_code
+                labels.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            labels.reverse()
+            self.stack_counts[";".join(labels)] += 1
+
+    def dump(self) -> None:
+        """导出 pstats 与 collapsed-stack；cProfile 导出期间短暂停用后恢复。"""
+
+        self.profile.disable()
+        try:
+            self.profile.dump_stats(self.output_prefix + ".pstats")
+        finally:
+            if not self.stop_event.is_set():
+                self.profile.enable()
+
+        lines = [f"{stack} {count}\n" for stack, count in self.stack_counts.items()]
+        with open(self.output_prefix + ".collapsed", "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        logging.getLogger(__name__).info(
+            "Profile written: %s.pstats, %s.collapsed",
+            self.output_prefix,
+            self.output_prefix,
+        )
+
+    def stop(self) -> None:
+        """停止采样并做最后一次导出。"""
+
+        self.stop_event.set()
+        if self.sampler is not None:
+            self.sampler.join(timeout=1.0)
+        self.dump()
+
+
+class SlowCallbackFilter(logging.Filter):
+    """给 asyncio 的慢回调告警补上请求阶段，并按阶段计数。
+
+    asyncio debug 模式在回调返回后立刻记录告警，此时 loop._current_handle
+    仍指向该回调，可以从它的 contextvars 上下文里读出所属连接的阶段轨迹；
+    一次回调可能跨越多个阶段，按与回调时间窗重叠最多的阶段归因。
+    """
+
+    def __init__(self, state: ServerState) -> None:
+        """绑定共享状态，计数写入 state.slow_callbacks。"""
+
+        super().__init__()
+        self.state = state
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """识别慢回调告警并改写消息；其他 asyncio 日志原样放行。"""
+
+        if not str(record.msg).startswith("Executing "):
+            return True
+
+        args = record.args if isinstance(record.args, tuple) else ()
+        duration_s = float(args[1]) if len(args) >= 2 else 0.0
+
+        try:
+            handle = getattr(asyncio.get_running_loop(), "_current_handle", None)
+        except RuntimeError:
+            handle = None
+        context = getattr(handle, "_context", None)
+        tracker = None if context is None else context.get(REQUEST_TRACE)
+        breakdown: dict[str, float] = {}
+        if tracker is not None:
+            now = time.monotonic()
+            breakdown = tracker.breakdown(now - duration_s, now)
+        phase = max(breakdown, key=breakdown.__getitem__) if breakdown else "loop"
+        stats = self.state.slow_callbacks.setdefault(
+            phase, {"count": 0, "total_s": 0.0, "max_s": 0.0}
+        )
+        stats["count"] += 1
+        stats["total_s"] += duration_s
+        stats["max_s"] = max(stats["max_s"], duration_s)
+
+        detail = ", ".join(f"{name} {sec:.3f}s" for name, sec in breakdown.items())
+        record.msg = str(record.msg) + " [phase=%s%s]"
+        record.args = (*args, phase, f"; {detail}" if detail else "")
+        return True
+
+
+def enable_slow_callback_detection(
+    loop: asyncio.AbstractEventLoop, state: ServerState, threshold_s: float
+) -> None:
+    """开启 asyncio debug 的慢回调告警，并关闭代价较高的协程来源追踪。"""
+
+    loop.set_debug(True)
+    loop.slow_callback_duration = threshold_s
+    sys.set_coroutine_origin_tracking_depth(0)
+    logging.getLogger("asyncio").addFilter(SlowCallbackFilter(state))
+
+
+def normalize_header_name(name: str) -> str:
+    """HTTP header 名称统一转小写，便于后续字典读取。"""
+
+    return name.strip().lower()
+
+
+def pick_user_prompt_text(messages: Any) -> str:
+    """从 messages 中取最后一个 user 文本，兼容缺失 role 的旧请求。"""
+
+    if not isinstance(messages, list):
+        return ""
+
+    for msg in reversed(messages):
+        if not isinstance(msg, dict):
+            continue
+        if msg.get("role") != "user":
+            continue
+        return coerce_message_text(msg.get("content"))
+
+    if messages and isinstance(messages[-1], dict):
+        return coerce_message_text(messages[-1].get("content"))
+    return ""
+
+
+def coerce_message_text(content: Any) -> str:
+    """把 OpenAI 字符串或多段 text content 收敛成单个文本。"""
+
+    if isinstance(content, str):
+        return content
+
+    # 兼容 OpenAI 的多段 content（如 [{"type":"text","text":"..."}]）
+    if isinstance(content, list):
+        parts: list[str] = []
+        for part in content:
+            if not isinstance(part, dict):
+                continue
+            if part.get("type") != "text":
+                continue
+            text = part.get("text")
+            if isinstance(text, str) and text:
+                parts.append(text)
+        return "".join(parts)
+
+    return str(content) if content is not None else ""
+
+
+def extract_jsonline_block(text: str) -> str:
+    """提取最后一个 ```jsonline 代码块的内容。
+
+    为什么取最后一个：提示词里通常包含“输出格式示例”的 jsonline 代码块，
+    真正的输入 JSONLINE 一般附在最后。
+    """
+
+    lines = text.splitlines()
+    blocks: list[tuple[str, list[str]]] = []
+
+    in_block = False
+    current_lang = ""
+    current_lines: list[str] = []
+
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            if not in_block:
+                current_lang = stripped[3:].strip().lower()
+                current_lines = []
+                in_block = True
+                continue
+
+            blocks.append((current_lang, current_lines))
+            in_block = False
+            current_lang = ""
+            current_lines = []
+            continue
+
+        if in_block:
+            current_lines.append(line)
+
+    for lang, payload_lines in reversed(blocks):
+        if lang.startswith("jsonl"):
+            return "\n".join(payload_lines)
+
+    return ""
+
+
+def parse_jsonline_entries(jsonline_payload: str) -> list[TranslationRequestEntry]:
+    """解析单键 JSONLINE 输入，坏行直接跳过以模拟宽容模型服务。"""
+
+    entries: list[TranslationRequestEntry] = []
+    for raw_line in jsonline_payload.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+        except Exception:
+            continue
+        if isinstance(obj, dict) and len(obj) == 1:
+            key, value = next(iter(obj.items()))
+            entries.append(TranslationRequestEntry(key=str(key), value=value))
+    return entries
+
+
+def find_last_prefix(text: str, prefixes: tuple[str, ...]) -> tuple[int, str]:
+    """返回文本中最后一个输入标记的位置和标记本身，找不到时位置为 -1。"""
+
+    last_index = -1
+    selected_prefix = ""
+    for prefix in prefixes:
+        current_index = text.rfind(prefix)
+        if current_index > last_index:
+            last_index = current_index
+            selected_prefix = prefix
+    return last_index, selected_prefix
+
+
+def find_last_analysis_prefix(text: str) -> tuple[int, str]:
+    """返回文本中最后一个分析输入标记的位置和标记本身，找不到时位置为 -1。"""
+
+    return find_last_prefix(text, ANALYSIS_INPUT_PREFIXES)
+
+
+def extract_analysis_input_text(text: str) -> str:
+    """提取分析任务的输入正文。
+
+    为什么用最后一个前缀：
+    - system/user 拼接后的提示词里可能多次出现 “输入：/Input:”
+    - 真正的任务正文通常在最后一个标记之后
+    """
+
+    last_index, selected_prefix = find_last_analysis_prefix(text)
+    if last_index < 0:
+        return text.strip()
+
+    payload = text[last_index + len(selected_prefix) :]
+    return payload.lstrip("\r\n").strip()
+
+
+def parse_analysis_input_lines(text: str) -> list[str]:
+    """按行规整分析输入，避免空白和代码块标记污染 mock 结果。"""
+
+    payload = extract_analysis_input_text(text)
+    normalized_lines: list[str] = []
+    for raw_line in payload.splitlines():
+        line = raw_line.strip()
+        if line == "":
+            continue
+        if line.startswith("```"):
+            continue
+        normalized_lines.append(line)
+    return normalized_lines
+
+
+def parse_sakura_input_lines(text: str) -> list[str]:
+    """取最后一个 Sakura 指令之后的原文行。
+
+    Sakura 响应要与原文逐行对齐，因此保留空行，只去掉指令末尾的那一个换行；
+    没有指令时退化为整段文本按行切分。
+    """
+
+    last_index, selected_prefix = find_last_prefix(text, SAKURA_INPUT_PREFIXES)
+    if last_index < 0:
+        payload = text.strip()
+    else:
+        payload = text[last_index + len(selected_prefix) :]
+        if payload.startswith("\r\n"):
+            payload = payload[2:]
+        elif payload.startswith("\n"):
+            payload = payload[1:]
+    return [line.rstrip("\r") for line in payload.split("\n")]
+
+
+def build_sakura_response_content(
+    request_text: str,
+    rng: random.Random,
+    text_source: TranslationTextSource,
+    faults: tuple[str, ...] = (),
+) -> str:
+    """Sakura 返回与原文逐行对齐的纯文本译文，不带 JSONLINE 包装。"""
+
+    # Sakura 固定是日译中，合成译文统一用中文词表并按原文长度缩放
+    sakura_source = dataclasses.replace(
+        text_source,
+        output_model=dataclasses.replace(
+            text_source.output_model, vocabulary="cjk", proportional=True
+        ),
+    )
+    src_lines = parse_sakura_input_lines(request_text)
+    lines = [
+        "" if not line.strip() else str(sakura_source.translate(line, rng))
+        for line in src_lines
+    ]
+    if faults:
+        lines = apply_content_faults(
+            lines,
+            src_lines,
+            faults,
+            rng,
+            edit_text=lambda line, transform: transform(line),
+            swap=swap_adjacent_items,
+            make_extra=lambda: str(sakura_source.translate("", rng)),
+        )
+    return "\n".join(lines)
+
+
+def estimate_sakura_decode_s(text: str, tokens_per_s: float) -> float:
+    """按 Sakura 的典型吐字速度估算生成这段文本需要的时间。"""
+
+    if tokens_per_s <= 0:
+        return 0.0
+    return len(text) / SAKURA_CHARS_PER_TOKEN / tokens_per_s
+
+
+def build_text_vocabulary(words: tuple[str, ...], separator: str) -> tuple[str, ...]:
+    """预先把分隔符拼进词条，生成时一次 join 即可。"""
+
+    return tuple(word + separator for word in words)
+
+
+def generate_random_text(
+    rng: random.Random,
+    *,
+    min_words: int = 4,
+    max_words: int = 10,
+    vocabulary: tuple[str, ...] | None = None,
+) -> str:
+    """生成稳定词表内的随机译文，供压测时制造非空输出。"""
+
+    word_count = rng.randint(min_words, max_words)
+    return join_vocabulary_words(rng, vocabulary or TEXT_VOCABULARIES["en"], word_count)
+
+
+def join_vocabulary_words(
+    rng: random.Random, vocabulary: tuple[str, ...], word_count: int
+) -> str:
+    """一次 choices 批量抽词，避免逐词调用 rng.choice。"""
+
+    return "".join(rng.choices(vocabulary, k=word_count)).rstrip()
+
+
+TEXT_VOCABULARIES: dict[str, tuple[str, ...]] = {
+    name: build_text_vocabulary(words, separator)
+    for name, (words, separator) in TEXT_VOCABULARY_WORDS.items()
+}
+VOCABULARY_MEAN_CHARS: dict[str, float] = {
+    name: sum(len(word) for word in words) / len(words)
+    for name, words in TEXT_VOCABULARIES.items()
+}
+
+
+def detect_text_language(text: str) -> str:
+    """按文字脚本粗判原文语言：假名 -> ja，谚文 -> ko，汉字 -> zh，其余视为 en。"""
+
+    if LANGUAGE_KANA_PATTERN.search(text):
+        return "ja"
+    if LANGUAGE_HANGUL_PATTERN.search(text):
+        return "ko"
+    if LANGUAGE_HAN_PATTERN.search(text):
+        return "zh"
+    return "en"
+
+
+@dataclass(frozen=True)
+class OutputModel:
+    """合成译文的词表与长度模型。
+
+    proportional 为 False 时保持每行 4~10 个词的旧行为；为 True 时目标字符数为
+    原文字符数 * 语言对扩展比（±15% 波动），按词表平均词长换算抽词个数。
+    """
+
+    vocabulary: str = "en"
+    proportional: bool = False
+    expansion_ratios: tuple[tuple[str, float], ...] = ()
+
+    def expansion_ratio(self, src_text: str) -> float:
+        """取 “原文语言-目标语言” 的扩展比，命令行覆盖优先于内置表。"""
+
+        pair = (
+            f"{detect_text_language(src_text)}-{VOCABULARY_LANGUAGE[self.vocabulary]}"
+        )
+        for name, ratio in self.expansion_ratios:
+            if name == pair:
+                return ratio
+        return DEFAULT_EXPANSION_RATIOS.get(pair, 1.0)
+
+    def generate(self, src_text: Any, rng: random.Random) -> str:
+        """按模型生成一行译文。"""
+
+        vocabulary = TEXT_VOCABULARIES[self.vocabulary]
+        if not self.proportional or not isinstance(src_text, str):
+            return generate_random_text(rng, vocabulary=vocabulary)
+
+        target_chars = len(src_text) * self.expansion_ratio(src_text)
+        target_chars *= rng.uniform(0.85, 1.15)
+        word_count = max(
+            1, round(target_chars / VOCABULARY_MEAN_CHARS[self.vocabulary])
+        )
+        return join_vocabulary_words(rng, vocabulary, word_count)
+
+
+@dataclass(frozen=True)
+class TranslationTextSource:
+    """翻译译文来源：优先回放语料，未配置语料时按输出模型合成。"""
+
+    corpus: ResponseCorpus | None
+    output_model: OutputModel
+
+    def translate(self, src_text: Any, rng: random.Random) -> Any:
+        """为一条原文生成译文。"""
+
+        if self.corpus is not None and isinstance(src_text, str):
+            recorded = self.corpus.lookup(src_text, rng)
+            if recorded is not None:
+                return recorded
+        return self.output_model.generate(src_text, rng)
+
+
+def hash_corpus_source(src_text: str) -> int:
+    """语料索引键：原文 UTF-8 的 64 位 blake2b。"""
+
+    digest = hashlib.blake2b(src_text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, byteorder="big", signed=False)
+
+
+def build_corpus_index(corpus_path: str, index_path: str) -> None:
+    """扫描语料 JSONL，写出按哈希和按原文长度排序的两段 (key, offset) 索引。
+
+    语料每行形如 {"src": "原文", "dst": 译文}，dst 可以是任意 JSON 值；坏行直接跳过。
+    索引只存 8 字节键和行偏移，语料正文不进内存。
+    """
+
+    hashes = array.array("Q")
+    lengths = array.array("Q")
+    offsets = array.array("Q")
+    with open(corpus_path, "rb") as f:
+        offset = 0
+        for raw in f:
+            line_offset = offset
+            offset += len(raw)
+            stripped = raw.strip()
+            if not stripped:
+                continue
+            try:
+                record = json.loads(stripped)
+            except ValueError:
+                continue
+            if not isinstance(record, dict) or "dst" not in record:
+                continue
+            src_text = record.get("src")
+            if not isinstance(src_text, str):
+                continue
+            hashes.append(hash_corpus_source(src_text))
+            lengths.append(len(src_text))
+            offsets.append(line_offset)
+
+    count = len(offsets)
+    by_hash = array.array("Q", bytes(16 * count))
+    by_length = array.array("Q", bytes(16 * count))
+    for slot, i in enumerate(sorted(range(count), key=hashes.__getitem__)):
+        by_hash[2 * slot] = hashes[i]
+        by_hash[2 * slot + 1] = offsets[i]
+    for slot, i in enumerate(sorted(range(count), key=lengths.__getitem__)):
+        by_length[2 * slot] = lengths[i]
+        by_length[2 * slot + 1] = offsets[i]
+
+    stat = os.stat(corpus_path)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(
+            CORPUS_INDEX_HEADER.pack(
+                CORPUS_INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, count
+            )
+        )
+        by_hash.tofile(f)
+        by_length.tofile(f)
+    os.replace(tmp_path, index_path)
+
+
+def bisect_index_pairs(pairs: memoryview, start: int, count: int, key: int) -> int:
+    """在 (key, offset) 对数组里找第一个 key >= 目标值的位置。"""
+
+    low = 0
+    high = count
+    while low < high:
+        mid = (low + high) // 2
+        if pairs[start + 2 * mid] < key:
+            low = mid + 1
+        else:
+            high = mid
+    return low
+
+
+class ResponseCorpus:
+    """内存映射的录制译文语料，按原文哈希精确命中，未命中时取长度最接近的记录。
+
+    语料与索引都通过 mmap 访问，多 GB 语料只占页缓存而不占进程堆；
+    索引缺失或与语料的大小/修改时间不符时在启动阶段重建。
+    映射只读，可以并发查找；卸载线程池和 batch 线程也会调用，命中计数在锁内更新。
+    """
+
+    def __init__(self, corpus_path: str) -> None:
+        """打开语料与索引（必要时重建索引）。"""
+
+        self.corpus_path = corpus_path
+        self.index_path = corpus_path + ".idx"
+        if not self.index_is_current():
+            logging.getLogger(__name__).info(
+                "Building corpus index %s", self.index_path
+            )
+            build_corpus_index(corpus_path, self.index_path)
+
+        self.corpus_fd = os.open(corpus_path, os.O_RDONLY)
+        self.index_fd = os.open(self.index_path, os.O_RDONLY)
+        self.corpus_map = self.map_file(self.corpus_fd)
+        self.index_map = self.map_file(self.index_fd)
+        _, _, _, self.count = CORPUS_INDEX_HEADER.unpack_from(self.index_map, 0)
+        self.pairs = memoryview(self.index_map)[CORPUS_INDEX_HEADER.size :].cast("Q")
+        self.lock = threading.Lock()
+        self.exact_hits = 0
+        self.nearest_hits = 0
+
+    @staticmethod
+    def map_file(fd: int) -> mmap.mmap | bytes:
+        """只读映射文件；空文件无法 mmap，退化为空 bytes。"""
+
+        if os.fstat(fd).st_size == 0:
+            return b""
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+
+    def index_is_current(self) -> bool:
+        """索引头记录的语料大小与修改时间一致时才复用。"""
+
+        try:
+            stat = os.stat(self.corpus_path)
+            with open(self.index_path, "rb") as f:
+                header = f.read(CORPUS_INDEX_HEADER.size)
+        except OSError:
+            return False
+        if len(header) != CORPUS_INDEX_HEADER.size:
+            return False
+        magic, size, mtime_ns, _ = CORPUS_INDEX_HEADER.unpack(header)
+        return (
+            magic == CORPUS_INDEX_MAGIC
+            and size == stat.st_size
+            and mtime_ns == stat.st_mtime_ns
+        )
+
+    def read_record(self, offset: int) -> dict[str, Any]:
+        """按偏移读取一行语料。"""
+
+        end = self.corpus_map.find(b"\n", offset)
+        if end < 0:
+            end = len(self.corpus_map)
+        return json.loads(self.corpus_map[offset:end])
+
+    def lookup(self, src_text: str, rng: random.Random) -> Any | None:
+        """返回录制的 dst；语料为空时返回 None，由调用方回退到合成文本。"""
+
+        if self.count == 0:
+            return None
+
+        key = hash_corpus_source(src_text)
+        slot = bisect_index_pairs(self.pairs, 0, self.count, key)
+        while slot < self.count and self.pairs[2 * slot] == key:
+            record = self.read_record(self.pairs[2 * slot + 1])
+            # 64 位哈希仍可能碰撞，命中后再核对原文
+            if record.get("src") == src_text:
+                with self.lock:
+                    self.exact_hits += 1
+                return record.get("dst")
+            slot += 1
+
+        # 长度最接近的一小段记录里随机取一条，保留真实译文的行长方差
+        base = 2 * self.count
+        slot = bisect_index_pairs(self.pairs, base, self.count, len(src_text))
+        low = max(0, slot - CORPUS_NEAREST_WINDOW // 2)
+        high = min(self.count, low + CORPUS_NEAREST_WINDOW)
+        low = max(0, high - CORPUS_NEAREST_WINDOW)
+        chosen = rng.randrange(low, high)
+        with self.lock:
+            self.nearest_hits += 1
+        return self.read_record(self.pairs[base + 2 * chosen + 1]).get("dst")
+
+    def stats(self) -> dict[str, Any]:
+        """导出 /health 使用的命中统计。"""
+
+        with self.lock:
+            return {
+                "path": self.corpus_path,
+                "records": self.count,
+                "exact_hits": self.exact_hits,
+                "nearest_hits": self.nearest_hits,
+            }
+
+    def close(self) -> None:
+        """释放映射与文件句柄。"""
+
+        self.pairs.release()
+        for mapping in (self.corpus_map, self.index_map):
+            if isinstance(mapping, mmap.mmap):
+                mapping.close()
+        os.close(self.corpus_fd)
+        os.close(self.index_fd)
+
+
+def choose_analysis_term_type(src_text: str) -> str:
+    """分析术语类型按文本哈希稳定映射，保证相同输入可复现。"""
+
+    digest = hashlib.blake2b(src_text.encode("utf-8"), digest_size=2).digest()
+    index = int.from_bytes(digest, byteorder="big", signed=False)
+    return ANALYSIS_TERM_TYPES[index % len(ANALYSIS_TERM_TYPES)]
+
+
+def extract_analysis_term_source(line: str) -> str | None:
+    """从原文行中取第一个较长连续词段，模拟术语抽取结果。"""
+
+    for pattern in (ANALYSIS_LATIN_TERM_PATTERN, ANALYSIS_CJK_TERM_PATTERN):
+        match = pattern.search(line)
+        if match is None:
+            continue
+
+        candidate = match.group(0).strip("【】「」『』（）()[]<>")
+        if len(candidate) < 2:
+            continue
+        if len(candidate) > 6:
+            candidate = candidate[:6]
+        if candidate.isdigit():
+            continue
+        return candidate
+
+    return None
+
+
+def build_analysis_term_target(src_text: str, rng: random.Random) -> str:
+    """目标术语需要稳定且与原文不同，避免被分析链路当作无效同形词。"""
+
+    if src_text.isascii():
+        return "Mock-" + src_text.title()
+    return "译" + src_text + "-" + rng.choice(("A", "B", "C"))
+
+
+def build_translation_actor_target(actor: Any) -> str | list[str] | None:
+    """按 actor/text 协议生成姓名译文，保留空数组槽位语义。"""
+
+    if isinstance(actor, str):
+        actor = actor.strip()
+        return None if not actor else "译名-" + actor
+    if isinstance(actor, list):
+        names = [
+            "译名-" + item.strip() if item.strip() else ""
+            for item in actor
+            if isinstance(item, str)
+        ]
+        return names if any(names) else None
+    return None
+
+
+def build_translation_text(
+    src_text: Any, rng: random.Random, text_source: TranslationTextSource | None
+) -> Any:
+    """未指定译文来源时沿用随机词表译文。"""
+
+    if text_source is None:
+        return generate_random_text(rng)
+    return text_source.translate(src_text, rng)
+
+
+def build_translation_response_value(
+    value: Any,
+    rng: random.Random,
+    text_source: TranslationTextSource | None = None,
+) -> Any:
+    """根据输入 value 形状生成同构翻译响应。"""
+
+    if isinstance(value, dict) and "actor" in value and "text" in value:
+        return {
+            "actor": build_translation_actor_target(value.get("actor")),
+            "text": build_translation_text(value.get("text"), rng, text_source),
+        }
+    return build_translation_text(value, rng, text_source)
+
+
+def choose_content_faults(
+    config: MockServerConfig, rng: random.Random
+) -> tuple[str, ...]:
+    """按各模式的概率独立抽取本次响应要注入的内容故障。"""
+
+    chosen = {mode for mode, rate in config.content_faults if rng.random() < rate}
+    return tuple(mode for mode in CONTENT_FAULT_MODES if mode in chosen)
+
+
+def apply_content_faults(
+    items: list[Any],
+    sources: list[str],
+    faults: tuple[str, ...],
+    rng: random.Random,
+    *,
+    edit_text: Callable[[Any, Callable[[str], str]], Any],
+    swap: Callable[[list[Any], int], None],
+    make_extra: Callable[[], Any],
+) -> list[Any]:
+    """把选中的内容故障施加到输出行上。
+
+    items 与 sources 逐行对齐；不同任务的行形状不同，改写译文、交换结构和补一条多余行
+    这三个动作由调用方提供。
+    """
+
+    items = list(items)
+    for fault in faults:
+        if not items:
+            break
+        index = rng.randrange(len(items))
+        if fault == FAULT_UNTRANSLATED:
+            items = [
+                edit_text(item, lambda _, src=src: src)
+                for item, src in zip(items, sources, strict=True)
+            ]
+        elif fault == FAULT_SOURCE_RESIDUE:
+            residue = "".join(sources[index].split())[:FAULT_SOURCE_RESIDUE_CHARS]
+            items[index] = edit_text(
+                items[index], lambda text, tail=residue: text + tail
+            )
+        elif fault == FAULT_REPETITION:
+            items[index] = edit_text(
+                items[index],
+                lambda text: text + FAULT_REPETITION_UNIT * FAULT_REPETITION_CHARS,
+            )
+        elif fault == FAULT_SWAPPED_KEYS:
+            swap(items, index)
+        elif fault == FAULT_MISSING_LINE:
+            del items[index]
+        elif fault == FAULT_EXTRA_LINE:
+            items.append(make_extra())
+    return items
+
+
+def swap_adjacent_items(items: list[Any], index: int) -> None:
+    """把第 index 行与相邻行对调，只有一行时不做处理。"""
+
+    if len(items) < 2:
+        return
+    other = index + 1 if index + 1 < len(items) else index - 1
+    items[index], items[other] = items[other], items[index]
+
+
+def swap_adjacent_keys(items: list[tuple[str, Any]], index: int) -> None:
+    """只对调相邻两行的 key：行数不变，但译文落到了错误的原文上。"""
+
+    if len(items) < 2:
+        return
+    other = index + 1 if index + 1 < len(items) else index - 1
+    (key_a, value_a), (key_b, value_b) = items[index], items[other]
+    items[index], items[other] = (key_b, value_a), (key_a, value_b)
+
+
+def edit_translation_value(value: Any, transform: Callable[[str], str]) -> Any:
+    """改写译文文本，带 actor 的对象只改 text。"""
+
+    if isinstance(value, dict) and "text" in value:
+        return {**value, "text": transform(str(value.get("text") or ""))}
+    return transform(str(value or ""))
+
+
+def build_translation_json_lines(
+    entries: list[TranslationRequestEntry],
+    rng: random.Random,
+    text_source: TranslationTextSource | None = None,
+    faults: tuple[str, ...] = (),
+) -> list[str]:
+    """生成翻译响应的 JSONLINE 行，流式与非流式共用。"""
+
+    pairs = [
+        (entry.key, build_translation_response_value(entry.value, rng, text_source))
+        for entry in entries
+    ]
+    if faults:
+        pairs = apply_content_faults(
+            pairs,
+            [
+                str((v.get("text") if isinstance(v, dict) else v) or "")
+                for v in (entry.value for entry in entries)
+            ],
+            faults,
+            rng,
+            edit_text=lambda pair, transform: (
+                pair[0],
+                edit_translation_value(pair[1], transform),
+            ),
+            swap=swap_adjacent_keys,
+            make_extra=lambda: (
+                str(len(entries)),
+                build_translation_text("", rng, text_source),
+            ),
+        )
+    return [
+        json.dumps({key: value}, ensure_ascii=False, separators=(",", ":"))
+        for key, value in pairs
+    ]
+
+
+def build_jsonline_response(
+    entries: list[TranslationRequestEntry],
+    rng: random.Random,
+    text_source: TranslationTextSource | None = None,
+    faults: tuple[str, ...] = (),
+) -> str:
+    """把翻译条目写成 fenced JSONLINE 响应。"""
+
+    lines = [
+        "```jsonline",
+        *build_translation_json_lines(entries, rng, text_source, faults),
+        "```",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def resolve_translation_response_entries(
+    request_text: str,
+) -> list[TranslationRequestEntry]:
+    """翻译模式统一解析输入 key/value，避免流式与非流式逻辑各维护一份。"""
+
+    jsonline_payload = extract_jsonline_block(request_text)
+    entries = parse_jsonline_entries(jsonline_payload)
+    if not entries:
+        non_empty_lines = [v for v in jsonline_payload.splitlines() if v.strip()]
+        if non_empty_lines:
+            entries = [
+                TranslationRequestEntry(key=str(i), value=line)
+                for i, line in enumerate(non_empty_lines)
+            ]
+        else:
+            # 兜底：没有解析到输入 JSONLINE 时，仍然返回 1 行，避免调用方卡死
+            entries = [TranslationRequestEntry(key="0", value="")]
+
+    return entries
+
+
+def build_translation_response_content(
+    request_text: str,
+    rng: random.Random,
+    text_source: TranslationTextSource | None = None,
+    faults: tuple[str, ...] = (),
+) -> str:
+    """翻译模式继续沿用按输入 key 数量回填随机 JSONLINE 的旧语义。"""
+
+    entries = resolve_translation_response_entries(request_text)
+    return build_jsonline_response(entries, rng, text_source, faults)
 
 
 def build_translation_stream_chunks(
     request_text: str,
     rng: random.Random,
     chunk_lines: int,
+    text_source: TranslationTextSource | None = None,
+    faults: tuple[str, ...] = (),
 ) -> list[str]:
     """流式翻译模式保留原有按 JSONLINE 行分块的行为。"""
 
     entries = resolve_translation_response_entries(request_text)
-    return build_stream_content_chunks(entries, rng, chunk_lines)
+    return build_stream_content_chunks(entries, rng, chunk_lines, text_source, faults)
 
 
-def build_analysis_response_content(request_text: str, rng: random.Random) -> str:
+def swap_term_fields(terms: list[dict[str, str]], index: int) -> None:
+    """术语条目的 src/dst 对调，模拟模型把两个字段写反。"""
+
+    term = terms[index]
+    terms[index] = {**term, "src": term["dst"], "dst": term["src"]}
+
+
+def build_analysis_response_content(
+    request_text: str, rng: random.Random, faults: tuple[str, ...] = ()
+) -> str:
     """分析模式只模拟数据形状，不试图复刻真实术语抽取能力。"""
 
     lines = parse_analysis_input_lines(request_text)
-    glossary_lines: list[str] = []
+    terms: list[dict[str, str]] = []
 
     for line in lines:
         src_text = extract_analysis_term_source(line)
         if src_text is None:
             continue
 
-        glossary_lines.append(
-            json.dumps(
-                {
-                    "src": src_text,
-                    "dst": build_analysis_term_target(src_text, rng),
-                    "type": choose_analysis_term_type(src_text),
-                },
-                ensure_ascii=False,
-                separators=(",", ":"),
-            )
+        terms.append(
+            {
+                "src": src_text,
+                "dst": build_analysis_term_target(src_text, rng),
+                "type": choose_analysis_term_type(src_text),
+            }
+        )
+
+    if faults:
+        terms = apply_content_faults(
+            terms,
+            [term["src"] for term in terms],
+            faults,
+            rng,
+            edit_text=lambda term, transform: {**term, "dst": transform(term["dst"])},
+            swap=swap_term_fields,
+            make_extra=lambda: {
+                "src": generate_random_text(rng, min_words=1, max_words=2),
+                "dst": generate_random_text(rng, min_words=1, max_words=2),
+                "type": rng.choice(ANALYSIS_TERM_TYPES),
+            },
         )
 
-    if not glossary_lines:
+    if not terms:
         return ANALYSIS_EMPTY_RESULT
 
-    lines = ["```jsonline", *glossary_lines, "```"]
+    lines = [
+        "```jsonline",
+        *(
+            json.dumps(term, ensure_ascii=False, separators=(",", ":"))
+            for term in terms
+        ),
+        "```",
+    ]
     return "\n".join(lines) + "\n"
 
 
+def count_jsonline_lines(chunks: list[str]) -> int:
+    """统计响应正文里的 JSONLINE 数据行，不需要先把分块拼成整段。"""
+
+    count = 0
+    for chunk in chunks:
+        count += chunk.count("\n{")
+        if chunk.startswith("{"):
+            count += 1
+    return count
+
+
+def resolve_reasoning_effort(data: dict[str, Any], config: MockServerConfig) -> str:
+    """从请求中读取思考档位，兼容 Chat Completions 与 Responses 两种字段。
+
+    未携带档位时：request 模式视为不思考，always 模式取 --reasoning-default-effort。
+    """
+
+    if config.reasoning_mode == REASONING_MODE_OFF:
+        return "none"
+
+    effort = data.get("reasoning_effort")
+    reasoning = data.get("reasoning")
+    if effort is None and isinstance(reasoning, dict):
+        effort = reasoning.get("effort")
+    if isinstance(effort, str) and effort.lower() in REASONING_EFFORT_TOKENS:
+        return effort.lower()
+    if config.reasoning_mode == REASONING_MODE_ALWAYS:
+        return config.reasoning_default_effort
+    return "none"
+
+
+def generate_reasoning_text(
+    effort: str, rng: random.Random, config: MockServerConfig
+) -> str:
+    """按档位生成思考文本，长度与 estimate_tokens 的字符口径一致。"""
+
+    target_tokens = REASONING_EFFORT_TOKENS.get(effort, 0) * config.reasoning_scale
+    if target_tokens <= 0:
+        return ""
+    target_chars = target_tokens * 4 * rng.uniform(0.8, 1.2)
+    word_count = max(1, round(target_chars / VOCABULARY_MEAN_CHARS["en"]))
+    return join_vocabulary_words(rng, TEXT_VOCABULARIES["en"], word_count)
+
+
+def split_reasoning_chunks(reasoning_text: str) -> list[str]:
+    """把思考文本切成小段 delta，贴近真实推理流的细粒度输出。"""
+
+    return [
+        reasoning_text[i : i + REASONING_DELTA_CHARS]
+        for i in range(0, len(reasoning_text), REASONING_DELTA_CHARS)
+    ]
+
+
+def load_tool_script(path: str | None, rounds: int) -> tuple[dict[str, Any], ...]:
+    """加载工具调用脚本；未给文件时按 --tool-rounds 生成每轮调用一次工具的默认脚本。
+
+    脚本是 JSON 数组，每步为 {"tool_calls": [{"name": ..., "arguments": ...}]}
+    或终止步 {"content": "最终回答"}；name/arguments 缺省时取请求 tools 并按 schema 合成参数。
+    """
+
+    if path is None:
+        return tuple({"tool_calls": [{}]} for _ in range(max(0, rounds)))
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            steps = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Invalid tool script {path}: {e}") from e
+    if not isinstance(steps, list) or not all(
+        isinstance(step, dict)
+        and (isinstance(step.get("tool_calls"), list) or "content" in step)
+        for step in steps
+    ):
+        raise SystemExit(
+            f"Invalid tool script {path}: expected a list of tool_calls/content steps"
+        )
+    return tuple(steps)
+
+
+def count_completed_tool_rounds(messages: Any) -> int:
+    """最后一条 user 消息之后带 tool_calls 的 assistant 消息数即本回合已完成的工具轮次。
+
+    更早回合里的工具调用属于已经回答过的问题，不计入当前回合。
+    """
+
+    if not isinstance(messages, list):
+        return 0
+    rounds = 0
+    for message in messages:
+        if not isinstance(message, dict):
+            continue
+        if message.get("role") == "user":
+            rounds = 0
+        elif message.get("role") == "assistant" and message.get("tool_calls"):
+            rounds += 1
+    return rounds
+
+
+def resolve_tool_step(
+    data: dict[str, Any], config: MockServerConfig
+) -> dict[str, Any] | None:
+    """按对话中已完成的轮次选出脚本当前步；请求未带 tools 或脚本已走完时返回 None。"""
+
+    tools = data.get("tools")
+    if not config.tool_script or not isinstance(tools, list) or not tools:
+        return None
+    rounds = count_completed_tool_rounds(data.get("messages"))
+    if rounds >= len(config.tool_script):
+        return None
+    return config.tool_script[rounds]
+
+
+def build_schema_arguments(schema: Any, rng: random.Random) -> Any:
+    """按 JSON Schema 合成一份能通过基本类型校验的参数。"""
+
+    if not isinstance(schema, dict):
+        return generate_random_text(rng, min_words=1, max_words=3)
+    enum = schema.get("enum")
+    if isinstance(enum, list) and enum:
+        return rng.choice(enum)
+    schema_type = schema.get("type")
+    if schema_type == "object" or "properties" in schema:
+        properties = schema.get("properties")
+        if not isinstance(properties, dict):
+            return {}
+        return {
+            name: build_schema_arguments(item, rng) for name, item in properties.items()
+        }
+    if schema_type == "array":
+        return [build_schema_arguments(schema.get("items"), rng)]
+    if schema_type == "integer":
+        return rng.randint(0, 100)
+    if schema_type == "number":
+        return round(rng.uniform(0, 100), 2)
+    if schema_type == "boolean":
+        return rng.random() < 0.5
+    return generate_random_text(rng, min_words=1, max_words=3)
+
+
+def build_scripted_tool_calls(
+    step: dict[str, Any], tools: list[Any], rng: random.Random
+) -> list[dict[str, Any]]:
+    """把脚本步展开成 Chat Completions 的 tool_calls 列表。"""
+
+    functions = [
+        tool.get("function")
+        for tool in tools
+        if isinstance(tool, dict) and isinstance(tool.get("function"), dict)
+    ]
+    tool_calls: list[dict[str, Any]] = []
+    for i, call in enumerate(step["tool_calls"]):
+        call = call if isinstance(call, dict) else {}
+        function = next(
+            (f for f in functions if f.get("name") == call.get("name")),
+            functions[i % len(functions)] if functions else {},
+        )
+        name = str(call.get("name") or function.get("name") or "tool")
+        arguments = call.get("arguments")
+        if arguments is None:
+            arguments = build_schema_arguments(function.get("parameters"), rng)
+        if not isinstance(arguments, str):
+            arguments = json.dumps(arguments, ensure_ascii=False)
+        tool_calls.append(
+            {
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": {"name": name, "arguments": arguments},
+            }
+        )
+    return tool_calls
+
+
+def build_tool_call_deltas(tool_calls: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """按真实服务的形状拆 tool_calls delta：首块带 id/name，参数 JSON 再分段续传。"""
+
+    deltas: list[dict[str, Any]] = []
+    for index, call in enumerate(tool_calls):
+        function = call["function"]
+        deltas.append(
+            {
+                "tool_calls": [
+                    {
+                        "index": index,
+                        "id": call["id"],
+                        "type": "function",
+                        "function": {"name": function["name"], "arguments": ""},
+                    }
+                ]
+            }
+        )
+        arguments = function["arguments"]
+        for start in range(0, len(arguments), TOOL_ARGUMENT_DELTA_CHARS):
+            deltas.append(
+                {
+                    "tool_calls": [
+                        {
+                            "index": index,
+                            "function": {
+                                "arguments": arguments[
+                                    start : start + TOOL_ARGUMENT_DELTA_CHARS
+                                ]
+                            },
+                        }
+                    ]
+                }
+            )
+    return deltas
+
+
 def estimate_tokens(text: str) -> int:
     """用字符长度粗估 token 数，满足 mock usage 统计即可。"""
 
@@ -542,20 +3494,28 @@ def build_chat_completion_response(
     *,
     model: str,
     content: str,
-    request_text: str,
+    prompt_tokens: int,
+    reasoning_content: str = "",
+    tool_calls: list[dict[str, Any]] | None = None,
+    cached_tokens: int | None = None,
 ) -> dict[str, Any]:
     """构造非流式 Chat Completions 兼容响应。"""
 
     created = int(time.time())
     completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
 
-    prompt_tokens = estimate_tokens(request_text)
-    completion_tokens = estimate_tokens(content)
-    usage = {
-        "prompt_tokens": prompt_tokens,
-        "completion_tokens": completion_tokens,
-        "total_tokens": prompt_tokens + completion_tokens,
-    }
+    usage = build_final_usage(
+        prompt_tokens=prompt_tokens,
+        response_text=content,
+        reasoning_text=reasoning_content,
+        cached_tokens=cached_tokens,
+    )
+    message: dict[str, Any] = {"role": "assistant", "content": content}
+    if reasoning_content:
+        message["reasoning_content"] = reasoning_content
+    if tool_calls:
+        message["content"] = None
+        message["tool_calls"] = tool_calls
 
     return {
         "id": completion_id,
@@ -565,8 +3525,8 @@ def build_chat_completion_response(
         "choices": [
             {
                 "index": 0,
-                "message": {"role": "assistant", "content": content},
-                "finish_reason": "stop",
+                "message": message,
+                "finish_reason": "tool_calls" if tool_calls else "stop",
             }
         ],
         "usage": usage,
@@ -580,7 +3540,7 @@ def build_chat_completion_chunk(
     model: str,
     delta: dict[str, Any],
     finish_reason: str | None,
-    usage: dict[str, int] | None = None,
+    usage: dict[str, Any] | None = None,
 ) -> dict[str, Any]:
     """构造单个 Chat Completions 流式 chunk。"""
 
@@ -602,16 +3562,32 @@ def build_chat_completion_chunk(
     return payload
 
 
-def build_final_usage(*, request_text: str, response_text: str) -> dict[str, int]:
-    """构造 include_usage 需要的最终 token 统计。"""
+def build_final_usage(
+    *,
+    prompt_tokens: int,
+    response_text: str,
+    reasoning_text: str = "",
+    cached_tokens: int | None = None,
+) -> dict[str, Any]:
+    """构造最终 token 统计；思考 token 计入 completion_tokens 并单独列出。
 
-    prompt_tokens = estimate_tokens(request_text)
-    completion_tokens = estimate_tokens(response_text)
-    return {
+    开启前缀缓存时命中的 token 同时写成 OpenAI 的 prompt_tokens_details.cached_tokens
+    和 Anthropic 风格的 cache_read_input_tokens，兼容按任一字段统计的客户端。
+    """
+
+    reasoning_tokens = estimate_tokens(reasoning_text)
+    completion_tokens = estimate_tokens(response_text) + reasoning_tokens
+    usage: dict[str, Any] = {
         "prompt_tokens": prompt_tokens,
         "completion_tokens": completion_tokens,
         "total_tokens": prompt_tokens + completion_tokens,
     }
+    if reasoning_tokens:
+        usage["completion_tokens_details"] = {"reasoning_tokens": reasoning_tokens}
+    if cached_tokens is not None:
+        usage["prompt_tokens_details"] = {"cached_tokens": cached_tokens}
+        usage["cache_read_input_tokens"] = cached_tokens
+    return usage
 
 
 def build_cors_headers() -> dict[str, str]:
@@ -619,7 +3595,7 @@ def build_cors_headers() -> dict[str, str]:
 
     return {
         "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Methods": "POST, GET, OPTIONS",
+        "Access-Control-Allow-Methods": "POST, GET, DELETE, OPTIONS",
         "Access-Control-Allow-Headers": "Authorization, Content-Type",
         "Access-Control-Max-Age": "86400",
     }
@@ -654,13 +3630,26 @@ async def write_http_response(
 ) -> None:
     """写出完整 HTTP 响应，并把客户端断开归一为 ClientDisconnected。"""
 
+    trace = REQUEST_TRACE.get()
+    if trace is not None:
+        headers = {
+            **headers,
+            "Server-Timing": trace.server_timing(final=False),
+            "X-Request-Id": trace.request_id,
+        }
+        traceresponse = trace.traceresponse()
+        if traceresponse is not None:
+            headers["traceresponse"] = traceresponse
+        trace.mark_response_start(status)
+
     reason = STATUS_REASON.get(status, "")
     header_lines = [f"HTTP/1.1 {status} {reason}\r\n"]
     for k, v in headers.items():
         header_lines.append(f"{k}: {v}\r\n")
     header_lines.append("\r\n")
+    head = "".join(header_lines).encode("latin-1")
     try:
-        writer.write("".join(header_lines).encode("latin-1"))
+        writer.write(head)
         if body:
             writer.write(body)
         await writer.drain()
@@ -668,6 +3657,9 @@ async def write_http_response(
         if is_client_disconnect_error(e):
             raise ClientDisconnected() from e
         raise
+    if trace is not None:
+        trace.bytes_out += len(head) + len(body)
+        trace.last_byte_mono = time.monotonic()
 
 
 async def write_chunk(writer: asyncio.StreamWriter, data: bytes) -> None:
@@ -683,42 +3675,75 @@ async def write_chunk(writer: asyncio.StreamWriter, data: bytes) -> None:
         if is_client_disconnect_error(e):
             raise ClientDisconnected() from e
         raise
+    trace = REQUEST_TRACE.get()
+    if trace is not None:
+        trace.bytes_out += len(size_line) + len(data) + 2
 
 
 async def write_chunked_sse(
     writer: asyncio.StreamWriter,
     *,
-    sse_messages: list[str],
+    sse_messages: list[bytes],
     delays_s: list[float],
     headers: dict[str, str],
+    timer: TimingWheel | None = None,
 ) -> None:
-    """按预设延迟写出 chunked SSE 消息序列。"""
+    """按预设延迟写出已编码的 chunked SSE 消息序列。
+
+    首/末字节时间在发 header 时还不知道，因此放进 Server-Timing trailer。
+    """
+
+    trace = REQUEST_TRACE.get()
+    if trace is not None:
+        headers = {
+            **headers,
+            "Server-Timing": trace.server_timing(final=False),
+            "X-Request-Id": trace.request_id,
+            "Trailer": "Server-Timing",
+        }
+        traceresponse = trace.traceresponse()
+        if traceresponse is not None:
+            headers["traceresponse"] = traceresponse
+        trace.mark_response_start(200)
 
     reason = STATUS_REASON.get(200, "")
     header_lines = [f"HTTP/1.1 200 {reason}\r\n"]
     for k, v in headers.items():
         header_lines.append(f"{k}: {v}\r\n")
     header_lines.append("\r\n")
+    head = "".join(header_lines).encode("latin-1")
     try:
-        writer.write("".join(header_lines).encode("latin-1"))
+        writer.write(head)
         await writer.drain()
     except Exception as e:
         if is_client_disconnect_error(e):
             raise ClientDisconnected() from e
         raise
+    if trace is not None:
+        trace.bytes_out += len(head)
 
     for msg, delay_s in zip(sse_messages, delays_s, strict=True):
         if delay_s > 0:
-            await asyncio.sleep(delay_s)
-        await write_chunk(writer, msg.encode("utf-8"))
-
+            await pause(delay_s, timer)
+        await write_chunk(writer, msg)
+        if trace is not None and trace.first_chunk_mono is None:
+            trace.first_chunk_mono = time.monotonic()
+
+    trailer = b"0\r\n\r\n"
+    if trace is not None:
+        trace.last_byte_mono = time.monotonic()
+        trailer = (
+            "0\r\nServer-Timing: " + trace.server_timing(final=True) + "\r\n\r\n"
+        ).encode("latin-1")
     try:
-        writer.write(b"0\r\n\r\n")
+        writer.write(trailer)
         await writer.drain()
     except Exception as e:
         if is_client_disconnect_error(e):
             raise ClientDisconnected() from e
         raise
+    if trace is not None:
+        trace.bytes_out += len(trailer)
 
 
 def split_total_delay(
@@ -753,18 +3778,15 @@ def group_lines_for_streaming(lines: list[str], chunk_lines: int) -> list[str]:
 
 
 def build_stream_content_chunks(
-    entries: list[TranslationRequestEntry], rng: random.Random, chunk_lines: int
+    entries: list[TranslationRequestEntry],
+    rng: random.Random,
+    chunk_lines: int,
+    text_source: TranslationTextSource | None = None,
+    faults: tuple[str, ...] = (),
 ) -> list[str]:
     """生成翻译流式响应的 fenced JSONLINE 内容块。"""
 
-    json_lines = [
-        json.dumps(
-            {entry.key: build_translation_response_value(entry.value, rng)},
-            ensure_ascii=False,
-            separators=(",", ":"),
-        )
-        for entry in entries
-    ]
+    json_lines = build_translation_json_lines(entries, rng, text_source, faults)
 
     chunks = ["```jsonline\n"]
     chunks.extend(group_lines_for_streaming(json_lines, chunk_lines))
@@ -805,9 +3827,11 @@ def build_sse_messages(
     created: int,
     model: str,
     content_chunks: list[str],
-    finish_usage: dict[str, int] | None,
+    finish_usage: dict[str, Any] | None,
+    reasoning_chunks: list[str] | None = None,
+    tool_call_deltas: list[dict[str, Any]] | None = None,
 ) -> list[str]:
-    """把 role/content/stop/usage/DONE 统一转成 SSE 文本，便于测试和复用。"""
+    """把 role/reasoning/content/tool_calls/stop/usage/DONE 统一转成 SSE 文本，便于测试和复用。"""
 
     sse_messages: list[str] = []
     sse_messages.append(
@@ -825,6 +3849,22 @@ def build_sse_messages(
         + "\n\n"
     )
 
+    for chunk in reasoning_chunks or []:
+        sse_messages.append(
+            "data: "
+            + json.dumps(
+                build_chat_completion_chunk(
+                    completion_id=completion_id,
+                    created=created,
+                    model=model,
+                    delta={"reasoning_content": chunk},
+                    finish_reason=None,
+                ),
+                ensure_ascii=False,
+            )
+            + "\n\n"
+        )
+
     for chunk in content_chunks:
         sse_messages.append(
             "data: "
@@ -841,6 +3881,22 @@ def build_sse_messages(
             + "\n\n"
         )
 
+    for delta in tool_call_deltas or []:
+        sse_messages.append(
+            "data: "
+            + json.dumps(
+                build_chat_completion_chunk(
+                    completion_id=completion_id,
+                    created=created,
+                    model=model,
+                    delta=delta,
+                    finish_reason=None,
+                ),
+                ensure_ascii=False,
+            )
+            + "\n\n"
+        )
+
     sse_messages.append(
         "data: "
         + json.dumps(
@@ -849,7 +3905,7 @@ def build_sse_messages(
                 created=created,
                 model=model,
                 delta={},
-                finish_reason="stop",
+                finish_reason="tool_calls" if tool_call_deltas else "stop",
             ),
             ensure_ascii=False,
         )
@@ -871,36 +3927,219 @@ def build_sse_messages(
     return sse_messages
 
 
-async def handle_chat_completions(
-    request: HttpRequest,
-    writer: asyncio.StreamWriter,
+def load_chat_request_payload(
+    body: bytes,
+    classifier: TaskClassifier | None = None,
     *,
-    min_jitter_s: float,
-    max_jitter_s: float,
-    stream_chunk_lines: int,
-    seed: int | None,
-    task: str,
-) -> None:
-    """处理 Chat Completions 请求并按任务模式生成 mock 响应。"""
-
-    if request.method != "POST":
-        raise HttpError(405, "Only POST is supported")
+    track_prefixes: bool = False,
+) -> ChatRequestPayload:
+    """缓冲路径：整体解析 JSON 请求体，结果形状与流式扫描一致。"""
 
     try:
-        data = json.loads(request.body.decode("utf-8"))
+        data = json.loads(body.decode("utf-8"))
     except Exception as e:
         raise HttpError(400, f"Invalid JSON body: {e}") from e
+    if not isinstance(data, dict):
+        raise HttpError(400, "Invalid JSON body: expected an object")
+
+    request_text = pick_user_prompt_text(data.get("messages"))
+    task: str | None = None
+    if classifier is not None:
+        task = classify_buffered_request(data.get("messages"), request_text, classifier)
+    return ChatRequestPayload(
+        data=data,
+        request_text=request_text,
+        prompt_tokens=estimate_tokens(request_text),
+        body_digest=hashlib.blake2b(body, digest_size=8).digest(),
+        task=task,
+        prefix_chain=build_prefix_chain(data.get("messages")) if track_prefixes else (),
+    )
+
+
+def classify_buffered_request(
+    messages: Any, request_text: str, classifier: TaskClassifier
+) -> str:
+    """缓冲路径的 auto 分类：有 system prompt 走缓存，否则看用户正文结构。"""
+
+    system_texts = [
+        coerce_message_text(message.get("content"))
+        for message in (messages if isinstance(messages, list) else [])
+        if isinstance(message, dict) and message.get("role") in SYSTEM_ROLES
+    ]
+    if system_texts:
+        digests = [
+            hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+            for text in system_texts
+        ]
+        probe = "".join(text[:TASK_SYSTEM_PROBE_CHARS] for text in system_texts)
+        return classifier.classify(digest_system_texts(digests), probe)
+    return classify_user_prompt(
+        bool(extract_jsonline_block(request_text)),
+        find_last_prefix(request_text, SAKURA_INPUT_PREFIXES)[0] >= 0,
+        find_last_analysis_prefix(request_text)[0] >= 0,
+    )
+
+
+def negotiate_response_encoding(accept_encoding: str) -> str | None:
+    """按 Accept-Encoding 在 gzip/deflate 中选一个，q=0 视为拒绝；都不接受时返回 None。"""
+
+    weights: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name.strip():
+            weights[name.strip().lower()] = weight
+    for encoding in CONTENT_ENCODINGS:
+        if weights.get(encoding, weights.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def json_string_offsets(message: bytes) -> list[int]:
+    """返回 SSE data 行里落在 JSON 字符串字面量内部的切分偏移（两侧都至少留一个字符）。"""
+
+    offsets: list[int] = []
+    pos = message.find(b"{")
+    if pos < 0:
+        return offsets
+    while (open_quote := message.find(b'"', pos)) >= 0:
+        close_quote = open_quote + 1
+        while close_quote < len(message) and message[close_quote] != 0x22:
+            # 反斜杠转义连同下一个字节一起跳过，切在转义序列中间同样算字符串内部
+            close_quote += 2 if message[close_quote] == 0x5C else 1
+        offsets.extend(range(open_quote + 2, min(close_quote, len(message))))
+        pos = close_quote + 1
+    return offsets
+
+
+def choose_fragment_offsets(message: bytes, mode: str, rng: random.Random) -> list[int]:
+    """按模式挑出切分偏移（升序）；找不到合适位置时返回空列表。"""
+
+    if len(message) < 2:
+        return []
+    if mode == FRAGMENT_BYTE:
+        return list(range(1, len(message)))
+    if mode == FRAGMENT_UTF8:
+        # 续字节 10xxxxxx 前切开，必然落在多字节字符中间
+        candidates = [
+            pos for pos in range(1, len(message)) if message[pos] & 0xC0 == 0x80
+        ]
+    elif mode == FRAGMENT_JSON_STRING:
+        candidates = json_string_offsets(message)
+    else:
+        candidates = range(1, len(message))
+    if not candidates:
+        return []
+    count = min(len(candidates), rng.randint(1, SSE_FRAGMENT_MAX_SPLITS))
+    return sorted(rng.sample(candidates, count))
+
+
+def fragment_sse_messages(
+    messages: list[bytes],
+    delays_s: list[float],
+    config: MockServerConfig,
+    rng: random.Random,
+) -> tuple[list[bytes], list[float]]:
+    """把 SSE 消息按配置切成多片；首片沿用原消息的等待，其余片紧随其后写出。"""
+
+    fragmented: list[bytes] = []
+    fragmented_delays: list[float] = []
+    counts: dict[str, tuple[int, int]] = {}
+    for message, delay_s in zip(messages, delays_s, strict=True):
+        offsets: list[int] = []
+        for mode, rate in config.sse_fragments:
+            if rng.random() < rate:
+                offsets = choose_fragment_offsets(message, mode, rng)
+                if offsets:
+                    hit_messages, extra_writes = counts.get(mode, (0, 0))
+                    counts[mode] = (hit_messages + 1, extra_writes + len(offsets))
+                break
+        bounds = [0, *offsets, len(message)]
+        for index in range(len(bounds) - 1):
+            fragmented.append(message[bounds[index] : bounds[index + 1]])
+            fragmented_delays.append(delay_s if index == 0 else 0.0)
+
+    trace = REQUEST_TRACE.get()
+    if trace is not None:
+        trace.sse_fragments = counts
+    return fragmented, fragmented_delays
+
+
+def compress_reply(
+    request: HttpRequest, reply: ChatReply, config: MockServerConfig
+) -> ChatReply:
+    """按配置与 Accept-Encoding 压缩响应。
+
+    非流式整体压缩；流式每条 SSE 消息各做一次 Z_SYNC_FLUSH，客户端收到即可解出整条事件，
+    最后一条消息带上流结尾。原始/压缩字节与 CPU 记入请求轨迹。
+    """
+
+    enabled = config.sse_compression if reply.stream else config.response_compression
+    raw_bytes = sum(len(msg) for msg in reply.messages)
+    if not enabled or raw_bytes < config.compress_min_bytes:
+        return reply
+    encoding = negotiate_response_encoding(request.headers.get("accept-encoding", ""))
+    if encoding is None:
+        return reply
+
+    cpu_start = time.thread_time()
+    wbits = 16 + zlib.MAX_WBITS if encoding == "gzip" else zlib.MAX_WBITS
+    compressor = zlib.compressobj(config.compression_level, zlib.DEFLATED, wbits)
+    if reply.stream:
+        messages = [
+            compressor.compress(msg) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            for msg in reply.messages
+        ]
+        messages[-1] += compressor.flush(zlib.Z_FINISH)
+    else:
+        messages = [compressor.compress(b"".join(reply.messages)) + compressor.flush()]
 
-    if seed is None:
+    trace = REQUEST_TRACE.get()
+    if trace is not None:
+        trace.response_encoding = encoding
+        trace.response_raw_bytes = raw_bytes
+        trace.response_encoded_bytes = sum(len(msg) for msg in messages)
+        trace.response_codec_cpu_s = time.thread_time() - cpu_start
+    return dataclasses.replace(reply, messages=messages, content_encoding=encoding)
+
+
+def build_chat_reply(
+    request: HttpRequest,
+    *,
+    config: MockServerConfig,
+    corpus: ResponseCorpus | None = None,
+    classifier: TaskClassifier | None = None,
+    prefix_cache: PrefixCache | None = None,
+) -> ChatReply:
+    """解析 chat 请求并生成完整响应（纯 CPU，不碰 ServerState，可在工作线程执行）。"""
+
+    set_request_phase("parse")
+    payload = request.payload or load_chat_request_payload(
+        request.body, classifier, track_prefixes=prefix_cache is not None
+    )
+    data = payload.data
+    request_text = payload.request_text
+
+    task = payload.task or config.task
+    stream_chunk_lines = config.stream_chunk_lines
+    if config.seed is None:
         rng = random.Random()
     else:
-        digest = hashlib.blake2b(request.body, digest_size=8).digest()
-        rng_seed = seed ^ int.from_bytes(digest, byteorder="big", signed=False)
+        rng_seed = config.seed ^ int.from_bytes(
+            payload.body_digest, byteorder="big", signed=False
+        )
         rng = random.Random(rng_seed)
 
     model = str(data.get("model") or "mock-llm")
-    messages = data.get("messages")
-    request_text = pick_user_prompt_text(messages)
+    trace = REQUEST_TRACE.get()
+    text_source = TranslationTextSource(corpus=corpus, output_model=config.output_model)
 
     stream = bool(data.get("stream", False))
     stream_options = data.get("stream_options")
@@ -908,58 +4147,257 @@ async def handle_chat_completions(
     if isinstance(stream_options, dict):
         include_usage = bool(stream_options.get("include_usage", False))
 
-    total_delay_s = rng.uniform(min_jitter_s, max_jitter_s)
+    total_delay_s = rng.uniform(config.min_jitter_s, config.max_jitter_s)
+
+    prompt_tokens = payload.prompt_tokens
+    cached_tokens: int | None = None
+    if prefix_cache is not None:
+        # 缓存按整段消息前缀计，prompt_tokens 也改为覆盖全部消息，cached_tokens 才是它的一部分
+        if payload.prefix_chain:
+            prompt_tokens = max(prompt_tokens, payload.prefix_chain[-1][1])
+        cached_tokens = prefix_cache.admit(model, payload.prefix_chain)
+    # 预填充只处理未命中的 token，命中缓存直接缩短首字节时间
+    prefill_delay_s = (
+        (prompt_tokens - (cached_tokens or 0)) / config.prefill_tokens_per_s
+        if config.prefill_tokens_per_s > 0
+        else 0.0
+    )
+
+    if trace is not None:
+        trace.task = task
+        trace.model = model
+        trace.stream = stream
+        trace.jitter_s = total_delay_s
+        trace.cached_tokens = cached_tokens
+    cpu_start = time.thread_time()
+
+    set_request_phase("generate")
+    reasoning_text = generate_reasoning_text(
+        resolve_reasoning_effort(data, config), rng, config
+    )
+    reasoning_tokens = estimate_tokens(reasoning_text)
+    # 思考阶段按配置的吐字速度额外耗时，叠加在网络抖动之上
+    reasoning_delay_s = (
+        reasoning_tokens / config.reasoning_tokens_per_s
+        if config.reasoning_tokens_per_s > 0
+        else 0.0
+    )
+    if trace is not None:
+        trace.reasoning_tokens = reasoning_tokens
+
+    # 工具脚本：调用步只返回 tool_calls，终止步用脚本里的回答替换任务输出
+    tool_step = resolve_tool_step(data, config)
+    tool_calls: list[dict[str, Any]] = []
+    scripted_content: str | None = None
+    if tool_step is not None:
+        if isinstance(tool_step.get("tool_calls"), list):
+            tool_calls = build_scripted_tool_calls(tool_step, data["tools"], rng)
+        else:
+            scripted_content = str(tool_step.get("content") or "")
+        if trace is not None:
+            trace.tool_calls = len(tool_calls)
+    tool_arguments_text = "".join(call["function"]["arguments"] for call in tool_calls)
+
+    # 内容故障只作用于任务输出，工具调用与脚本回答保持原样
+    faults: tuple[str, ...] = ()
+    if tool_step is None:
+        faults = choose_content_faults(config, rng)
+        if trace is not None:
+            trace.content_faults = faults
 
     if not stream:
-        if task == TASK_ANALYSIS:
-            response_content = build_analysis_response_content(request_text, rng)
+        if tool_calls:
+            response_content = tool_arguments_text
+        elif scripted_content is not None:
+            response_content = scripted_content
+        elif task == TASK_SAKURA:
+            response_content = build_sakura_response_content(
+                request_text, rng, text_source, faults
+            )
+        elif task == TASK_ANALYSIS:
+            response_content = build_analysis_response_content(
+                request_text, rng, faults
+            )
         else:
-            response_content = build_translation_response_content(request_text, rng)
-        payload = build_chat_completion_response(
+            response_content = build_translation_response_content(
+                request_text, rng, text_source, faults
+            )
+        response_obj = build_chat_completion_response(
             model=model,
             content=response_content,
-            request_text=request_text,
+            prompt_tokens=prompt_tokens,
+            reasoning_content=reasoning_text,
+            tool_calls=tool_calls,
+            cached_tokens=cached_tokens,
         )
-        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        body = json.dumps(response_obj, ensure_ascii=False).encode("utf-8")
+        if trace is not None:
+            trace.generate_cpu_s = time.thread_time() - cpu_start
+            trace.line_count = (
+                response_content.count("\n") + 1
+                if task == TASK_SAKURA and not tool_calls
+                else count_jsonline_lines([response_content])
+            )
+            trace.prompt_tokens = prompt_tokens
+            trace.completion_tokens = response_obj["usage"]["completion_tokens"]
 
-        await asyncio.sleep(total_delay_s)
-        headers = build_response_headers(
-            content_type="application/json; charset=utf-8",
-            content_length=len(body),
-            connection_close=True,
+        decode_delay_s = 0.0
+        if task == TASK_SAKURA and not tool_calls:
+            decode_delay_s = estimate_sakura_decode_s(
+                response_content, config.sakura_tokens_per_s
+            )
+        return compress_reply(
+            request,
+            ChatReply(
+                stream=False,
+                messages=[body],
+                delays_s=[
+                    total_delay_s + prefill_delay_s + reasoning_delay_s + decode_delay_s
+                ],
+            ),
+            config,
         )
-        await write_http_response(writer, status=200, headers=headers, body=body)
-        return
 
     completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
     created = int(time.time())
 
-    if task == TASK_ANALYSIS:
-        response_content = build_analysis_response_content(request_text, rng)
+    if tool_calls:
+        content_chunks = []
+    elif scripted_content is not None:
+        content_chunks = build_text_stream_chunks(scripted_content, stream_chunk_lines)
+    elif task == TASK_SAKURA:
+        response_content = build_sakura_response_content(
+            request_text, rng, text_source, faults
+        )
         content_chunks = build_text_stream_chunks(response_content, stream_chunk_lines)
+    elif task == TASK_ANALYSIS:
+        response_content = build_analysis_response_content(request_text, rng, faults)
+        content_chunks = build_text_stream_chunks(response_content, stream_chunk_lines)
+    else:
+        content_chunks = build_translation_stream_chunks(
+            request_text,
+            rng,
+            stream_chunk_lines,
+            text_source,
+            faults,
+        )
+
+    usage: dict[str, Any] | None = None
+    if include_usage:
+        usage = build_final_usage(
+            prompt_tokens=prompt_tokens,
+            response_text="".join(content_chunks) + tool_arguments_text,
+            reasoning_text=reasoning_text,
+            cached_tokens=cached_tokens,
+        )
+
+    reasoning_chunks = split_reasoning_chunks(reasoning_text)
+    sse_messages = build_sse_messages(
+        completion_id=completion_id,
+        created=created,
+        model=model,
+        content_chunks=content_chunks,
+        finish_usage=usage,
+        reasoning_chunks=reasoning_chunks,
+        tool_call_deltas=build_tool_call_deltas(tool_calls),
+    )
+
+    encoded_messages = [msg.encode("utf-8") for msg in sse_messages]
+    if trace is not None:
+        trace.generate_cpu_s = time.thread_time() - cpu_start
+        trace.line_count = (
+            "".join(content_chunks).count("\n") + 1
+            if task == TASK_SAKURA and content_chunks
+            else count_jsonline_lines(content_chunks)
+        )
+        trace.prompt_tokens = prompt_tokens
+        trace.completion_tokens = (
+            usage["completion_tokens"]
+            if usage is not None
+            else max(0, sum(len(chunk) for chunk in content_chunks) // 4)
+            + estimate_tokens(tool_arguments_text)
+            + reasoning_tokens
+        )
+    delays = split_total_delay(total_delay_s, len(encoded_messages), rng)
+    delays[0] += prefill_delay_s
+    if reasoning_chunks and reasoning_delay_s > 0:
+        # 思考 delta 紧跟 role 消息，均摊思考耗时，正文首块因此整体后移
+        per_chunk_s = reasoning_delay_s / len(reasoning_chunks)
+        for i in range(1, len(reasoning_chunks) + 1):
+            delays[i] += per_chunk_s
+    if task == TASK_SAKURA and config.sakura_tokens_per_s > 0:
+        # 本地模型逐 token 解码，每块正文的间隔按块长度和吐字速度计算
+        first_content = 1 + len(reasoning_chunks)
+        for offset, chunk in enumerate(content_chunks):
+            delays[first_content + offset] += estimate_sakura_decode_s(
+                chunk, config.sakura_tokens_per_s
+            )
+    if config.sse_fragments:
+        encoded_messages, delays = fragment_sse_messages(
+            encoded_messages, delays, config, rng
+        )
+    return compress_reply(
+        request,
+        ChatReply(stream=True, messages=encoded_messages, delays_s=delays),
+        config,
+    )
+
+
+async def handle_chat_completions(
+    request: HttpRequest,
+    writer: asyncio.StreamWriter,
+    *,
+    config: MockServerConfig,
+    lease: BudgetLease,
+    corpus: ResponseCorpus | None = None,
+    classifier: TaskClassifier | None = None,
+    prefix_cache: PrefixCache | None = None,
+    timer: TimingWheel | None = None,
+    offload: OffloadPool | None = None,
+) -> None:
+    """处理 Chat Completions 请求并按任务模式生成 mock 响应。"""
+
+    if request.method != "POST":
+        raise HttpError(405, "Only POST is supported")
+
+    trace = REQUEST_TRACE.get()
+    size = trace.body_bytes if trace is not None else len(request.body)
+    if offload is not None and offload.should_offload(size):
+        reply = await offload.run(
+            build_chat_reply,
+            request,
+            config=config,
+            corpus=corpus,
+            classifier=classifier,
+            prefix_cache=prefix_cache,
+        )
     else:
-        content_chunks = build_translation_stream_chunks(
-            request_text,
-            rng,
-            stream_chunk_lines,
+        if offload is not None:
+            offload.inline += 1
+        reply = build_chat_reply(
+            request,
+            config=config,
+            corpus=corpus,
+            classifier=classifier,
+            prefix_cache=prefix_cache,
         )
+    # 响应在抖动期间一直驻留内存，需要计入预算
+    lease.reserve(sum(len(msg) for msg in reply.messages))
 
-    usage: dict[str, int] | None = None
-    if include_usage:
-        usage = build_final_usage(
-            request_text=request_text,
-            response_text="".join(content_chunks),
+    if not reply.stream:
+        set_request_phase("respond")
+        await pause(reply.delays_s[0], timer)
+        body = reply.messages[0]
+        headers = build_response_headers(
+            content_type="application/json; charset=utf-8",
+            content_length=len(body),
+            connection_close=True,
         )
-
-    sse_messages = build_sse_messages(
-        completion_id=completion_id,
-        created=created,
-        model=model,
-        content_chunks=content_chunks,
-        finish_usage=usage,
-    )
-
-    delays = split_total_delay(total_delay_s, len(sse_messages), rng)
+        if reply.content_encoding is not None:
+            headers["Content-Encoding"] = reply.content_encoding
+            headers["Vary"] = "Accept-Encoding"
+        await write_http_response(writer, status=200, headers=headers, body=body)
+        return
 
     headers = {
         "Content-Type": "text/event-stream; charset=utf-8",
@@ -969,11 +4407,16 @@ async def handle_chat_completions(
         **build_cors_headers(),
         "Connection": "close",
     }
+    if reply.content_encoding is not None:
+        headers["Content-Encoding"] = reply.content_encoding
+        headers["Vary"] = "Accept-Encoding"
+    set_request_phase("stream")
     await write_chunked_sse(
         writer,
-        sse_messages=sse_messages,
-        delays_s=delays,
+        sse_messages=reply.messages,
+        delays_s=reply.delays_s,
         headers=headers,
+        timer=timer,
     )
 
 
@@ -1003,15 +4446,207 @@ async def handle_models(request: HttpRequest, writer: asyncio.StreamWriter) -> N
     await write_http_response(writer, status=200, headers=headers, body=body)
 
 
-async def handle_health(request: HttpRequest, writer: asyncio.StreamWriter) -> None:
-    """返回简单健康检查文本。"""
+async def handle_health(
+    request: HttpRequest, writer: asyncio.StreamWriter, *, state: ServerState
+) -> None:
+    """返回就绪/过载状态及准入计数；过载时用 503 方便探针直接判断。"""
+
+    if request.method != "GET":
+        raise HttpError(405, "Only GET is supported")
+
+    snapshot = state.snapshot()
+    body = json.dumps(snapshot, ensure_ascii=False).encode("utf-8")
+    headers = build_response_headers(
+        content_type="application/json; charset=utf-8",
+        content_length=len(body),
+        connection_close=True,
+    )
+    status = 200 if snapshot["status"] == "ok" else 503
+    if status == 503:
+        headers["Retry-After"] = str(state.config.retry_after_s)
+    await write_http_response(writer, status=status, headers=headers, body=body)
+
+
+async def write_json_response(
+    writer: asyncio.StreamWriter, body_obj: Any, *, status: int = 200
+) -> None:
+    """写出一个 JSON 响应。"""
+
+    body = json.dumps(body_obj, ensure_ascii=False).encode("utf-8")
+    headers = build_response_headers(
+        content_type="application/json; charset=utf-8",
+        content_length=len(body),
+        connection_close=True,
+    )
+    await write_http_response(writer, status=status, headers=headers, body=body)
+
+
+def parse_multipart_form(
+    body: bytes, content_type: str
+) -> dict[str, tuple[str | None, bytes]]:
+    """解析 multipart/form-data，返回 字段名 -> (文件名, 内容)。"""
+
+    media_type, _, params = content_type.partition(";")
+    boundary = ""
+    for param in params.split(";"):
+        key, _, value = param.strip().partition("=")
+        if key.lower() == "boundary":
+            boundary = value.strip().strip('"')
+    if media_type.strip().lower() != "multipart/form-data" or not boundary:
+        raise HttpError(400, "Expected multipart/form-data with a boundary")
+
+    fields: dict[str, tuple[str | None, bytes]] = {}
+    delimiter = b"--" + boundary.encode("latin-1")
+    for part in body.split(delimiter)[1:]:
+        if part.startswith(b"--"):
+            break
+        head, sep, data = part.removeprefix(b"\r\n").partition(b"\r\n\r\n")
+        if not sep:
+            raise HttpError(400, "Malformed multipart body")
+        name: str | None = None
+        filename: str | None = None
+        for header_line in head.decode("utf-8", errors="replace").split("\r\n"):
+            header_name, _, header_value = header_line.partition(":")
+            if header_name.strip().lower() != "content-disposition":
+                continue
+            for item in header_value.split(";"):
+                key, _, value = item.strip().partition("=")
+                if key == "name":
+                    name = value.strip('"')
+                elif key == "filename":
+                    filename = value.strip('"')
+        if name is not None:
+            fields[name] = (filename, data.removesuffix(b"\r\n"))
+    return fields
+
+
+def load_json_object(body: bytes) -> dict[str, Any]:
+    """解析 JSON 对象请求体。"""
+
+    try:
+        data = json.loads(body or b"{}")
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise HttpError(400, f"Invalid JSON body: {e}") from e
+    if not isinstance(data, dict):
+        raise HttpError(400, "Request body must be a JSON object")
+    return data
+
+
+async def handle_files(
+    request: HttpRequest,
+    writer: asyncio.StreamWriter,
+    *,
+    batches: BatchService,
+    parts: list[str],
+) -> None:
+    """/v1/files：上传、列出、查询、删除与下载内容。"""
+
+    if not parts:
+        if request.method == "POST":
+            fields = parse_multipart_form(
+                request.body, request.headers.get("content-type", "")
+            )
+            purpose = fields.get("purpose", (None, b""))[1].decode("utf-8").strip()
+            if "file" not in fields or not purpose:
+                raise HttpError(400, "Both 'file' and 'purpose' fields are required")
+            filename, content = fields["file"]
+            stored = batches.add_file(
+                filename=filename or "upload.jsonl", purpose=purpose, content=content
+            )
+            await write_json_response(writer, stored.to_json())
+            return
+        if request.method == "GET":
+            data = [f.to_json() for f in batches.files.values()]
+            await write_json_response(writer, {"object": "list", "data": data})
+            return
+        raise HttpError(405, "Only GET and POST are supported")
+
+    stored = batches.get_file(parts[0])
+    if len(parts) == 2 and parts[1] == "content" and request.method == "GET":
+        headers = build_response_headers(
+            content_type="application/octet-stream",
+            content_length=len(stored.content),
+            connection_close=True,
+        )
+        await write_http_response(
+            writer, status=200, headers=headers, body=stored.content
+        )
+        return
+    if len(parts) == 1 and request.method == "GET":
+        await write_json_response(writer, stored.to_json())
+        return
+    if len(parts) == 1 and request.method == "DELETE":
+        del batches.files[stored.id]
+        await write_json_response(
+            writer, {"id": stored.id, "object": "file", "deleted": True}
+        )
+        return
+    raise HttpError(404, f"Not found: {request.target}")
+
+
+async def handle_batches(
+    request: HttpRequest,
+    writer: asyncio.StreamWriter,
+    *,
+    batches: BatchService,
+    parts: list[str],
+) -> None:
+    """/v1/batches：创建、列出、查询与取消。"""
+
+    if not parts:
+        if request.method == "POST":
+            job = batches.create(load_json_object(request.body))
+            await write_json_response(writer, job.to_json())
+            return
+        if request.method == "GET":
+            # 与 OpenAI 一致按创建时间倒序；after 为上一页最后一个 id
+            query = parse_qs(urlsplit(request.target).query)
+            try:
+                limit = int(query.get("limit", [BATCH_LIST_LIMIT])[0])
+            except ValueError:
+                limit = BATCH_LIST_LIMIT
+            jobs = list(reversed(batches.jobs.values()))
+            after = query.get("after", [None])[0]
+            if after is not None:
+                ids = [job.id for job in jobs]
+                jobs = jobs[ids.index(after) + 1 :] if after in ids else []
+            page = jobs[: max(1, limit)]
+            await write_json_response(
+                writer,
+                {
+                    "object": "list",
+                    "data": [job.to_json() for job in page],
+                    "first_id": page[0].id if page else None,
+                    "last_id": page[-1].id if page else None,
+                    "has_more": len(jobs) > len(page),
+                },
+            )
+            return
+        raise HttpError(405, "Only GET and POST are supported")
+
+    if len(parts) == 1 and request.method == "GET":
+        await write_json_response(writer, batches.get_job(parts[0]).to_json())
+        return
+    if len(parts) == 2 and parts[1] == "cancel" and request.method == "POST":
+        await write_json_response(writer, batches.cancel(parts[0]).to_json())
+        return
+    raise HttpError(404, f"Not found: {request.target}")
+
+
+async def handle_debug_soak(
+    request: HttpRequest, writer: asyncio.StreamWriter, *, state: ServerState
+) -> None:
+    """返回最近一次长稳采样；未开启 soak 模式时返回 404。"""
 
     if request.method != "GET":
         raise HttpError(405, "Only GET is supported")
+    if state.soak is None:
+        raise HttpError(404, "Soak mode is disabled (start with --soak-interval)")
 
-    body = b"ok\n"
+    body_obj = state.soak.latest or {"seq": -1}
+    body = json.dumps(body_obj, ensure_ascii=False).encode("utf-8")
     headers = build_response_headers(
-        content_type="text/plain; charset=utf-8",
+        content_type="application/json; charset=utf-8",
         content_length=len(body),
         connection_close=True,
     )
@@ -1029,6 +4664,544 @@ async def handle_options(writer: asyncio.StreamWriter) -> None:
     await write_http_response(writer, status=204, headers=headers, body=b"")
 
 
+class PromptTextScanner:
+    """按行增量扫描单条消息正文，只保留提取结果需要的片段。
+
+    翻译模式只留最后一个已闭合的 jsonline 代码块；分析/Sakura 模式只留最后一个
+    `输入：/Input:` 或 Sakura 指令之后的正文，语义与 extract_*/parse_* 系列函数保持一致。
+    """
+
+    def __init__(self, *, task: str, keep_untagged: bool = True) -> None:
+        """按任务决定需要保留的片段，避免为用不到的提取结果囤积正文。
+
+        auto 模式同时维护三种提取结果（分析/Sakura 只留标记之后的正文），
+        并为 system 消息保留摘要和有限长度的开头，供分类器使用。
+        """
+
+        self.task = task
+        self.keep_untagged = keep_untagged
+        self.delegates: dict[str, PromptTextScanner] = {}
+        self.digest: Any = None
+        self.probe_parts: list[str] = []
+        self.probe_chars = 0
+        if task == TASK_AUTO:
+            self.delegates = {
+                TASK_TRANSLATION: PromptTextScanner(task=TASK_TRANSLATION),
+                TASK_ANALYSIS: PromptTextScanner(
+                    task=TASK_ANALYSIS, keep_untagged=False
+                ),
+                TASK_SAKURA: PromptTextScanner(task=TASK_SAKURA, keep_untagged=False),
+            }
+            self.digest = hashlib.blake2b(digest_size=16)
+        self.char_count = 0
+        self.partial_parts: list[str] = []
+        self.in_block = False
+        self.current_is_jsonline = False
+        self.current_lines: list[str] = []
+        self.jsonline_lines: list[str] | None = None
+        self.tail_prefixes = (
+            SAKURA_INPUT_PREFIXES if task == TASK_SAKURA else ANALYSIS_INPUT_PREFIXES
+        )
+        self.analysis_marker_seen = False
+        self.analysis_tail: list[str] = []
+
+    def feed(self, text: str) -> None:
+        """接收一段正文；未结束的行留到下一段再处理。"""
+
+        if not text:
+            return
+
+        self.char_count += len(text)
+        if self.digest is not None:
+            self.digest.update(text.encode("utf-8", "surrogatepass"))
+            if self.probe_chars < TASK_SYSTEM_PROBE_CHARS:
+                piece = text[: TASK_SYSTEM_PROBE_CHARS - self.probe_chars]
+                self.probe_parts.append(piece)
+                self.probe_chars += len(piece)
+        # 只切分新到的片段；未结束的行按片段累积，行结束时才拼接，超长行也保持线性
+        if (
+            self.partial_parts
+            and self.partial_parts[-1].endswith("\r")
+            and not text.startswith("\n")
+        ):
+            self.flush()
+        pieces = text.splitlines(keepends=True)
+        for index, piece in enumerate(pieces):
+            self.partial_parts.append(piece)
+            # 末尾是 \r 时可能还差一个 \n，和未结束的行一样先留着
+            if piece.splitlines() == [piece] or (
+                piece.endswith("\r") and index == len(pieces) - 1
+            ):
+                continue
+            self.consume_line("".join(self.partial_parts))
+            self.partial_parts = []
+
+    def consume_line(self, line: str) -> None:
+        """处理一整行（含行尾换行符）。"""
+
+        if self.delegates:
+            for delegate in self.delegates.values():
+                delegate.consume_line(line)
+            return
+
+        if self.task in (TASK_ANALYSIS, TASK_SAKURA):
+            index, prefix = find_last_prefix(line, self.tail_prefixes)
+            if index >= 0:
+                self.analysis_marker_seen = True
+                self.analysis_tail = [line[index + len(prefix) :]]
+            elif self.keep_untagged or self.analysis_marker_seen:
+                self.analysis_tail.append(line)
+            return
+
+        bare = line.splitlines()[0]
+        stripped = bare.strip()
+        if stripped.startswith("```"):
+            if not self.in_block:
+                lang = stripped[3:].strip().lower()
+                self.current_is_jsonline = lang.startswith("jsonl")
+                self.current_lines = []
+                self.in_block = True
+                return
+
+            if self.current_is_jsonline:
+                self.jsonline_lines = self.current_lines
+            self.in_block = False
+            self.current_lines = []
+            return
+
+        if self.in_block and self.current_is_jsonline:
+            self.current_lines.append(bare)
+
+    def flush(self) -> None:
+        """冲刷最后一个未以换行结尾的行。"""
+
+        if self.partial_parts:
+            self.consume_line("".join(self.partial_parts))
+            self.partial_parts = []
+
+    def guess_task(self) -> str:
+        """auto 模式下没有 system prompt 时，按本条正文的提取结果判定任务。"""
+
+        self.flush()
+        return classify_user_prompt(
+            self.delegates[TASK_TRANSLATION].jsonline_lines is not None,
+            self.delegates[TASK_SAKURA].analysis_marker_seen,
+            self.delegates[TASK_ANALYSIS].analysis_marker_seen,
+        )
+
+    def finish(self, task: str | None = None) -> str:
+        """冲刷最后一行，并返回与原始正文提取结果等价的紧凑文本。"""
+
+        self.flush()
+        if self.delegates:
+            return self.delegates[task or TASK_TRANSLATION].finish()
+
+        if self.task in (TASK_ANALYSIS, TASK_SAKURA):
+            tail = "".join(self.analysis_tail)
+            return self.tail_prefixes[-1] + tail if self.analysis_marker_seen else tail
+
+        if self.jsonline_lines is None:
+            return ""
+        return "```jsonline\n" + "\n".join(self.jsonline_lines) + "\n```\n"
+
+    def estimate_prompt_tokens(self) -> int:
+        """按完整正文长度估算 prompt token，和 estimate_tokens 的粗估口径一致。"""
+
+        if self.char_count == 0:
+            return 0
+        return max(1, self.char_count // 4)
+
+
+def is_unescaped_backslash(text: str, index: int) -> bool:
+    """判断 text[index] 的反斜杠是否真正开启转义（前面连续反斜杠为偶数个）。"""
+
+    count = 0
+    while index - count - 1 >= 0 and text[index - count - 1] == "\\":
+        count += 1
+    return count % 2 == 0
+
+
+@dataclass
+class JsonScanFrame:
+    """流式 JSON 扫描中的一层容器及其当前 key。"""
+
+    container: dict[str, Any] | list[Any]
+    key: str | None = None
+
+
+class ChatBodyScanner:
+    """边接收边扫描 chat 请求体的增量 JSON 解析器。
+
+    普通字段照常物化成 dict；messages[*].content（含多段 text）不入内存，
+    直接逐段喂给 PromptTextScanner。单请求峰值内存因此只取决于读取块大小
+    和提取出的 JSONLINE 块，而不是整个请求体。
+
+    多段 content 与 coerce_message_text 一样只取 type 为 text 的片段；
+    type 出现在 text 之后时先暂存该片段的正文，片段结束时再决定喂入还是丢弃。
+    """
+
+    def __init__(
+        self,
+        *,
+        task: str,
+        classifier: TaskClassifier | None = None,
+        track_prefixes: bool = False,
+    ) -> None:
+        """初始化解码器、摘要和扫描状态；track_prefixes 时额外累计消息前缀摘要。"""
+
+        self.task = task
+        self.classifier = classifier
+        self.prefix: Any = hashlib.blake2b(digest_size=16) if track_prefixes else None
+        self.prefix_chars = 0
+        self.prefix_chain: list[tuple[bytes, int]] = []
+        self.system_scanners: list[PromptTextScanner] = []
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.digest = hashlib.blake2b(digest_size=8)
+        self.stack: list[JsonScanFrame] = []
+        self.root: Any = None
+        self.mode = "value"
+        self.string_is_key = False
+        self.string_is_prompt = False
+        self.string_is_held = False
+        self.held_part_text: list[str] | None = None
+        self.string_parts: list[str] = []
+        self.carry = ""
+        self.literal_parts: list[str] = []
+        self.message_scanner: PromptTextScanner | None = None
+        self.user_scanner: PromptTextScanner | None = None
+        self.last_message_scanner: PromptTextScanner | None = None
+
+    def feed(self, data: bytes) -> None:
+        """接收一段原始请求体字节。"""
+
+        self.digest.update(data)
+        try:
+            text = self.decoder.decode(data)
+        except UnicodeDecodeError as e:
+            raise HttpError(400, f"Invalid JSON body: {e}") from e
+        if self.carry:
+            text = self.carry + text
+            self.carry = ""
+        self.scan(text)
+
+    def finish(self) -> ChatRequestPayload:
+        """确认 JSON 完整后，返回与缓冲解析等价的请求负载。"""
+
+        try:
+            text = self.carry + self.decoder.decode(b"", final=True)
+        except UnicodeDecodeError as e:
+            raise HttpError(400, f"Invalid JSON body: {e}") from e
+        self.carry = ""
+        self.scan(text)
+        if self.carry:
+            raise self.fail("unterminated string")
+        if self.mode == "literal":
+            self.finish_literal()
+        if self.mode != "end":
+            raise HttpError(400, "Invalid JSON body: unexpected end of data")
+        if not isinstance(self.root, dict):
+            raise HttpError(400, "Invalid JSON body: expected an object")
+
+        scanner = self.user_scanner or self.last_message_scanner
+        task = self.resolve_task(scanner)
+        request_text = "" if scanner is None else scanner.finish(task)
+        prompt_tokens = 0 if scanner is None else scanner.estimate_prompt_tokens()
+        return ChatRequestPayload(
+            data=self.root,
+            request_text=request_text,
+            prompt_tokens=prompt_tokens,
+            body_digest=self.digest.digest(),
+            task=task,
+            prefix_chain=tuple(self.prefix_chain),
+        )
+
+    def resolve_task(self, scanner: PromptTextScanner | None) -> str | None:
+        """auto 模式下确定本请求的任务；固定任务模式返回 None。"""
+
+        if self.task != TASK_AUTO or self.classifier is None:
+            return None
+        if self.system_scanners:
+            digest = digest_system_texts(
+                [system.digest.digest() for system in self.system_scanners]
+            )
+            probe = "".join(
+                "".join(system.probe_parts) for system in self.system_scanners
+            )
+            return self.classifier.classify(digest, probe)
+        if scanner is None:
+            return TASK_TRANSLATION
+        return scanner.guess_task()
+
+    def fail(self, message: str) -> HttpError:
+        """统一构造 JSON 语法错误。"""
+
+        return HttpError(400, f"Invalid JSON body: {message}")
+
+    def scan(self, text: str) -> None:
+        """推进状态机；字符串正文用正则整段跳过，避免逐字符循环。"""
+
+        i = 0
+        n = len(text)
+        while i < n:
+            mode = self.mode
+            if mode == "string":
+                match = JSON_STRING_SPECIAL_PATTERN.search(text, i)
+                if match is None:
+                    self.push_string_text(text[i:])
+                    return
+                end = match.start()
+                if text[end] == '"':
+                    if end > i:
+                        self.push_string_text(text[i:end])
+                    i = end + 1
+                    self.finish_string()
+                    continue
+                i = self.scan_escaped_run(text, i)
+                if i < 0:
+                    return
+                continue
+
+            if mode == "literal":
+                match = JSON_LITERAL_PATTERN.match(text, i)
+                if match is not None:
+                    self.literal_parts.append(match.group(0))
+                    i = match.end()
+                if i >= n:
+                    return
+                self.finish_literal()
+                continue
+
+            ch = text[i]
+            if ch in " \t\r\n":
+                i += 1
+                continue
+            i += 1
+
+            if mode in ("value", "value_or_end"):
+                if ch == "]" and mode == "value_or_end":
+                    self.close_container(list)
+                elif ch == "{":
+                    self.open_container({})
+                    self.mode = "key_or_end"
+                elif ch == "[":
+                    self.open_container([])
+                    self.mode = "value_or_end"
+                elif ch == '"':
+                    self.start_string(is_key=False)
+                elif JSON_LITERAL_PATTERN.match(ch):
+                    self.literal_parts = [ch]
+                    self.mode = "literal"
+                else:
+                    raise self.fail(f"unexpected character {ch!r}")
+            elif mode in ("key", "key_or_end"):
+                if ch == '"':
+                    self.start_string(is_key=True)
+                elif ch == "}" and mode == "key_or_end":
+                    self.close_container(dict)
+                else:
+                    raise self.fail(f"expected object key, got {ch!r}")
+            elif mode == "colon":
+                if ch != ":":
+                    raise self.fail(f"expected ':', got {ch!r}")
+                self.mode = "value"
+            elif mode == "after_value":
+                if ch == ",":
+                    top = self.stack[-1].container
+                    self.mode = "key" if isinstance(top, dict) else "value"
+                elif ch == "}":
+                    self.close_container(dict)
+                elif ch == "]":
+                    self.close_container(list)
+                else:
+                    raise self.fail(f"expected ',' or closing bracket, got {ch!r}")
+            else:
+                raise self.fail("extra data after JSON value")
+
+    def scan_escaped_run(self, text: str, start: int) -> int:
+        """把“普通文本 + 完整转义”的连续片段整段交给 json 解码。
+
+        逐个处理 \\uXXXX 在 ensure_ascii 请求体上慢一个数量级；块尾残缺的转义
+        和落单的高位代理留到下一块拼上再解码。返回 -1 表示本块已消费完。
+        """
+
+        run = JSON_STRING_RUN_PATTERN.match(text, start)
+        run_end = start if run is None else run.end()
+        rest = text[run_end:]
+        at_end = rest == "" or (
+            len(rest) < 6 and JSON_PARTIAL_ESCAPE_PATTERN.fullmatch(rest) is not None
+        )
+        if not at_end and rest[0] != '"':
+            raise self.fail(f"invalid escape {rest[:2]!r}")
+
+        segment = text[start:run_end]
+        if at_end:
+            tail = JSON_HIGH_SURROGATE_TAIL_PATTERN.search(segment)
+            if tail is not None and is_unescaped_backslash(segment, tail.start()):
+                segment = segment[: tail.start()]
+                rest = text[start + tail.start() :]
+        if segment:
+            self.push_string_text(json.loads('"' + segment + '"', strict=False))
+
+        if at_end:
+            self.carry = rest
+            return -1
+        self.finish_string()
+        return run_end + 1
+
+    def is_prompt_string_position(self) -> bool:
+        """判断当前字符串是否位于 messages[*].content 或其多段 text 上。"""
+
+        stack = self.stack
+        depth = len(stack)
+        if depth not in (3, 5) or stack[0].key != "messages":
+            return False
+        if not isinstance(stack[1].container, list):
+            return False
+        if depth == 3:
+            return stack[2].key == "content"
+        return (
+            stack[2].key == "content"
+            and isinstance(stack[3].container, list)
+            and stack[4].key == "text"
+        )
+
+    def start_string(self, *, is_key: bool) -> None:
+        """进入字符串状态，提示词正文改走行扫描器。"""
+
+        self.string_is_key = is_key
+        self.string_is_prompt = (
+            not is_key
+            and self.message_scanner is not None
+            and self.is_prompt_string_position()
+        )
+        self.string_is_held = False
+        if self.string_is_prompt and len(self.stack) == 5:
+            part = self.stack[4].container
+            part_type = part.get("type") if isinstance(part, dict) else None
+            if part_type is None:
+                # type 还没出现：正文先暂存，片段结束时按 type 决定去留
+                self.string_is_held = True
+                self.held_part_text = []
+            elif part_type != "text":
+                self.string_is_prompt = False
+        self.string_parts = []
+        self.mode = "string"
+
+    def push_string_text(self, text: str) -> None:
+        """追加一段已解码的字符串内容。"""
+
+        if self.string_is_held and self.held_part_text is not None:
+            self.held_part_text.append(text)
+        elif self.string_is_prompt:
+            self.feed_prompt_text(text)
+        else:
+            self.string_parts.append(text)
+
+    def feed_prompt_text(self, text: str) -> None:
+        """把一段提示词正文交给当前消息的行扫描器，并累计前缀摘要。"""
+
+        if self.message_scanner is None:
+            return
+        self.message_scanner.feed(text)
+        if self.prefix is not None:
+            self.prefix.update(text.encode("utf-8", "surrogatepass"))
+            self.prefix_chars += len(text)
+
+    def finish_string(self) -> None:
+        """字符串结束：key 记到当前层，值挂到父容器。"""
+
+        if self.string_is_key:
+            self.stack[-1].key = "".join(self.string_parts)
+            self.string_parts = []
+            self.mode = "colon"
+            return
+
+        # 正文已交给行扫描器，物化结果里只留空字符串占位
+        value = "" if self.string_is_prompt else "".join(self.string_parts)
+        self.string_parts = []
+        self.attach_value(value)
+
+    def finish_literal(self) -> None:
+        """数字、true/false/null 借用 json.loads 校验并转换。"""
+
+        token = "".join(self.literal_parts)
+        self.literal_parts = []
+        try:
+            value = json.loads(token)
+        except ValueError as e:
+            raise self.fail(f"invalid literal {token!r}") from e
+        self.attach_value(value)
+
+    def attach_value(self, value: Any) -> None:
+        """把标量或新容器挂到父容器上。"""
+
+        if not self.stack:
+            self.root = value
+            self.mode = "end"
+            return
+
+        frame = self.stack[-1]
+        if isinstance(frame.container, dict):
+            frame.container[str(frame.key)] = value
+        else:
+            frame.container.append(value)
+            # messages 里出现非对象元素时，兜底“最后一条消息”随之失效
+            if (
+                len(self.stack) == 2
+                and self.stack[0].key == "messages"
+                and not isinstance(value, dict)
+            ):
+                self.last_message_scanner = None
+        self.mode = "after_value"
+
+    def open_container(self, container: dict[str, Any] | list[Any]) -> None:
+        """容器开启时立即挂到父节点，关闭时只需出栈。"""
+
+        if not self.stack:
+            self.root = container
+        else:
+            self.attach_value(container)
+        self.stack.append(JsonScanFrame(container=container))
+        if (
+            len(self.stack) == 3
+            and self.stack[0].key == "messages"
+            and isinstance(self.stack[1].container, list)
+            and isinstance(container, dict)
+        ):
+            self.message_scanner = PromptTextScanner(task=self.task)
+
+    def close_container(self, kind: type) -> None:
+        """校验括号配对并出栈；消息对象结束时按 role 归档扫描结果。"""
+
+        if not self.stack or not isinstance(self.stack[-1].container, kind):
+            raise self.fail("mismatched closing bracket")
+
+        frame = self.stack.pop()
+        if len(self.stack) == 4 and self.held_part_text is not None:
+            part = frame.container
+            if isinstance(part, dict) and part.get("type") == "text":
+                for text in self.held_part_text:
+                    self.feed_prompt_text(text)
+            self.held_part_text = None
+        if len(self.stack) == 2 and self.message_scanner is not None:
+            message = frame.container
+            if isinstance(message, dict) and message.get("role") == "user":
+                self.user_scanner = self.message_scanner
+            if isinstance(message, dict) and message.get("role") in SYSTEM_ROLES:
+                self.system_scanners.append(self.message_scanner)
+            self.last_message_scanner = self.message_scanner
+            self.message_scanner = None
+            if self.prefix is not None and isinstance(message, dict):
+                self.prefix_chain.append(
+                    (
+                        seal_prefix_message(self.prefix, message.get("role")),
+                        self.prefix_chars // 4,
+                    )
+                )
+
+        self.mode = "after_value" if self.stack else "end"
+
+
 async def read_request_head(
     reader: asyncio.StreamReader,
     *,
@@ -1080,61 +5253,330 @@ async def read_request_head(
     return method, target, version, headers
 
 
-async def read_http_request(
+def parse_content_length(headers: dict[str, str]) -> int:
+    """读取 Content-Length；缺省视为空 body。"""
+
+    content_length_text = headers.get("content-length", "")
+    if content_length_text == "":
+        return 0
+    try:
+        content_length = int(content_length_text)
+    except Exception as e:
+        raise HttpError(400, f"Invalid Content-Length: {e}") from e
+    if content_length < 0:
+        raise HttpError(400, "Invalid Content-Length: negative value")
+    return content_length
+
+
+def is_chunked_request(headers: dict[str, str]) -> bool:
+    """判断请求体是否使用 chunked transfer 编码。"""
+
+    return "chunked" in headers.get("transfer-encoding", "").lower()
+
+
+async def read_with_timeout(
+    reader: asyncio.StreamReader, size: int, *, read_timeout_s: float
+) -> bytes:
+    """精确读取 size 字节，把截断和超时统一成 400。"""
+
+    try:
+        return await asyncio.wait_for(reader.readexactly(size), timeout=read_timeout_s)
+    except asyncio.IncompleteReadError as e:
+        raise HttpError(400, "Incomplete request body") from e
+    except TimeoutError as e:
+        raise HttpError(400, "Request body read timeout") from e
+
+
+async def read_line_with_timeout(
+    reader: asyncio.StreamReader, *, read_timeout_s: float
+) -> bytes:
+    """读取 chunked 编码里的一行控制信息。"""
+
+    try:
+        line = await asyncio.wait_for(reader.readline(), timeout=read_timeout_s)
+    except TimeoutError as e:
+        raise HttpError(400, "Request body read timeout") from e
+    except ValueError as e:
+        # StreamReader 单行超过缓冲上限
+        raise HttpError(400, "Chunk size line too long") from e
+    if not line:
+        raise HttpError(400, "Incomplete request body")
+    return line
+
+
+async def iter_request_body(
     reader: asyncio.StreamReader,
-    writer: asyncio.StreamWriter,
     *,
+    chunked: bool,
+    content_length: int,
     read_timeout_s: float,
-    max_header_bytes: int,
     max_body_bytes: int,
+    chunk_bytes: int,
+) -> AsyncIterator[bytes]:
+    """按不超过 chunk_bytes 的块产出请求体，兼容 Content-Length 与 chunked。
+
+    超时按单次读取计算：持续有数据到达的大 body 不会因总耗时被误杀。
+    """
+
+    chunk_bytes = max(1, chunk_bytes)
+    if not chunked:
+        remaining = content_length
+        while remaining > 0:
+            piece = await read_with_timeout(
+                reader, min(chunk_bytes, remaining), read_timeout_s=read_timeout_s
+            )
+            remaining -= len(piece)
+            yield piece
+        return
+
+    total = 0
+    while True:
+        size_line = await read_line_with_timeout(reader, read_timeout_s=read_timeout_s)
+        size_text = size_line.split(b";", 1)[0].strip()
+        try:
+            size = int(size_text, 16)
+        except ValueError as e:
+            raise HttpError(400, "Invalid chunk size") from e
+        if size < 0:
+            raise HttpError(400, "Invalid chunk size")
+
+        if size == 0:
+            # 丢弃 trailer，直到空行
+            while True:
+                trailer = await read_line_with_timeout(
+                    reader, read_timeout_s=read_timeout_s
+                )
+                if trailer in (b"\r\n", b"\n"):
+                    return
+
+        total += size
+        if total > max_body_bytes:
+            raise HttpError(413, f"Body too large (>{max_body_bytes} bytes)")
+
+        remaining = size
+        while remaining > 0:
+            piece = await read_with_timeout(
+                reader, min(chunk_bytes, remaining), read_timeout_s=read_timeout_s
+            )
+            remaining -= len(piece)
+            yield piece
+
+        terminator = await read_line_with_timeout(reader, read_timeout_s=read_timeout_s)
+        if terminator not in (b"\r\n", b"\n"):
+            raise HttpError(400, "Malformed chunk terminator")
+
+
+def parse_content_encoding(headers: dict[str, str]) -> str | None:
+    """解析请求体的 Content-Encoding；identity 视为未压缩，不支持的编码返回 415。"""
+
+    value = headers.get("content-encoding", "").strip().lower()
+    if value in ("", "identity"):
+        return None
+    encoding = CONTENT_ENCODING_ALIASES.get(value, value)
+    if encoding not in CONTENT_ENCODINGS:
+        raise HttpError(415, f"Unsupported Content-Encoding: {value}")
+    return encoding
+
+
+def new_request_decompressor(encoding: str, first: bytes) -> Any:
+    """按编码创建解压器；deflate 兼容不带 zlib 头的裸 deflate 流。"""
+
+    if encoding == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    has_zlib_header = (
+        len(first) >= 2
+        and first[0] & 0x0F == 8
+        and (first[0] << 8 | first[1]) % 31 == 0
+    )
+    return zlib.decompressobj(zlib.MAX_WBITS if has_zlib_header else -zlib.MAX_WBITS)
+
+
+async def decode_request_body(
+    chunks: AsyncIterator[bytes],
+    *,
+    encoding: str,
+    max_body_bytes: int,
+    chunk_bytes: int,
+) -> AsyncIterator[bytes]:
+    """边读边解压请求体，解压后的总量同样受 max_body_bytes 约束，防止压缩炸弹。
+
+    每次最多解压出 chunk_bytes，下游的流式扫描窗口因此不受压缩比影响。
+    """
+
+    trace = REQUEST_TRACE.get()
+    decompressor: Any = None
+    total = 0
+    async for piece in chunks:
+        if decompressor is None:
+            decompressor = new_request_decompressor(encoding, piece)
+        data = piece
+        while data:
+            cpu_start = time.thread_time()
+            try:
+                out = decompressor.decompress(data, chunk_bytes)
+            except zlib.error as e:
+                raise HttpError(400, f"Invalid {encoding} request body") from e
+            if trace is not None:
+                trace.request_codec_cpu_s += time.thread_time() - cpu_start
+            data = decompressor.unconsumed_tail
+            total += len(out)
+            if total > max_body_bytes:
+                raise HttpError(413, f"Body too large (>{max_body_bytes} bytes)")
+            if out:
+                yield out
+    if decompressor is None or not decompressor.eof:
+        raise HttpError(400, f"Truncated {encoding} request body")
+
+
+def should_stream_ingest(
+    method: str,
+    target: str,
+    *,
+    chunked: bool,
+    content_length: int,
+    stream_ingest_threshold: int,
+) -> bool:
+    """chunked 或足够大的 chat 请求改走流式扫描，小请求仍整体解析。"""
+
+    if stream_ingest_threshold < 0:
+        return False
+    if method != "POST" or get_path_only(target) not in CHAT_COMPLETIONS_PATHS:
+        return False
+    return chunked or content_length >= stream_ingest_threshold
+
+
+async def read_http_request(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    *,
+    config: MockServerConfig,
+    state: ServerState,
+    lease: BudgetLease,
+    within_connection_limit: bool,
 ) -> HttpRequest | None:
-    """读取完整 HTTP 请求体，拒绝 chunked request body。"""
+    """读取 HTTP 请求；大 chat 请求边读边扫描，不在内存里保留整份 body。
 
+    准入检查放在读完 header、读 body 之前：被拒绝的请求不会再占用 body 内存，
+    也不会收到 100 Continue。/health 不受准入限制，过载时也能探测。
+    """
+
+    read_timeout_s = config.read_timeout_s
+    max_body_bytes = config.max_body_bytes
+    ingest_chunk_bytes = config.ingest_chunk_bytes
+
+    set_request_phase("read_head")
     head = await read_request_head(
         reader,
         read_timeout_s=read_timeout_s,
-        max_header_bytes=max_header_bytes,
+        max_header_bytes=config.max_header_bytes,
     )
     if head is None:
         return None
+    set_request_phase("read_body")
 
     method, target, version, headers = head
+    state.total_requests += 1
+    trace = REQUEST_TRACE.get()
+    if trace is not None:
+        trace.head_done_mono = time.monotonic()
+        trace.method = method
+        trace.path = get_path_only(target)
+        trace.trace_context = parse_trace_context(headers)
+    is_probe = get_path_only(target) in ("/health", "/debug/soak")
+
+    if not within_connection_limit and not is_probe:
+        raise state.record_shed(SHED_REASON_CONNECTIONS)
+
+    chunked = is_chunked_request(headers)
+    content_length = 0 if chunked else parse_content_length(headers)
+    if content_length > max_body_bytes:
+        raise HttpError(413, f"Body too large (>{max_body_bytes} bytes)")
+    content_encoding = (
+        parse_content_encoding(headers) if content_length or chunked else None
+    )
+
+    stream_ingest = should_stream_ingest(
+        method,
+        target,
+        chunked=chunked,
+        content_length=content_length,
+        stream_ingest_threshold=config.stream_ingest_threshold,
+    )
+    if not is_probe:
+        # 流式扫描只需要一个读取窗口；缓冲路径按声明长度预占
+        lease.reserve(ingest_chunk_bytes if stream_ingest else content_length)
 
     if headers.get("expect", "").lower() == "100-continue":
         writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
         await writer.drain()
 
-    if (
-        "transfer-encoding" in headers
-        and "chunked" in headers["transfer-encoding"].lower()
-    ):
-        raise HttpError(411, "Chunked request bodies are not supported")
-
-    content_length_text = headers.get("content-length", "")
-    if content_length_text == "":
-        content_length = 0
-    else:
-        try:
-            content_length = int(content_length_text)
-        except Exception as e:
-            raise HttpError(400, f"Invalid Content-Length: {e}") from e
-
-    if content_length > max_body_bytes:
-        raise HttpError(413, f"Body too large (>{max_body_bytes} bytes)")
+    wire_chunks = iter_request_body(
+        reader,
+        chunked=chunked,
+        content_length=content_length,
+        read_timeout_s=read_timeout_s,
+        max_body_bytes=max_body_bytes,
+        chunk_bytes=ingest_chunk_bytes,
+    )
+    bytes_in = 0
+
+    async def count_wire_bytes() -> AsyncIterator[bytes]:
+        nonlocal bytes_in
+        async for piece in wire_chunks:
+            bytes_in += len(piece)
+            yield piece
+
+    body_chunks: AsyncIterator[bytes] = count_wire_bytes()
+    if content_encoding is not None:
+        body_chunks = decode_request_body(
+            body_chunks,
+            encoding=content_encoding,
+            max_body_bytes=max_body_bytes,
+            chunk_bytes=ingest_chunk_bytes,
+        )
 
+    payload: ChatRequestPayload | None = None
     body = b""
-    if content_length > 0:
-        try:
-            body = await asyncio.wait_for(
-                reader.readexactly(content_length), timeout=read_timeout_s
-            )
-        except asyncio.IncompleteReadError as e:
-            raise HttpError(400, "Incomplete request body") from e
-        except TimeoutError as e:
-            raise HttpError(400, "Request body read timeout") from e
+    body_bytes = 0
+    if stream_ingest:
+        scanner = ChatBodyScanner(
+            task=config.task,
+            classifier=state.task_classifier,
+            track_prefixes=state.prefix_cache is not None,
+        )
+        async for piece in body_chunks:
+            body_bytes += len(piece)
+            scanner.feed(piece)
+        payload = scanner.finish()
+        lease.reserve(len(payload.request_text))
+    elif chunked or content_encoding is not None:
+        buffer = bytearray()
+        async for piece in body_chunks:
+            # 压缩体解压后可能远大于声明长度，按实际产出继续占预算
+            if not is_probe:
+                lease.reserve(len(piece))
+            buffer += piece
+        body = bytes(buffer)
+        body_bytes = len(body)
+    elif content_length > 0:
+        body = await read_with_timeout(
+            reader, content_length, read_timeout_s=read_timeout_s
+        )
+        bytes_in = body_bytes = len(body)
+
+    if trace is not None:
+        trace.body_done_mono = time.monotonic()
+        trace.bytes_in = bytes_in
+        trace.body_bytes = body_bytes
+        trace.request_encoding = content_encoding
 
     return HttpRequest(
-        method=method, target=target, version=version, headers=headers, body=body
+        method=method,
+        target=target,
+        version=version,
+        headers=headers,
+        body=body,
+        payload=payload,
     )
 
 
@@ -1146,57 +5588,171 @@ def get_path_only(target: str) -> str:
     return target
 
 
+class ConnectionReader(asyncio.StreamReader):
+    """在收到 EOF 或连接断开时置位 peer_closed 的 StreamReader。
+
+    断开监听只等这个信号、不调用 read，请求之后到达的字节原样留在缓冲里。
+    """
+
+    def __init__(self, limit: int = 2**16) -> None:
+        super().__init__(limit=limit)
+        self.peer_closed = asyncio.Event()
+
+    def feed_eof(self) -> None:
+        super().feed_eof()
+        self.peer_closed.set()
+
+    def set_exception(self, exc: BaseException) -> None:
+        super().set_exception(exc)
+        self.peer_closed.set()
+
+
+def make_connection_protocol_factory(
+    client_connected_cb: Callable[
+        [asyncio.StreamReader, asyncio.StreamWriter], Awaitable[None]
+    ],
+) -> Callable[[], asyncio.StreamReaderProtocol]:
+    """与 asyncio.start_server 相同的协议工厂，只是把 reader 换成 ConnectionReader。"""
+
+    def factory() -> asyncio.StreamReaderProtocol:
+        return asyncio.StreamReaderProtocol(ConnectionReader(), client_connected_cb)
+
+    return factory
+
+
+async def wait_for_client_gone(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    *,
+    allow_half_close: bool,
+) -> None:
+    """等待客户端离开：默认 EOF 即离开，allow_half_close 时只认传输层断开（重置或写失败）。
+
+    半关闭只会触发 eof_received，传输保持可写，connection_lost 不会被调用。
+    """
+
+    if not allow_half_close and isinstance(reader, ConnectionReader):
+        await reader.peer_closed.wait()
+        return
+    try:
+        await writer.wait_closed()
+    except OSError:
+        # 连接被重置时 wait_closed 抛出对应异常，同样视为客户端离开
+        return
+
+
+async def run_until_client_disconnect(
+    response: Awaitable[None], client_gone: Awaitable[None]
+) -> None:
+    """并发运行响应与断开监听，客户端先离开时立即取消响应（含抖动等待）。
+
+    非流式响应要睡满抖动才写出，流式也要等下一次写才发现断开；
+    任务取消后协程、响应体和预算租约当场释放，不再占满整个抖动时长。
+    """
+
+    response_task = asyncio.ensure_future(response)
+    watch_task = asyncio.ensure_future(client_gone)
+    try:
+        await asyncio.wait(
+            (response_task, watch_task), return_when=asyncio.FIRST_COMPLETED
+        )
+    except asyncio.CancelledError:
+        response_task.cancel()
+        watch_task.cancel()
+        raise
+
+    if response_task.done():
+        watch_task.cancel()
+        response_task.result()
+        return
+
+    response_task.cancel()
+    try:
+        await response_task
+    except asyncio.CancelledError:
+        pass
+    raise ClientDisconnected()
+
+
 async def handle_connection(
     reader: asyncio.StreamReader,
     writer: asyncio.StreamWriter,
     *,
-    read_timeout_s: float,
-    max_header_bytes: int,
-    max_body_bytes: int,
-    min_jitter_s: float,
-    max_jitter_s: float,
-    stream_chunk_lines: int,
-    seed: int | None,
-    task: str,
+    config: MockServerConfig,
+    state: ServerState,
 ) -> None:
     """处理单个 TCP 连接的读取、路由和收尾。"""
 
     peer = writer.get_extra_info("peername")
+    trace = RequestTrace()
+    REQUEST_TRACE.set(trace)
+    within_connection_limit = state.connection_opened()
+    state.live_writers.add(writer)
+    task = asyncio.current_task()
+    if task is not None:
+        state.connection_tasks.add(task)
+    lease = BudgetLease(state)
 
     try:
         request = await read_http_request(
             reader,
             writer,
-            read_timeout_s=read_timeout_s,
-            max_header_bytes=max_header_bytes,
-            max_body_bytes=max_body_bytes,
+            config=config,
+            state=state,
+            lease=lease,
+            within_connection_limit=within_connection_limit,
         )
         if request is None:
             return
 
         path = get_path_only(request.target)
 
+        set_request_phase("route")
         if request.method == "OPTIONS":
             await handle_options(writer)
             return
 
         if path == "/health":
-            await handle_health(request, writer)
+            await handle_health(request, writer, state=state)
+            return
+
+        if path == "/debug/soak":
+            await handle_debug_soak(request, writer, state=state)
             return
 
         if path in ("/v1/models", "/models"):
             await handle_models(request, writer)
             return
 
-        if path in ("/v1/chat/completions", "/chat/completions"):
-            await handle_chat_completions(
-                request,
-                writer,
-                min_jitter_s=min_jitter_s,
-                max_jitter_s=max_jitter_s,
-                stream_chunk_lines=stream_chunk_lines,
-                seed=seed,
-                task=task,
+        # /v1/files/{id}/content -> ["files", id, "content"]；同样兼容不带 /v1 的前缀
+        segments = path.removeprefix("/v1").strip("/").split("/")
+        if segments[0] == "files":
+            await handle_files(
+                request, writer, batches=state.batches, parts=segments[1:]
+            )
+            return
+        if segments[0] == "batches":
+            await handle_batches(
+                request, writer, batches=state.batches, parts=segments[1:]
+            )
+            return
+
+        if path in CHAT_COMPLETIONS_PATHS:
+            await run_until_client_disconnect(
+                handle_chat_completions(
+                    request,
+                    writer,
+                    config=config,
+                    lease=lease,
+                    corpus=state.corpus,
+                    classifier=state.task_classifier,
+                    prefix_cache=state.prefix_cache,
+                    timer=state.timer,
+                    offload=state.offload,
+                ),
+                wait_for_client_gone(
+                    reader, writer, allow_half_close=config.allow_half_close
+                ),
             )
             return
 
@@ -1204,19 +5760,28 @@ async def handle_connection(
 
     except ClientDisconnected:
         # 客户端在服务端写回数据时断开；这在流式/压测/取消请求时非常常见
+        trace.disconnect_reason = "client_disconnect"
+        if trace.first_byte_mono is None:
+            state.abandoned_counts["before_first_byte"] += 1
+        else:
+            state.abandoned_counts["mid_stream"] += 1
         return
 
     except HttpError as e:
-        logging.getLogger(__name__).warning(
-            "%s %s -> %s (%s)", peer, "error", e.status, e.message
+        trace.disconnect_reason = "shed" if e.status == 503 else "http_error"
+        # 削峰拒绝在过载时会成批出现，降到 DEBUG 避免日志本身拖慢事件循环
+        level = logging.DEBUG if e.status == 503 else logging.WARNING
+        logging.getLogger(__name__).log(
+            level, "%s %s -> %s (%s)", peer, "error", e.status, e.message
         )
-        body_obj = build_openai_error(e.message)
+        body_obj = build_openai_error(e.message, error_type=e.error_type)
         body = json.dumps(body_obj, ensure_ascii=False).encode("utf-8")
         headers = build_response_headers(
             content_type="application/json; charset=utf-8",
             content_length=len(body),
             connection_close=True,
         )
+        headers.update(e.headers)
         try:
             await write_http_response(
                 writer, status=e.status, headers=headers, body=body
@@ -1225,6 +5790,7 @@ async def handle_connection(
             pass
         return
     except Exception as e:
+        trace.disconnect_reason = "server_error"
         logging.getLogger(__name__).exception("Unhandled error: %s", e)
         body_obj = build_openai_error(
             "Internal server error", error_type="server_error"
@@ -1241,6 +5807,16 @@ async def handle_connection(
             pass
         return
     finally:
+        lease.release_all()
+        state.connection_closed()
+        state.record_task(trace)
+        state.record_compression(trace)
+        if state.access_log is not None and trace.head_done_mono is not None:
+            state.access_log.log(trace.to_access_record())
+        if state.span_exporter is not None and trace.head_done_mono is not None:
+            spans = trace.to_otlp_spans()
+            if spans:
+                state.span_exporter.log(build_otlp_export_request(spans))
         try:
             writer.close()
             await writer.wait_closed()
@@ -1248,6 +5824,48 @@ async def handle_connection(
             pass
 
 
+def parse_expansion_ratio(value: str) -> tuple[str, float]:
+    """解析 SRC-DST=RATIO 形式的扩展比参数。"""
+
+    pair, sep, ratio_text = value.partition("=")
+    try:
+        ratio = float(ratio_text)
+    except ValueError:
+        ratio = -1.0
+    if not sep or "-" not in pair or ratio <= 0:
+        raise argparse.ArgumentTypeError(f"expected SRC-DST=RATIO, got {value!r}")
+    return pair.strip().lower(), ratio
+
+
+def parse_mode_probability(value: str, modes: tuple[str, ...]) -> tuple[str, float]:
+    """解析 MODE=PROB 形式的按概率注入参数。"""
+
+    mode, sep, rate_text = value.partition("=")
+    try:
+        rate = float(rate_text)
+    except ValueError:
+        rate = -1.0
+    mode = mode.strip().lower()
+    if not sep or mode not in modes or not 0 <= rate <= 1:
+        raise argparse.ArgumentTypeError(
+            f"expected MODE=PROB with MODE in {', '.join(modes)}"
+            f" and 0 <= PROB <= 1, got {value!r}"
+        )
+    return mode, rate
+
+
+def parse_content_fault(value: str) -> tuple[str, float]:
+    """解析 MODE=PROB 形式的内容故障参数。"""
+
+    return parse_mode_probability(value, CONTENT_FAULT_MODES)
+
+
+def parse_sse_fragment(value: str) -> tuple[str, float]:
+    """解析 MODE=PROB 形式的 SSE 分片参数。"""
+
+    return parse_mode_probability(value, SSE_FRAGMENT_MODES)
+
+
 def parse_args() -> argparse.Namespace:
     """解析命令行参数并提供本地联调默认值。"""
 
@@ -1257,16 +5875,280 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--host", default="127.0.0.1")
     parser.add_argument("--port", type=int, default=8000)
     parser.add_argument("--backlog", type=int, default=4096)
+    parser.add_argument(
+        "--unix-socket",
+        default=None,
+        metavar="PATH",
+        help="Also listen on a Unix domain socket (shares routing and stats with TCP)",
+    )
+    parser.add_argument(
+        "--no-tcp",
+        action="store_true",
+        help="Disable the TCP listener; requires --unix-socket",
+    )
     parser.add_argument("--read-timeout", type=float, default=30.0)
+    parser.add_argument(
+        "--allow-half-close",
+        action="store_true",
+        help="Keep answering clients that shut down their write side; only a reset counts as a disconnect",
+    )
     parser.add_argument("--max-header-bytes", type=int, default=64 * 1024)
     parser.add_argument("--max-body-bytes", type=int, default=16 * 1024 * 1024)
+    parser.add_argument(
+        "--ingest-chunk-bytes",
+        type=int,
+        default=64 * 1024,
+        help="Max bytes read from the socket per body read while ingesting",
+    )
+    parser.add_argument(
+        "--stream-ingest-threshold",
+        type=int,
+        default=1024 * 1024,
+        help="Chat bodies at/above this Content-Length (and all chunked ones) are scanned incrementally; -1 disables",
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=0,
+        help="Concurrent connection cap; extra requests get 503 + Retry-After (0 = unlimited)",
+    )
+    parser.add_argument(
+        "--memory-budget-bytes",
+        type=int,
+        default=1024 * 1024 * 1024,
+        help="Global byte budget for in-flight request bodies and pending responses (0 = unlimited)",
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=int,
+        default=1,
+        help="Retry-After seconds sent with overload 503 responses",
+    )
+    parser.add_argument(
+        "--soak-interval",
+        type=float,
+        default=0.0,
+        help="Soak mode: seconds between tracemalloc/FD/task samples (0 = disabled)",
+    )
+    parser.add_argument(
+        "--soak-output",
+        default=None,
+        help="Soak mode: append samples to this JSONL file",
+    )
+    parser.add_argument(
+        "--soak-top",
+        type=int,
+        default=10,
+        help="Soak mode: allocation sites reported per sample, ranked by growth",
+    )
+    parser.add_argument(
+        "--access-log",
+        default=None,
+        metavar="PATH",
+        help="Write a JSONL access log with per-phase timings (background writer thread)",
+    )
+    parser.add_argument(
+        "--trace-output",
+        default=None,
+        metavar="PATH",
+        help="Export server-side spans (W3C traceparent aware) as OTLP-JSON lines",
+    )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        metavar="PREFIX",
+        help="Profile the event loop; writes PREFIX.pstats and PREFIX.collapsed on shutdown or SIGUSR1",
+    )
+    parser.add_argument(
+        "--profile-sample-interval",
+        type=float,
+        default=0.005,
+        help="Stack sampling interval in seconds for the collapsed-stack output (0 = cProfile only)",
+    )
+    parser.add_argument(
+        "--slow-callback-ms",
+        type=float,
+        default=0.0,
+        help="Report event-loop callbacks slower than this, tagged with request phase (0 = disabled)",
+    )
+    parser.add_argument(
+        "--timer-tick-ms",
+        type=float,
+        default=10.0,
+        help="Tick of the shared timing wheel for jitter/SSE waits (0 = one asyncio.sleep per wait)",
+    )
+    parser.add_argument(
+        "--response-compression",
+        action="store_true",
+        help="Compress non-stream responses with gzip/deflate when Accept-Encoding allows",
+    )
+    parser.add_argument(
+        "--sse-compression",
+        action="store_true",
+        help="Compress SSE streams, sync-flushing after every event",
+    )
+    parser.add_argument(
+        "--compression-level", type=int, default=6, choices=range(1, 10)
+    )
+    parser.add_argument(
+        "--compress-min-bytes",
+        type=int,
+        default=1024,
+        help="Responses smaller than this are sent uncompressed",
+    )
+    parser.add_argument(
+        "--offload-threshold",
+        type=int,
+        default=256 * 1024,
+        help="Chat requests of at least this many bytes are parsed and generated in a worker thread (0 = all, -1 = never)",
+    )
+    parser.add_argument(
+        "--offload-workers",
+        type=int,
+        default=2,
+        help="Worker threads for offloaded requests",
+    )
+    parser.add_argument(
+        "--offload-queue",
+        type=int,
+        default=64,
+        help="Offloaded requests allowed to wait for a worker before new ones get 503",
+    )
+    parser.add_argument(
+        "--batch-capacity-rps",
+        type=float,
+        default=100.0,
+        help="Batch API requests processed per second, shared by all batches (<= 0 = unlimited)",
+    )
+    parser.add_argument(
+        "--batch-max-active",
+        type=int,
+        default=2,
+        help="Batches processed at the same time; the rest stay in validating",
+    )
+    parser.add_argument(
+        "--batch-min-duration",
+        type=float,
+        default=5.0,
+        help="Minimum seconds from batch creation to completion",
+    )
+    parser.add_argument(
+        "--prefix-cache-tokens",
+        type=int,
+        default=0,
+        help="Token budget of the emulated prompt-prefix cache (0 = off)",
+    )
+    parser.add_argument(
+        "--prefix-cache-ttl",
+        type=float,
+        default=300.0,
+        help="Seconds a cached prefix survives without being reused (<= 0 = no expiry)",
+    )
+    parser.add_argument(
+        "--prefix-cache-min-tokens",
+        type=int,
+        default=64,
+        help="Shortest message prefix, in estimated tokens, that is cached",
+    )
+    parser.add_argument(
+        "--prefill-tokens-per-s",
+        type=float,
+        default=0.0,
+        help="Extra time to first byte = uncached prompt tokens / this rate (0 = no prefill delay)",
+    )
+    parser.add_argument(
+        "--corpus",
+        default=None,
+        metavar="PATH",
+        help='Replay recorded translations from a JSONL corpus of {"src": ..., "dst": ...} lines (mmap, index at PATH.idx)',
+    )
+    parser.add_argument(
+        "--vocabulary",
+        default="en",
+        choices=sorted(TEXT_VOCABULARY_WORDS),
+        help="Word pool for synthetic translations (cjk = Chinese words, no spaces)",
+    )
+    parser.add_argument(
+        "--output-length",
+        default="words",
+        choices=["words", "proportional"],
+        help="Synthetic line length: words = 4-10 words, proportional = source chars * expansion ratio",
+    )
+    parser.add_argument(
+        "--expansion-ratio",
+        type=parse_expansion_ratio,
+        action="append",
+        default=[],
+        metavar="SRC-DST=RATIO",
+        help="Override the output/source char ratio for a language pair, e.g. ja-en=2.5 (repeatable)",
+    )
+    parser.add_argument(
+        "--reasoning",
+        default=REASONING_MODE_OFF,
+        choices=[REASONING_MODE_OFF, REASONING_MODE_REQUEST, REASONING_MODE_ALWAYS],
+        help="Emit reasoning_content before the answer: request = only when reasoning_effort is sent, always = also default effort",
+    )
+    parser.add_argument(
+        "--reasoning-default-effort",
+        default="medium",
+        choices=list(REASONING_EFFORT_TOKENS),
+        help="Effort used by --reasoning always when the request sends none",
+    )
+    parser.add_argument(
+        "--reasoning-scale",
+        type=float,
+        default=1.0,
+        help="Multiplier on the per-effort reasoning token counts",
+    )
+    parser.add_argument(
+        "--reasoning-tokens-per-s",
+        type=float,
+        default=0.0,
+        help="Extra thinking time = reasoning tokens / this rate (0 = reasoning shares the jitter)",
+    )
+    parser.add_argument(
+        "--tool-rounds",
+        type=int,
+        default=0,
+        help="Requests carrying tools get this many tool_calls turns before a plain answer (0 = off)",
+    )
+    parser.add_argument(
+        "--tool-script",
+        default=None,
+        metavar="PATH",
+        help='JSON list of {"tool_calls": [...]} / {"content": ...} steps; overrides --tool-rounds',
+    )
     parser.add_argument("--min-jitter", type=float, default=2.0)
     parser.add_argument("--max-jitter", type=float, default=20.0)
     parser.add_argument(
         "--task",
         default=TASK_TRANSLATION,
-        choices=[TASK_TRANSLATION, TASK_ANALYSIS],
-        help="Mock task mode: translation keeps old numbered JSONLINE, analysis returns glossary JSONLINE",
+        choices=[TASK_TRANSLATION, TASK_ANALYSIS, TASK_SAKURA, TASK_AUTO],
+        help="Mock task mode: translation keeps old numbered JSONLINE, analysis returns glossary JSONLINE, sakura returns line-aligned plain text, auto picks per request",
+    )
+    parser.add_argument(
+        "--sakura-tokens-per-s",
+        type=float,
+        default=40.0,
+        help="Sakura mode decode speed added on top of jitter (0 = no decode delay)",
+    )
+    parser.add_argument(
+        "--content-fault",
+        type=parse_content_fault,
+        action="append",
+        default=[],
+        metavar="MODE=PROB",
+        help="Inject a response-quality fault with the given per-response probability, "
+        f"MODE in {', '.join(CONTENT_FAULT_MODES)} (repeatable)",
+    )
+    parser.add_argument(
+        "--sse-fragment",
+        type=parse_sse_fragment,
+        action="append",
+        default=[],
+        metavar="MODE=PROB",
+        help="Split each SSE message into several writes with the given per-message probability, "
+        f"MODE in {', '.join(SSE_FRAGMENT_MODES)} (repeatable)",
     )
     parser.add_argument(
         "--stream-chunk-lines",
@@ -1288,6 +6170,397 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
+def build_server_config(args: argparse.Namespace) -> MockServerConfig:
+    """把命令行参数收敛成不可变配置，避免参数在各层函数间逐个透传。"""
+
+    return MockServerConfig(
+        read_timeout_s=float(args.read_timeout),
+        allow_half_close=bool(args.allow_half_close),
+        max_header_bytes=int(args.max_header_bytes),
+        max_body_bytes=int(args.max_body_bytes),
+        ingest_chunk_bytes=int(args.ingest_chunk_bytes),
+        stream_ingest_threshold=int(args.stream_ingest_threshold),
+        min_jitter_s=float(args.min_jitter),
+        max_jitter_s=float(args.max_jitter),
+        stream_chunk_lines=int(args.stream_chunk_lines),
+        seed=args.seed,
+        task=str(args.task),
+        max_connections=int(args.max_connections),
+        memory_budget_bytes=int(args.memory_budget_bytes),
+        retry_after_s=int(args.retry_after),
+        soak_interval_s=float(args.soak_interval),
+        soak_output=args.soak_output,
+        soak_top_n=int(args.soak_top),
+        access_log=args.access_log,
+        trace_output=args.trace_output,
+        profile_output=args.profile,
+        profile_sample_interval_s=float(args.profile_sample_interval),
+        slow_callback_s=float(args.slow_callback_ms) / 1000.0,
+        timer_tick_s=float(args.timer_tick_ms) / 1000.0,
+        offload_threshold_bytes=int(args.offload_threshold),
+        offload_workers=int(args.offload_workers),
+        offload_queue=int(args.offload_queue),
+        batch_capacity_rps=float(args.batch_capacity_rps),
+        batch_max_active=int(args.batch_max_active),
+        batch_min_duration_s=float(args.batch_min_duration),
+        prefix_cache_tokens=int(args.prefix_cache_tokens),
+        prefix_cache_ttl_s=float(args.prefix_cache_ttl),
+        prefix_cache_min_tokens=int(args.prefix_cache_min_tokens),
+        prefill_tokens_per_s=float(args.prefill_tokens_per_s),
+        response_compression=bool(args.response_compression),
+        sse_compression=bool(args.sse_compression),
+        compression_level=int(args.compression_level),
+        compress_min_bytes=int(args.compress_min_bytes),
+        corpus_path=args.corpus,
+        reasoning_mode=str(args.reasoning),
+        reasoning_default_effort=str(args.reasoning_default_effort),
+        reasoning_scale=float(args.reasoning_scale),
+        reasoning_tokens_per_s=float(args.reasoning_tokens_per_s),
+        tool_script=load_tool_script(args.tool_script, int(args.tool_rounds)),
+        sakura_tokens_per_s=float(args.sakura_tokens_per_s),
+        # 同一模式重复指定时以最后一次为准
+        content_faults=tuple(dict(args.content_fault).items()),
+        # 抽签顺序固定为 SSE_FRAGMENT_MODES，与命令行顺序无关
+        sse_fragments=tuple(
+            (mode, rate)
+            for mode, rate in sorted(
+                dict(args.sse_fragment).items(),
+                key=lambda item: SSE_FRAGMENT_MODES.index(item[0]),
+            )
+            if rate > 0
+        ),
+        output_model=OutputModel(
+            vocabulary=str(args.vocabulary),
+            proportional=args.output_length == "proportional",
+            expansion_ratios=tuple(args.expansion_ratio),
+        ),
+    )
+
+
+class MockServer:
+    """事件循环内运行的服务句柄：base_url 交给客户端，stats() 读取实时计数。
+
+    TCP 与 Unix 套接字监听器共用同一个 ServerState，路由、准入和统计完全一致。
+    """
+
+    def __init__(
+        self,
+        state: ServerState,
+        *,
+        tcp_server: asyncio.Server | None = None,
+        unix_server: asyncio.Server | None = None,
+        unix_socket: str | None = None,
+        soak_task: asyncio.Task[None] | None = None,
+    ) -> None:
+        """保存监听器与共享状态，并记下 TCP 实际绑定的地址。"""
+
+        self.state = state
+        self.config = state.config
+        self.tcp_server = tcp_server
+        self.unix_server = unix_server
+        self.unix_socket = unix_socket
+        self.soak_task = soak_task
+        self.servers = [s for s in (tcp_server, unix_server) if s is not None]
+        self.host: str | None = None
+        self.port: int | None = None
+        if tcp_server is not None:
+            self.host, self.port = tcp_server.sockets[0].getsockname()[:2]
+
+    @property
+    def base_url(self) -> str:
+        """OpenAI 兼容客户端使用的 API Base URL。
+
+        只开 Unix 套接字时返回 http://localhost/v1，客户端需要走 UDS transport 连接 unix_socket。
+        """
+
+        if self.host is None:
+            return "http://localhost/v1"
+        host = f"[{self.host}]" if ":" in self.host else self.host
+        return f"http://{host}:{self.port}/v1"
+
+    def stats(self) -> dict[str, Any]:
+        """返回与 /health 相同的状态快照。"""
+
+        return self.state.snapshot()
+
+    async def serve_forever(self) -> None:
+        """持续服务直到任务被取消。"""
+
+        await asyncio.gather(*(server.serve_forever() for server in self.servers))
+
+    async def close(self) -> None:
+        """停止监听，断开在途连接并等连接任务收尾后释放后台资源。
+
+        先中止传输：断开监听与读写异常让连接任务自行走完 finally（访问日志、预算归还），
+        不以取消结束；Python 3.11 的 StreamReaderProtocol 会为被取消的连接任务打印 CancelledError 回溯。
+        """
+
+        for server in self.servers:
+            server.close()
+        for writer in list(self.state.live_writers):
+            writer.transport.abort()
+        tasks = list(self.state.connection_tasks)
+        if tasks:
+            _, stuck = await asyncio.wait(tasks, timeout=SHUTDOWN_GRACE_S)
+            for task in stuck:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for server in self.servers:
+            await server.wait_closed()
+        if self.unix_socket is not None:
+            remove_stale_unix_socket(self.unix_socket)
+        if self.soak_task is not None:
+            self.soak_task.cancel()
+        self.state.close()
+
+    async def __aenter__(self) -> Self:
+        """支持 async with 自动关闭。"""
+
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        """退出上下文时关闭服务。"""
+
+        await self.close()
+
+
+def remove_stale_unix_socket(path: str) -> None:
+    """删除残留的套接字文件，否则 bind 会报地址已占用；同名普通文件保持不动。"""
+
+    socket_path = pathlib.Path(path)
+    if socket_path.is_socket():
+        socket_path.unlink(missing_ok=True)
+
+
+async def start_mock_server(
+    config: MockServerConfig | None = None,
+    *,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    backlog: int = 4096,
+    unix_socket: str | None = None,
+    tcp: bool = True,
+) -> MockServer:
+    """在当前事件循环里启动服务；port=0 时由系统分配空闲端口，便于并行跑多组配置。
+
+    unix_socket 给出路径时额外（tcp=False 时改为只）在 Unix 域套接字上监听，
+    同机压测可以绕开回环 TCP 的协议栈开销和临时端口压力。
+    """
+
+    config = config or MockServerConfig()
+    if (
+        config.min_jitter_s < 0
+        or config.max_jitter_s < 0
+        or config.max_jitter_s < config.min_jitter_s
+    ):
+        raise ValueError("Invalid jitter range")
+    if not tcp and unix_socket is None:
+        raise ValueError("At least one of TCP or a Unix socket must be enabled")
+    if unix_socket is not None and not hasattr(asyncio, "start_unix_server"):
+        raise ValueError("Unix domain sockets are not supported on this platform")
+
+    state = ServerState(config)
+    loop = asyncio.get_running_loop()
+    if config.slow_callback_s > 0:
+        enable_slow_callback_detection(loop, state, config.slow_callback_s)
+    if config.timer_tick_s > 0:
+        state.timer = TimingWheel(loop, config.timer_tick_s)
+    if config.offload_threshold_bytes >= 0:
+        state.offload = OffloadPool(
+            state,
+            workers=config.offload_workers,
+            max_queue=config.offload_queue,
+            threshold_bytes=config.offload_threshold_bytes,
+        )
+
+    protocol_factory = make_connection_protocol_factory(
+        lambda r, w: handle_connection(r, w, config=config, state=state)
+    )
+    soak_task: asyncio.Task[None] | None = None
+    tcp_server: asyncio.Server | None = None
+    unix_server: asyncio.Server | None = None
+    try:
+        if config.access_log:
+            state.access_log = BackgroundJsonlWriter(config.access_log)
+        if config.trace_output:
+            state.span_exporter = BackgroundJsonlWriter(config.trace_output)
+        if config.corpus_path:
+            state.corpus = ResponseCorpus(config.corpus_path)
+            logging.getLogger(__name__).info(
+                "Corpus mode: %d records from %s",
+                state.corpus.count,
+                config.corpus_path,
+            )
+
+        if tcp:
+            tcp_server = await loop.create_server(
+                protocol_factory,
+                host=host,
+                port=port,
+                backlog=backlog,
+            )
+        if unix_socket is not None:
+            remove_stale_unix_socket(unix_socket)
+            unix_server = await loop.create_unix_server(
+                protocol_factory,
+                path=unix_socket,
+                backlog=backlog,
+            )
+    except BaseException:
+        if tcp_server is not None:
+            tcp_server.close()
+        state.close()
+        raise
+
+    if config.soak_interval_s > 0:
+        state.soak = SoakMonitor(
+            state,
+            interval_s=config.soak_interval_s,
+            output_path=config.soak_output,
+            top_n=config.soak_top_n,
+        )
+        soak_task = asyncio.create_task(state.soak.run())
+    return MockServer(
+        state,
+        tcp_server=tcp_server,
+        unix_server=unix_server,
+        unix_socket=unix_socket,
+        soak_task=soak_task,
+    )
+
+
+class MockServerThread:
+    """在后台线程的独立事件循环里运行服务，供同步代码和 pytest 使用。
+
+    ServerState 只允许在事件循环线程里读写，stats() 因此切回服务线程取快照。
+    """
+
+    def __init__(
+        self,
+        config: MockServerConfig | None = None,
+        *,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        backlog: int = 4096,
+        unix_socket: str | None = None,
+        tcp: bool = True,
+    ) -> None:
+        """启动线程与事件循环，阻塞到端口开始监听。"""
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="mock-llm-server", daemon=True
+        )
+        self.thread.start()
+        future = asyncio.run_coroutine_threadsafe(
+            start_mock_server(
+                config,
+                host=host,
+                port=port,
+                backlog=backlog,
+                unix_socket=unix_socket,
+                tcp=tcp,
+            ),
+            self.loop,
+        )
+        try:
+            self.server = future.result()
+        except BaseException:
+            self.stop_loop()
+            raise
+
+    @property
+    def base_url(self) -> str:
+        """OpenAI 兼容客户端使用的 API Base URL。"""
+
+        return self.server.base_url
+
+    @property
+    def port(self) -> int | None:
+        """实际绑定的 TCP 端口，只开 Unix 套接字时为 None。"""
+
+        return self.server.port
+
+    @property
+    def unix_socket(self) -> str | None:
+        """Unix 套接字路径。"""
+
+        return self.server.unix_socket
+
+    def stats(self) -> dict[str, Any]:
+        """在服务线程里取 /health 同款快照。"""
+
+        async def collect() -> dict[str, Any]:
+            return self.server.stats()
+
+        return asyncio.run_coroutine_threadsafe(collect(), self.loop).result()
+
+    def close(self) -> None:
+        """关闭服务（先断开连接再收尾），取消残留的后台任务后停止线程。"""
+
+        if self.loop.is_closed():
+            return
+
+        async def shutdown() -> None:
+            await self.server.close()
+            current = asyncio.current_task()
+            pending = [task for task in asyncio.all_tasks() if task is not current]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        try:
+            asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        finally:
+            self.stop_loop()
+
+    def stop_loop(self) -> None:
+        """停止事件循环并回收线程。"""
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def __enter__(self) -> Self:
+        """支持 with 自动关闭。"""
+
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        """退出上下文时关闭服务。"""
+
+        self.close()
+
+
+def make_pytest_fixture(
+    config: MockServerConfig | None = None, *, scope: str = "function"
+) -> Any:
+    """生成 pytest fixture，在 conftest.py 里写 mock_llm_server = make_pytest_fixture()。
+
+    默认关闭抖动；用 indirect 参数化时 request.param 可以是 MockServerConfig，
+    也可以是覆盖字段的 dict，每组参数各自占用一个临时端口，可与 pytest-xdist 并行。
+    pytest 只在调用时导入，脚本本身仍只依赖标准库。
+    """
+
+    import pytest
+
+    base_config = config or MockServerConfig(min_jitter_s=0.0, max_jitter_s=0.0)
+
+    @pytest.fixture(scope=scope)
+    def mock_llm_server(request: Any) -> Any:
+        param = getattr(request, "param", None)
+        if isinstance(param, MockServerConfig):
+            server_config = param
+        elif isinstance(param, dict):
+            server_config = dataclasses.replace(base_config, **param)
+        else:
+            server_config = base_config
+        with MockServerThread(server_config) as server:
+            yield server
+
+    return mock_llm_server
+
+
 async def run_server(args: argparse.Namespace) -> None:
     """启动 asyncio TCP server 并保持服务运行。"""
 
@@ -1296,36 +6569,60 @@ async def run_server(args: argparse.Namespace) -> None:
         format="[%(asctime)s] %(levelname)s %(message)s",
     )
 
-    if args.min_jitter < 0 or args.max_jitter < 0 or args.max_jitter < args.min_jitter:
-        raise SystemExit("Invalid jitter range")
-
-    server = await asyncio.start_server(
-        lambda r, w: handle_connection(
-            r,
-            w,
-            read_timeout_s=float(args.read_timeout),
-            max_header_bytes=int(args.max_header_bytes),
-            max_body_bytes=int(args.max_body_bytes),
-            min_jitter_s=float(args.min_jitter),
-            max_jitter_s=float(args.max_jitter),
-            stream_chunk_lines=int(args.stream_chunk_lines),
-            seed=args.seed,
-            task=str(args.task),
-        ),
-        host=args.host,
-        port=args.port,
-        backlog=int(args.backlog),
-    )
+    config = build_server_config(args)
+    try:
+        mock_server = await start_mock_server(
+            config,
+            host=args.host,
+            port=args.port,
+            backlog=int(args.backlog),
+            unix_socket=args.unix_socket,
+            tcp=not args.no_tcp,
+        )
+    except ValueError as e:
+        raise SystemExit(str(e)) from e
+
+    loop = asyncio.get_running_loop()
+    profiler: LoopProfiler | None = None
+    if config.profile_output:
+        profiler = LoopProfiler(
+            config.profile_output,
+            sample_interval_s=config.profile_sample_interval_s,
+        )
+        profiler.start()
+        serve_task = asyncio.current_task()
+        try:
+            # SIGUSR1 随时导出；SIGTERM 走正常收尾，保证退出前写出结果
+            loop.add_signal_handler(signal.SIGUSR1, profiler.dump)
+            if serve_task is not None:
+                loop.add_signal_handler(signal.SIGTERM, serve_task.cancel)
+        except (AttributeError, NotImplementedError):
+            # Windows 事件循环不支持 add_signal_handler，只在退出时导出
+            pass
 
-    addrs = ", ".join(str(sock.getsockname()) for sock in (server.sockets or []))
+    addrs = ", ".join(
+        str(sock.getsockname())
+        for server in mock_server.servers
+        for sock in (server.sockets or [])
+    )
     logging.getLogger(__name__).info("Mock LLM API server listening on %s", addrs)
     logging.getLogger(__name__).info(
-        "Endpoints: POST /v1/chat/completions, GET /v1/models, GET /health"
+        "Endpoints: POST /v1/chat/completions, GET /v1/models, GET /health, /v1/files, /v1/batches"
     )
     logging.getLogger(__name__).info("Task mode: %s", args.task)
+    if mock_server.soak_task is not None:
+        logging.getLogger(__name__).info(
+            "Soak mode: every %.1fs -> %s, GET /debug/soak",
+            config.soak_interval_s,
+            config.soak_output or "(endpoint only)",
+        )
 
-    async with server:
-        await server.serve_forever()
+    try:
+        await mock_server.serve_forever()
+    finally:
+        await mock_server.close()
+        if profiler is not None:
+            profiler.stop()
 
 
 def main() -> None:
@@ -0,0 +1,1124 @@
+"""模拟 LLM API Server 的基准结果库与回归检测。
+
+用途
+- 把每次压测（mock 自身或 LinguaGacha 引擎打 mock）的吞吐与延迟分位数落到本地 JSONL，
+  避免临时跑出来的数字丢失。
+- 仅使用标准库。
+
+子命令
+- run：内置 asyncio 压测客户端直接打 mock 服务，测 TTFB/总延迟与吞吐并入库。
+- import-access-log：把 mock 服务 --access-log 产出的 JSONL 汇总成一条结果（用于 LinguaGacha 作为客户端的场景）。
+- list：列出结果库中的记录。
+- compare：以某个基线对比候选结果，发现统计显著的回归时以非零码退出，可直接放进 CI。
+- report：把 LinguaGacha --cli 的 stdout JSONL（started/progress/finished）与 mock 访问日志按时间对齐，
+  输出容量报告（文本摘要 + 可选 CSV 时间序列），不写入结果库。
+
+容量报告指标
+- lines/s：按 --bucket-s 分桶统计 completed 的增量；另给出首个完成到 --tail-fraction 之间的稳态速率。
+- 首个完成耗时：started 到第一条 completed > 0 的 progress。
+- 尾部排空：completed 达到最终值的 --tail-fraction 到 finished 的时长。
+- 重试放大：chat 请求数 / 完成行数，以及 mock 返回的行数 / 完成行数。
+- 服务端利用率：平均与峰值在途请求数、至少有一个在途请求的时间占比、
+  生成 CPU 占事件循环单核的比例。
+
+每条记录包含
+- 环境指纹：Python/平台/CPU/主机/git 提交与是否有未提交修改。
+- 压测配置、吞吐（req/s、lines/s）、延迟分位数（p50/p90/p95/p99/max），
+  以及最多 --max-samples 个原始延迟样本（compare 做显著性检验时使用）。
+
+显著性判定
+- 延迟：候选相对基线做单侧 Mann-Whitney U 检验（正态近似），p < --alpha 且中位数变差超过 --threshold 才算回归。
+- 吞吐：基线与候选各有 >= 3 条记录时同样做 U 检验；否则只按 --threshold 的相对降幅判断。
+  每侧仅 3 条时 p 值最小约 0.04，默认 --alpha 0.01 下建议每侧重复 5 次以上。
+
+示例
+   uv run python buildtools/mock_llm_bench.py run --url http://127.0.0.1:8000 --label main --requests 2000 --concurrency 200
+   uv run python buildtools/mock_llm_bench.py run --unix-socket /tmp/mock-llm.sock --label main-uds --requests 2000 --concurrency 200
+   uv run python buildtools/mock_llm_bench.py import-access-log /tmp/access.jsonl --label lg-translate
+   uv run python buildtools/mock_llm_bench.py compare --baseline main --candidate latest
+   uv run python buildtools/mock_llm_bench.py report --cli-log /tmp/cli.jsonl --access-log /tmp/access.jsonl --csv /tmp/capacity.csv
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import csv
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any
+from urllib.parse import urlsplit
+
+DEFAULT_STORE_PATH: str = os.path.join("build", "mock-bench", "results.jsonl")
+PERCENTILES: tuple[int, ...] = (50, 90, 95, 99)
+LATENCY_METRICS: tuple[str, ...] = ("total_ms", "ttfb_ms")
+MIN_RUNS_FOR_THROUGHPUT_TEST: int = 3
+CHAT_COMPLETION_PATHS: tuple[str, ...] = ("/v1/chat/completions", "/chat/completions")
+REPORT_CSV_FIELDS: tuple[str, ...] = (
+    "t_s",
+    "completed",
+    "failed",
+    "lines_per_s",
+    "requests_started",
+    "requests_failed",
+    "mean_in_flight",
+    "generate_cpu_pct",
+)
+SAMPLE_WORDS: tuple[str, ...] = (
+    "勇者は剣を抜いた。",
+    "霜之哀伤正在发光。",
+    "「行くぞ、みんな！」",
+    "The gate creaks open.",
+    "圣女艾琳在教堂祈祷。",
+    "魔王城の扉が静かに開く。",
+)
+
+
+@dataclass(frozen=True)
+class RequestSample:
+    """单个请求的客户端测量结果。"""
+
+    status: int
+    ttfb_ms: float
+    total_ms: float
+    bytes_in: int
+
+
+@dataclass(frozen=True)
+class Comparison:
+    """单个指标的对比结论。"""
+
+    metric: str
+    baseline: float
+    candidate: float
+    change: float
+    p_value: float | None
+    regression: bool
+
+
+@dataclass(frozen=True)
+class ProgressPoint:
+    """CLI 一条 progress 事件中的累计计数。"""
+
+    at: float
+    completed: int
+    failed: int
+    total: int
+
+
+@dataclass(frozen=True)
+class CliRun:
+    """从 CLI stdout JSONL 还原的一次任务。"""
+
+    command: str | None
+    status: str | None
+    started_at: float | None
+    finished_at: float | None
+    points: list[ProgressPoint]
+
+
+def read_jsonl(path: str) -> list[dict[str, Any]]:
+    """读取 JSONL；空行、非 JSON 行与非对象行直接跳过（CLI stdout 可能混入其他输出）。"""
+
+    items: list[dict[str, Any]] = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(item, dict):
+                items.append(item)
+    return items
+
+
+def load_chat_records(path: str) -> list[dict[str, Any]]:
+    """从访问日志中取出 chat completions 请求记录。"""
+
+    return [
+        record
+        for record in read_jsonl(path)
+        if record.get("path") in CHAT_COMPLETION_PATHS
+        and record.get("accepted_at") is not None
+    ]
+
+
+def request_span(record: dict[str, Any]) -> tuple[float, float]:
+    """返回请求在墙钟上的起止时间（秒）；没有写出任何字节时按 body 读完为止。"""
+
+    start = float(record["accepted_at"])
+    end_ms = record.get("last_byte_ms")
+    if end_ms is None:
+        end_ms = record.get("body_ms") or record.get("head_ms") or 0.0
+    return start, start + float(end_ms) / 1000.0
+
+
+def request_failed(record: dict[str, Any]) -> bool:
+    """与服务端 error_total 口径一致：非 200 或未正常写完（含客户端提前断开）都算失败。"""
+
+    reason = record.get("disconnect_reason")
+    return record.get("status") != 200 or reason not in (None, "complete")
+
+
+def parse_cli_timestamp(value: Any) -> float | None:
+    """把 CLI 事件里的 ISO 8601 时间戳转成 epoch 秒。"""
+
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+def load_cli_run(path: str) -> CliRun:
+    """解析 CLI stdout JSONL；文件里有多次任务时只取最后一次 started 之后的事件。"""
+
+    command: str | None = None
+    status: str | None = None
+    started_at: float | None = None
+    finished_at: float | None = None
+    points: list[ProgressPoint] = []
+    for event in read_jsonl(path):
+        kind = event.get("event")
+        at = parse_cli_timestamp(event.get("timestamp"))
+        if kind == "started":
+            command = event.get("command")
+            status = None
+            started_at = at
+            finished_at = None
+            points = []
+        elif kind == "progress" and at is not None:
+            stats = event.get("stats") or {}
+            points.append(
+                ProgressPoint(
+                    at=at,
+                    completed=int(stats.get("completed") or 0),
+                    failed=int(stats.get("failed") or 0),
+                    total=int(stats.get("total") or 0),
+                )
+            )
+            status = event.get("status", status)
+        elif kind == "finished":
+            status = event.get("status", status)
+            finished_at = at
+    points.sort(key=lambda point: point.at)
+    return CliRun(
+        command=command,
+        status=status,
+        started_at=started_at,
+        finished_at=finished_at,
+        points=points,
+    )
+
+
+def cumulative_at(points: list[ProgressPoint], at: float) -> tuple[int, int]:
+    """返回时刻 at 时已知的 (completed, failed)；progress 只在变化时输出，因此向前沿用。"""
+
+    completed = failed = 0
+    for point in points:
+        if point.at > at:
+            break
+        completed, failed = point.completed, point.failed
+    return completed, failed
+
+
+def interval_union_s(spans: list[tuple[float, float]]) -> float:
+    """区间并集长度。"""
+
+    busy = 0.0
+    current_start: float | None = None
+    current_end = 0.0
+    for start, end in sorted(spans):
+        if current_start is None or start > current_end:
+            if current_start is not None:
+                busy += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_start is not None:
+        busy += current_end - current_start
+    return busy
+
+
+def peak_in_flight(spans: list[tuple[float, float]]) -> int:
+    """扫描线求最大在途请求数；同一时刻先结束后开始。"""
+
+    edges = sorted(
+        [(start, 1) for start, _ in spans] + [(end, -1) for _, end in spans],
+        key=lambda edge: (edge[0], edge[1]),
+    )
+    peak = current = 0
+    for _, delta in edges:
+        current += delta
+        peak = max(peak, current)
+    return peak
+
+
+def records_in_cli_window(
+    run: CliRun, records: list[dict[str, Any]]
+) -> list[dict[str, Any]]:
+    """只保留在本次任务 started 与 finished 之间开始的请求，避免同一份访问日志里其他任务的干扰。"""
+
+    if run.started_at is None:
+        return records
+    window_end = math.inf if run.finished_at is None else run.finished_at
+    return [
+        r for r in records if run.started_at <= float(r["accepted_at"]) <= window_end
+    ]
+
+
+def build_capacity_timeline(
+    run: CliRun,
+    records: list[dict[str, Any]],
+    *,
+    origin: float,
+    end: float,
+    bucket_s: float,
+) -> list[dict[str, Any]]:
+    """按固定时间桶对齐 CLI 进度与服务端请求。"""
+
+    bucket_count = max(1, math.ceil((end - origin) / bucket_s))
+    rows: list[dict[str, Any]] = []
+    previous_completed = 0
+    for index in range(bucket_count):
+        bucket_end = min(origin + (index + 1) * bucket_s, end)
+        completed, failed = cumulative_at(run.points, bucket_end)
+        rows.append(
+            {
+                "t_s": round(index * bucket_s, 3),
+                "completed": completed,
+                "failed": failed,
+                "lines_per_s": round((completed - previous_completed) / bucket_s, 3),
+                "requests_started": 0,
+                "requests_failed": 0,
+                "mean_in_flight": 0.0,
+                "generate_cpu_pct": 0.0,
+            }
+        )
+        previous_completed = completed
+
+    for record in records:
+        start, stop = request_span(record)
+        first = int((start - origin) // bucket_s)
+        if 0 <= first < bucket_count:
+            rows[first]["requests_started"] += 1
+            if request_failed(record):
+                rows[first]["requests_failed"] += 1
+            # 生成 CPU 只发生在请求开头附近，整笔记到起始桶即可。
+            rows[first]["generate_cpu_pct"] += float(
+                record.get("generate_cpu_ms") or 0.0
+            ) / (bucket_s * 10.0)
+        last = min(int((stop - origin) // bucket_s), bucket_count - 1)
+        for index in range(max(first, 0), last + 1):
+            bucket_start = origin + index * bucket_s
+            overlap = min(stop, bucket_start + bucket_s) - max(start, bucket_start)
+            if overlap > 0:
+                rows[index]["mean_in_flight"] += overlap / bucket_s
+
+    for row in rows:
+        row["mean_in_flight"] = round(row["mean_in_flight"], 3)
+        row["generate_cpu_pct"] = round(row["generate_cpu_pct"], 2)
+    return rows
+
+
+def summarize_capacity(
+    run: CliRun,
+    records: list[dict[str, Any]],
+    *,
+    tail_fraction: float,
+) -> dict[str, Any]:
+    """汇总一次 CLI 任务的容量指标；缺失的数据源对应字段为 None。"""
+
+    spans = [request_span(r) for r in records]
+    starts = [p.at for p in run.points] + [start for start, _ in spans]
+    ends = [p.at for p in run.points] + [end for _, end in spans]
+    origin = run.started_at if run.started_at is not None else min(starts, default=0.0)
+    end = run.finished_at if run.finished_at is not None else max(ends, default=origin)
+    wall_s = max(end - origin, 0.0)
+
+    last = run.points[-1] if run.points else None
+    completed = 0 if last is None else last.completed
+    failed = 0 if last is None else last.failed
+
+    first_completion = next((p.at for p in run.points if p.completed > 0), None)
+    tail_start = next(
+        (
+            p.at
+            for p in run.points
+            if completed > 0 and p.completed >= completed * tail_fraction
+        ),
+        None,
+    )
+    steady_lines_per_s = None
+    if first_completion is not None and tail_start is not None:
+        steady_s = tail_start - first_completion
+        steady_lines = (
+            cumulative_at(run.points, tail_start)[0]
+            - cumulative_at(run.points, first_completion)[0]
+        )
+        if steady_s > 0:
+            steady_lines_per_s = steady_lines / steady_s
+
+    summary: dict[str, Any] = {
+        "command": run.command,
+        "status": run.status,
+        "wall_s": wall_s,
+        "total": None if last is None else last.total,
+        "completed": completed,
+        "failed": failed,
+        "lines_per_s": completed / wall_s if wall_s > 0 else None,
+        "steady_lines_per_s": steady_lines_per_s,
+        "time_to_first_completion_s": None
+        if first_completion is None
+        else first_completion - origin,
+        "tail_drain_s": None if tail_start is None else end - tail_start,
+        "requests": None,
+        "requests_failed": None,
+        "requests_per_line": None,
+        "lines_served_per_line": None,
+        "mean_in_flight": None,
+        "peak_in_flight": None,
+        "busy_fraction": None,
+        "generate_cpu_fraction": None,
+    }
+    if records:
+        requests_failed = sum(1 for r in records if request_failed(r))
+        lines_served = sum(
+            int(r.get("line_count") or 0) for r in records if r.get("status") == 200
+        )
+        request_wall_s = max(wall_s, max(ends) - min(starts))
+        summary.update(
+            requests=len(records),
+            requests_failed=requests_failed,
+            requests_per_line=len(records) / completed if completed else None,
+            lines_served_per_line=lines_served / completed if completed else None,
+            mean_in_flight=sum(stop - start for start, stop in spans) / request_wall_s
+            if request_wall_s > 0
+            else None,
+            peak_in_flight=peak_in_flight(spans),
+            busy_fraction=interval_union_s(spans) / request_wall_s
+            if request_wall_s > 0
+            else None,
+            generate_cpu_fraction=sum(
+                float(r.get("generate_cpu_ms") or 0.0) for r in records
+            )
+            / 1000.0
+            / request_wall_s
+            if request_wall_s > 0
+            else None,
+        )
+    summary["origin"] = origin
+    summary["end"] = end
+    return summary
+
+
+def format_metric(value: Any, unit: str = "", digits: int = 3) -> str:
+    """报告里的数值格式；缺失时显示 n/a。"""
+
+    if value is None:
+        return "n/a"
+    if isinstance(value, float):
+        return f"{value:.{digits}f}{unit}"
+    return f"{value}{unit}"
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """线性插值分位数；输入需已排序。"""
+
+    if not sorted_values:
+        return math.nan
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * pct / 100.0
+    low = math.floor(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (
+        rank - low
+    )
+
+
+def summarize_latencies(values: list[float]) -> dict[str, float]:
+    """生成 p50/p90/p95/p99/max/mean 摘要。"""
+
+    ordered = sorted(values)
+    summary = {f"p{pct}": round(percentile(ordered, pct), 3) for pct in PERCENTILES}
+    summary["max"] = round(ordered[-1], 3) if ordered else math.nan
+    summary["mean"] = round(sum(ordered) / len(ordered), 3) if ordered else math.nan
+    return summary
+
+
+def downsample(values: list[float], limit: int, rng: random.Random) -> list[float]:
+    """保留至多 limit 个样本，避免结果库随请求量膨胀。"""
+
+    if len(values) <= limit:
+        return [round(v, 3) for v in values]
+    return [round(v, 3) for v in rng.sample(values, limit)]
+
+
+def read_git_state() -> dict[str, Any]:
+    """读取当前 git 提交与是否有未提交修改；不在仓库内时返回空值。"""
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=5,
+        ).stdout.strip()
+        dirty = bool(
+            subprocess.run(
+                ["git", "status", "--porcelain", "--untracked-files=no"],
+                capture_output=True,
+                text=True,
+                check=True,
+                timeout=5,
+            ).stdout.strip()
+        )
+    except (OSError, subprocess.SubprocessError):
+        return {"git_commit": None, "git_dirty": None}
+    return {"git_commit": commit, "git_dirty": dirty}
+
+
+def build_environment_fingerprint() -> dict[str, Any]:
+    """采集能影响性能数字的环境信息。"""
+
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "hostname": socket.gethostname(),
+        **read_git_state(),
+    }
+
+
+def fingerprint_key(fingerprint: dict[str, Any]) -> tuple[Any, ...]:
+    """对比时只关心硬件与运行时，git 信息允许不同。"""
+
+    return tuple(
+        fingerprint.get(key)
+        for key in ("python", "implementation", "platform", "machine", "cpu_count")
+    )
+
+
+def build_prompt(task: str, lines: int, rng: random.Random) -> str:
+    """按 LinguaGacha 的提示词结构构造压测输入。"""
+
+    if task == "analysis":
+        body = "\n".join(rng.choice(SAMPLE_WORDS) for _ in range(lines))
+        return "输入：\n" + body
+    jsonline = "\n".join(
+        json.dumps({str(i): rng.choice(SAMPLE_WORDS)}, ensure_ascii=False)
+        for i in range(lines)
+    )
+    return "Input:\n```jsonline\n" + jsonline + "\n```\n"
+
+
+async def send_one(
+    host: str,
+    port: int,
+    path: str,
+    body: bytes,
+    timeout_s: float,
+    unix_socket: str | None = None,
+) -> RequestSample:
+    """发送一个请求并读到连接关闭（mock 服务总是 Connection: close）。
+
+    给出 unix_socket 时改走 Unix 域套接字，Host 头仍按 URL 填写。
+    """
+
+    started = time.perf_counter()
+    connect = (
+        asyncio.open_unix_connection(unix_socket)
+        if unix_socket is not None
+        else asyncio.open_connection(host, port)
+    )
+    reader, writer = await asyncio.wait_for(connect, timeout=timeout_s)
+    try:
+        head = (
+            f"POST {path} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+        ).encode("latin-1")
+        writer.write(head + body)
+        await writer.drain()
+
+        first = await asyncio.wait_for(reader.read(65536), timeout=timeout_s)
+        ttfb = time.perf_counter() - started
+        received = len(first)
+        status = 0
+        status_line = first.split(b"\r\n", 1)[0].split()
+        if len(status_line) >= 2 and status_line[1].isdigit():
+            status = int(status_line[1])
+        while True:
+            data = await asyncio.wait_for(reader.read(65536), timeout=timeout_s)
+            if not data:
+                break
+            received += len(data)
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+    total = time.perf_counter() - started
+    return RequestSample(
+        status=status,
+        ttfb_ms=ttfb * 1000.0,
+        total_ms=total * 1000.0,
+        bytes_in=received,
+    )
+
+
+async def run_load(args: argparse.Namespace) -> tuple[list[RequestSample], float, int]:
+    """按并发上限发出全部请求，返回样本、墙钟耗时和失败数。"""
+
+    url = urlsplit(args.url)
+    host = url.hostname or "127.0.0.1"
+    port = url.port or 80
+    path = (url.path.rstrip("/") or "") + "/v1/chat/completions"
+    if url.path.rstrip("/").endswith("/v1"):
+        path = url.path.rstrip("/") + "/chat/completions"
+
+    rng = random.Random(args.seed)
+    bodies = [
+        json.dumps(
+            {
+                "model": args.model,
+                "stream": bool(args.stream),
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": build_prompt(args.task, args.lines, rng),
+                    }
+                ],
+            },
+            ensure_ascii=False,
+        ).encode("utf-8")
+        for _ in range(min(args.requests, 64))
+    ]
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    samples: list[RequestSample] = []
+    failures = 0
+
+    async def worker(index: int) -> None:
+        nonlocal failures
+        async with semaphore:
+            try:
+                sample = await send_one(
+                    host,
+                    port,
+                    path,
+                    bodies[index % len(bodies)],
+                    args.timeout,
+                    args.unix_socket,
+                )
+            except (OSError, TimeoutError, asyncio.IncompleteReadError):
+                failures += 1
+                return
+            if sample.status != 200:
+                failures += 1
+            samples.append(sample)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(args.requests)))
+    return samples, time.perf_counter() - started, failures
+
+
+def build_result(
+    *,
+    label: str,
+    source: str,
+    config: dict[str, Any],
+    latencies: dict[str, list[float]],
+    wall_s: float,
+    requests: int,
+    failures: int,
+    lines_per_request: float,
+    max_samples: int,
+) -> dict[str, Any]:
+    """组装一条结果库记录。"""
+
+    rng = random.Random(0)
+    ok = requests - failures
+    return {
+        "id": uuid.uuid4().hex[:12],
+        "created_at": time.time(),
+        "label": label,
+        "source": source,
+        "environment": build_environment_fingerprint(),
+        "config": config,
+        "metrics": {
+            "requests": requests,
+            "failures": failures,
+            "error_rate": round(failures / requests, 6) if requests else 0.0,
+            "wall_s": round(wall_s, 3),
+            "throughput_rps": round(ok / wall_s, 3) if wall_s > 0 else 0.0,
+            "throughput_lines_per_s": (
+                round(ok * lines_per_request / wall_s, 3) if wall_s > 0 else 0.0
+            ),
+            **{
+                name: summarize_latencies(values)
+                for name, values in latencies.items()
+                if values
+            },
+        },
+        "samples": {
+            name: downsample(values, max_samples, rng)
+            for name, values in latencies.items()
+            if values
+        },
+    }
+
+
+def append_result(store_path: str, result: dict[str, Any]) -> None:
+    """追加一条记录到结果库。"""
+
+    directory = os.path.dirname(store_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(store_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+def load_results(store_path: str) -> list[dict[str, Any]]:
+    """读取结果库，坏行跳过。"""
+
+    if not os.path.exists(store_path):
+        return []
+    results: list[dict[str, Any]] = []
+    with open(store_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                results.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return results
+
+
+def select_results(
+    results: list[dict[str, Any]], selector: str
+) -> list[dict[str, Any]]:
+    """按 id、label 或 latest 选择记录；label 可能命中多次重复压测。"""
+
+    if selector == "latest":
+        return results[-1:]
+    by_id = [r for r in results if r.get("id") == selector]
+    if by_id:
+        return by_id
+    return [r for r in results if r.get("label") == selector]
+
+
+def mann_whitney_greater(candidate: list[float], baseline: list[float]) -> float:
+    """单侧 Mann-Whitney U 检验（候选偏大），返回正态近似的 p 值。
+
+    并列值取平均秩并做并列校正；样本量小时近似偏保守，足够用于回归门禁。
+    """
+
+    n1 = len(candidate)
+    n2 = len(baseline)
+    if n1 == 0 or n2 == 0:
+        return 1.0
+
+    combined = sorted(
+        [(value, 0) for value in candidate] + [(value, 1) for value in baseline]
+    )
+    ranks = [0.0] * len(combined)
+    tie_term = 0.0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        average_rank = (i + j) / 2.0 + 1.0
+        for k in range(i, j + 1):
+            ranks[k] = average_rank
+        tied = j - i + 1
+        tie_term += tied**3 - tied
+        i = j + 1
+
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, combined) if group == 0)
+    u = rank_sum - n1 * (n1 + 1) / 2.0
+    mean_u = n1 * n2 / 2.0
+    n = n1 + n2
+    variance = n1 * n2 / 12.0 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    # 连续性校正
+    z = (u - mean_u - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2.0))
+
+
+def median(values: list[float]) -> float:
+    """中位数。"""
+
+    return percentile(sorted(values), 50)
+
+
+def compare_results(
+    baseline: list[dict[str, Any]],
+    candidate: list[dict[str, Any]],
+    *,
+    alpha: float,
+    threshold: float,
+) -> list[Comparison]:
+    """逐项对比延迟与吞吐，返回每个指标的结论。"""
+
+    comparisons: list[Comparison] = []
+    for metric in LATENCY_METRICS:
+        base_samples = [
+            v for r in baseline for v in r.get("samples", {}).get(metric, [])
+        ]
+        cand_samples = [
+            v for r in candidate for v in r.get("samples", {}).get(metric, [])
+        ]
+        if not base_samples or not cand_samples:
+            continue
+        base_median = median(base_samples)
+        cand_median = median(cand_samples)
+        change = (cand_median - base_median) / base_median if base_median else 0.0
+        p_value = mann_whitney_greater(cand_samples, base_samples)
+        comparisons.append(
+            Comparison(
+                metric=f"{metric}.p50",
+                baseline=base_median,
+                candidate=cand_median,
+                change=change,
+                p_value=p_value,
+                regression=p_value < alpha and change > threshold,
+            )
+        )
+
+    for metric in ("throughput_rps", "throughput_lines_per_s"):
+        base_values = [float(r["metrics"].get(metric, 0.0)) for r in baseline]
+        cand_values = [float(r["metrics"].get(metric, 0.0)) for r in candidate]
+        base_median = median(base_values)
+        cand_median = median(cand_values)
+        if not base_median:
+            continue
+        change = (cand_median - base_median) / base_median
+        p_value: float | None = None
+        regressed = change < -threshold
+        if (
+            len(base_values) >= MIN_RUNS_FOR_THROUGHPUT_TEST
+            and len(cand_values) >= MIN_RUNS_FOR_THROUGHPUT_TEST
+        ):
+            # 吞吐越低越差，因此检验“基线偏大”
+            p_value = mann_whitney_greater(base_values, cand_values)
+            regressed = regressed and p_value < alpha
+        comparisons.append(
+            Comparison(
+                metric=metric,
+                baseline=base_median,
+                candidate=cand_median,
+                change=change,
+                p_value=p_value,
+                regression=regressed,
+            )
+        )
+    return comparisons
+
+
+def command_run(args: argparse.Namespace) -> int:
+    """执行内置压测并入库。"""
+
+    samples, wall_s, failures = asyncio.run(run_load(args))
+    config = {
+        "url": args.url,
+        "transport": "unix" if args.unix_socket else "tcp",
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "lines": args.lines,
+        "stream": bool(args.stream),
+        "task": args.task,
+        "model": args.model,
+        **({"server": args.server_config} if args.server_config else {}),
+    }
+    ok_samples = [s for s in samples if s.status == 200]
+    result = build_result(
+        label=args.label,
+        source="run",
+        config=config,
+        latencies={
+            "total_ms": [s.total_ms for s in ok_samples],
+            "ttfb_ms": [s.ttfb_ms for s in ok_samples],
+        },
+        wall_s=wall_s,
+        requests=args.requests,
+        failures=failures,
+        lines_per_request=float(args.lines),
+        max_samples=args.max_samples,
+    )
+    append_result(args.store, result)
+    print(json.dumps({"id": result["id"], **result["metrics"]}, ensure_ascii=False))
+    return 0
+
+
+def command_import_access_log(args: argparse.Namespace) -> int:
+    """把 mock 服务的访问日志汇总成一条结果。"""
+
+    records = load_chat_records(args.access_log)
+    if not records:
+        print("No chat completion records found", file=sys.stderr)
+        return 1
+
+    ok = [r for r in records if r.get("status") == 200]
+    spans = [request_span(r) for r in records]
+    wall_s = max(end for _, end in spans) - min(start for start, _ in spans)
+    total_lines = sum(int(r.get("line_count") or 0) for r in ok)
+    result = build_result(
+        label=args.label,
+        source="access_log",
+        config={"access_log": os.path.abspath(args.access_log)},
+        latencies={
+            "total_ms": [float(r["last_byte_ms"]) for r in ok if r.get("last_byte_ms")],
+            "ttfb_ms": [
+                float(r["first_byte_ms"]) for r in ok if r.get("first_byte_ms")
+            ],
+        },
+        wall_s=wall_s,
+        requests=len(records),
+        failures=len(records) - len(ok),
+        lines_per_request=total_lines / len(ok) if ok else 0.0,
+        max_samples=args.max_samples,
+    )
+    append_result(args.store, result)
+    print(json.dumps({"id": result["id"], **result["metrics"]}, ensure_ascii=False))
+    return 0
+
+
+def command_list(args: argparse.Namespace) -> int:
+    """列出结果库记录。"""
+
+    for result in load_results(args.store):
+        metrics = result.get("metrics", {})
+        total = metrics.get("total_ms", {})
+        print(
+            f"{result.get('id')}  {time.strftime('%Y-%m-%d %H:%M', time.localtime(result.get('created_at', 0)))}"
+            f"  {result.get('label'):<20}  rps={metrics.get('throughput_rps')}"
+            f"  p50={total.get('p50')}ms  p99={total.get('p99')}ms"
+            f"  err={metrics.get('error_rate')}"
+        )
+    return 0
+
+
+def command_compare(args: argparse.Namespace) -> int:
+    """对比基线与候选；有回归时返回 1。"""
+
+    results = load_results(args.store)
+    baseline = select_results(results, args.baseline)
+    candidate = select_results(results, args.candidate)
+    if not baseline or not candidate:
+        print("Baseline or candidate not found in store", file=sys.stderr)
+        return 2
+
+    base_keys = {fingerprint_key(r.get("environment", {})) for r in baseline}
+    cand_keys = {fingerprint_key(r.get("environment", {})) for r in candidate}
+    if base_keys != cand_keys:
+        print("warning: environment fingerprints differ between baseline and candidate")
+
+    comparisons = compare_results(
+        baseline, candidate, alpha=args.alpha, threshold=args.threshold
+    )
+    regressed = False
+    for item in comparisons:
+        p_text = "-" if item.p_value is None else f"{item.p_value:.4g}"
+        flag = "REGRESSION" if item.regression else "ok"
+        print(
+            f"{item.metric:<24} base={item.baseline:.3f} cand={item.candidate:.3f}"
+            f" change={item.change:+.1%} p={p_text}  {flag}"
+        )
+        regressed = regressed or item.regression
+    return 1 if regressed else 0
+
+
+def command_report(args: argparse.Namespace) -> int:
+    """输出 CLI 任务的容量报告。"""
+
+    run = load_cli_run(args.cli_log)
+    records = [] if args.access_log is None else load_chat_records(args.access_log)
+    if run.started_at is None and not run.points:
+        print("No CLI started/progress events found", file=sys.stderr)
+        return 1
+
+    records = records_in_cli_window(run, records)
+    summary = summarize_capacity(run, records, tail_fraction=args.tail_fraction)
+
+    tail_label = f"tail_drain_s (from {args.tail_fraction:.0%})"
+    lines = [
+        ("command", format_metric(summary["command"])),
+        ("status", format_metric(summary["status"])),
+        ("wall_s", format_metric(summary["wall_s"], "s")),
+        (
+            "lines",
+            (
+                f"total={format_metric(summary['total'])}"
+                f" completed={summary['completed']} failed={summary['failed']}"
+            ),
+        ),
+        ("lines_per_s", format_metric(summary["lines_per_s"])),
+        ("steady_lines_per_s", format_metric(summary["steady_lines_per_s"])),
+        (
+            "time_to_first_completion_s",
+            format_metric(summary["time_to_first_completion_s"], "s"),
+        ),
+        (tail_label, format_metric(summary["tail_drain_s"], "s")),
+        (
+            "requests",
+            (
+                f"{format_metric(summary['requests'])}"
+                f" (failed/aborted {format_metric(summary['requests_failed'])})"
+            ),
+        ),
+        ("requests_per_line", format_metric(summary["requests_per_line"], "", 4)),
+        (
+            "lines_served_per_line",
+            format_metric(summary["lines_served_per_line"], "", 4),
+        ),
+        ("mean_in_flight", format_metric(summary["mean_in_flight"], "", 2)),
+        ("peak_in_flight", format_metric(summary["peak_in_flight"])),
+        ("busy_fraction", format_metric(summary["busy_fraction"], "", 4)),
+        (
+            "generate_cpu_fraction",
+            format_metric(summary["generate_cpu_fraction"], "", 4),
+        ),
+    ]
+    for name, value in lines:
+        print(f"{name:<32} {value}")
+
+    if args.csv is not None:
+        rows = build_capacity_timeline(
+            run,
+            records,
+            origin=summary["origin"],
+            end=summary["end"],
+            bucket_s=args.bucket_s,
+        )
+        directory = os.path.dirname(args.csv)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.csv, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    return 0
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """解析子命令参数。"""
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark result store and regression gate for the mock LLM API server"
+    )
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser(
+        "run", help="Load-test a running mock server and store the result"
+    )
+    run.add_argument("--url", default="http://127.0.0.1:8000")
+    run.add_argument(
+        "--unix-socket",
+        default=None,
+        metavar="PATH",
+        help="Connect over a Unix domain socket (mock server --unix-socket)",
+    )
+    run.add_argument("--label", required=True)
+    run.add_argument("--requests", type=int, default=1000)
+    run.add_argument("--concurrency", type=int, default=100)
+    run.add_argument("--lines", type=int, default=20)
+    run.add_argument("--stream", action="store_true")
+    run.add_argument(
+        "--task", default="translation", choices=["translation", "analysis"]
+    )
+    run.add_argument("--model", default="mock-llm")
+    run.add_argument("--timeout", type=float, default=120.0)
+    run.add_argument("--seed", type=int, default=12345)
+    run.add_argument(
+        "--server-config",
+        default=None,
+        help="Free-form note of the server flags used, stored with the result",
+    )
+    run.add_argument("--max-samples", type=int, default=2000)
+    run.set_defaults(handler=command_run)
+
+    imp = sub.add_parser(
+        "import-access-log", help="Summarise a mock server --access-log file"
+    )
+    imp.add_argument("access_log")
+    imp.add_argument("--label", required=True)
+    imp.add_argument("--max-samples", type=int, default=2000)
+    imp.set_defaults(handler=command_import_access_log)
+
+    lst = sub.add_parser("list", help="List stored results")
+    lst.set_defaults(handler=command_list)
+
+    cmp_parser = sub.add_parser(
+        "compare", help="Compare candidate against baseline; exit 1 on regression"
+    )
+    cmp_parser.add_argument("--baseline", required=True, help="id, label or 'latest'")
+    cmp_parser.add_argument(
+        "--candidate", default="latest", help="id, label or 'latest'"
+    )
+    cmp_parser.add_argument("--alpha", type=float, default=0.01)
+    cmp_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.05,
+        help="Minimum relative change that counts as a regression",
+    )
+    cmp_parser.set_defaults(handler=command_compare)
+
+    report = sub.add_parser(
+        "report",
+        help="Capacity report from LinguaGacha --cli progress JSONL and the mock access log",
+    )
+    report.add_argument("--cli-log", required=True, help="CLI stdout JSONL")
+    report.add_argument(
+        "--access-log", default=None, help="Mock server --access-log JSONL"
+    )
+    report.add_argument(
+        "--bucket-s", type=float, default=10.0, help="Timeline bucket width"
+    )
+    report.add_argument(
+        "--tail-fraction",
+        type=float,
+        default=0.95,
+        help="Completed fraction where the tail drain starts",
+    )
+    report.add_argument(
+        "--csv", default=None, metavar="PATH", help="Write the timeline as CSV"
+    )
+    report.set_defaults(handler=command_report)
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    """脚本入口。"""
+
+    args = parse_args()
+    raise SystemExit(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,609 @@
+"""规模测试用的合成工程夹具生成器。
+
+用途
+- 为 src/backend/file/formats 下的 txt/srt/renpy/epub/trans/xlsx 解析器以及翻译引擎
+  生成 10 万～100 万行以上的输入工程（一个目录，内含一个或多个同格式文件）。
+- 相同参数 + 相同 --seed 产出逐字节一致的文件（zip 条目时间戳固定），结果可复现、可对比。
+- 边生成边写盘：单行、单个字幕块、单个 EPUB 章节或单个 TRANS 地图之外不做缓存，
+  重复行只从有界的最近行池中抽取，内存占用与总行数无关，可以生成数 GB 的输入。
+- 仅使用标准库。
+
+可控参数
+- --lines / --lines-per-file：总行数与每个文件的行数（0 表示全部写进一个文件）；XLSX 单表最多 1048576 行，超出时自动拆分。
+- --mean-chars / --length-sigma / --max-chars：行长按对数正态分布抽样（均值 --mean-chars），再截断到 [1, --max-chars]。
+- --speaker-ratio / --speakers：带说话人的行占比与角色数量。
+- --duplicate-ratio：直接复用之前某一行（含说话人）的比例，用来模拟口癖、系统提示等高频重复文本。
+- --cjk-ratio：每个词片段取日文（假名 + 汉字）而不是拉丁单词的概率，0 为纯拉丁、1 为纯日文。
+
+各格式中的说话人
+- txt/xlsx/epub：写成 名字「台词」。
+- srt：写成 名字：台词。
+- renpy：写成 "名字" "台词" 形式的 translate 块（目标行与模板行相同，等同 Ren'Py 刚生成的翻译模板）。
+- trans：按 RPG Maker MZ 的写法单独占一行名字框（parameters/4），紧跟台词行；--lines 只统计台词行。
+
+示例
+   uv run python buildtools/scale_fixture_generator.py --format txt --lines 1000000 --output build/fixtures/txt-1m
+   uv run python buildtools/scale_fixture_generator.py --format renpy --lines 200000 --lines-per-file 5000 --speaker-ratio 0.7 --output build/fixtures/renpy
+   uv run python buildtools/scale_fixture_generator.py --format epub --lines 500000 --cjk-ratio 1 --duplicate-ratio 0.02 --output build/fixtures/epub
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import math
+import os
+import random
+import sys
+import zipfile
+from collections import deque
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from typing import TextIO
+from xml.sax.saxutils import escape
+
+FORMATS: tuple[str, ...] = ("txt", "srt", "renpy", "epub", "trans", "xlsx")
+FILE_EXTENSIONS: dict[str, str] = {
+    "txt": ".txt",
+    "srt": ".srt",
+    "renpy": ".rpy",
+    "epub": ".epub",
+    "trans": ".trans",
+    "xlsx": ".xlsx",
+}
+XLSX_MAX_ROWS: int = 1_048_576
+ZIP64_LIMIT: int = (1 << 32) - 1
+ZIP_DATE_TIME: tuple[int, int, int, int, int, int] = (1980, 1, 1, 0, 0, 0)
+DUPLICATE_POOL_SIZE: int = 4096
+EPUB_LINES_PER_CHAPTER: int = 2000
+TRANS_LINES_PER_MAP: int = 500
+TRANS_LINES_PER_EVENT: int = 20
+SRT_CUE_MS: tuple[int, int] = (1200, 4800)
+SRT_GAP_MS: tuple[int, int] = (100, 900)
+RENPY_LANGUAGE: str = "schinese"
+WRITE_BUFFER_BYTES: int = 1 << 20
+
+HIRAGANA: str = (
+    "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+    "がぎぐげござじずぜぞだでどばびぶべぼぱぴぷぺぽっゃゅょ"
+)
+KATAKANA: str = (
+    "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワン"
+    "ガギグゲゴザジズゼゾダデドバビブベボパピプペポッャュョー"
+)
+KANJI: str = (
+    "日月火水木金土山川田人口目耳手足力気天雨空花草森林石村町市国学校先生年時分半今何"
+    "前後左右上下中外大小長高安新古多少明暗強弱心思言話語読書見聞行来帰出入立休食飲"
+    "買売歩走乗教習開閉始終待持使作送知住春夏秋冬朝昼夜風雪星光音色声道海島東西南北"
+)
+CJK_PUNCTUATION: str = "、。！？…"
+LATIN_WORDS: tuple[str, ...] = (
+    "the",
+    "quick",
+    "brown",
+    "fox",
+    "jumps",
+    "over",
+    "lazy",
+    "dog",
+    "sword",
+    "magic",
+    "castle",
+    "village",
+    "quest",
+    "potion",
+    "dragon",
+    "forest",
+    "gold",
+    "level",
+    "HP",
+    "MP",
+    "attack",
+    "defend",
+    "escape",
+    "item",
+    "save",
+    "load",
+    "menu",
+    "option",
+    "north",
+    "gate",
+)
+LATIN_PUNCTUATION: str = ",.!?"
+
+
+@dataclass(frozen=True)
+class FixtureConfig:
+    """一次生成的全部参数。"""
+
+    format: str
+    lines: int
+    lines_per_file: int
+    seed: int
+    mean_chars: float
+    length_sigma: float
+    max_chars: int
+    speaker_ratio: float
+    speakers: int
+    duplicate_ratio: float
+    cjk_ratio: float
+    prefix: str
+
+
+@dataclass(frozen=True)
+class FixtureLine:
+    """一行合成文本；speaker 为 None 表示旁白。"""
+
+    speaker: str | None
+    text: str
+
+
+class LineSource:
+    """确定性行生成器：行长、说话人、重复和 CJK/Latin 混合都在这里决定。"""
+
+    def __init__(self, config: FixtureConfig) -> None:
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.cast = [self.make_name() for _ in range(config.speakers)]
+        self.recent: deque[FixtureLine] = deque(maxlen=DUPLICATE_POOL_SIZE)
+        # 对数正态的均值 = exp(mu + sigma^2 / 2)，反解 mu 让平均行长贴近 --mean-chars。
+        self.length_mu = math.log(config.mean_chars) - config.length_sigma**2 / 2.0
+        self.generated = 0
+        self.duplicates = 0
+        self.speaker_lines = 0
+        self.chars = 0
+
+    def make_name(self) -> str:
+        """角色名同样按 --cjk-ratio 取日文或拉丁。"""
+
+        if self.rng.random() < self.config.cjk_ratio:
+            return "".join(
+                self.rng.choice(KANJI) for _ in range(self.rng.randint(2, 3))
+            )
+        return self.rng.choice(LATIN_WORDS).capitalize() + self.rng.choice(
+            ("", "a", "o", "ia", "us")
+        )
+
+    def sample_length(self) -> int:
+        """按对数正态抽样行长并截断。"""
+
+        length = round(
+            self.rng.lognormvariate(self.length_mu, self.config.length_sigma)
+        )
+        return max(1, min(self.config.max_chars, length))
+
+    def make_text(self, length: int) -> str:
+        """按片段拼出指定长度的文本；不会产生引号、反斜杠、方括号等需要转义的字符。"""
+
+        parts: list[str] = []
+        size = 0
+        while size < length:
+            if self.rng.random() < self.config.cjk_ratio:
+                kana = HIRAGANA if self.rng.random() < 0.7 else KATAKANA
+                part = "".join(
+                    self.rng.choice(KANJI if self.rng.random() < 0.35 else kana)
+                    for _ in range(self.rng.randint(2, 6))
+                )
+                if self.rng.random() < 0.15:
+                    part += self.rng.choice(CJK_PUNCTUATION)
+            else:
+                part = self.rng.choice(LATIN_WORDS)
+                if self.rng.random() < 0.1:
+                    part += self.rng.choice(LATIN_PUNCTUATION)
+                part += " "
+            parts.append(part)
+            size += len(part)
+        return "".join(parts)[:length].strip() or self.rng.choice(KANJI)
+
+    def next_line(self) -> FixtureLine:
+        """生成下一行；按 --duplicate-ratio 从最近行池中原样复用。"""
+
+        if self.recent and self.rng.random() < self.config.duplicate_ratio:
+            line = self.rng.choice(self.recent)
+            self.duplicates += 1
+        else:
+            speaker = None
+            if self.cast and self.rng.random() < self.config.speaker_ratio:
+                speaker = self.rng.choice(self.cast)
+            line = FixtureLine(
+                speaker=speaker, text=self.make_text(self.sample_length())
+            )
+            self.recent.append(line)
+        self.generated += 1
+        self.speaker_lines += line.speaker is not None
+        self.chars += len(line.text)
+        return line
+
+    def take(self, count: int) -> Iterator[FixtureLine]:
+        """惰性产出 count 行。"""
+
+        for _ in range(count):
+            yield self.next_line()
+
+
+def inline_speaker(line: FixtureLine, template: str = "{speaker}「{text}」") -> str:
+    """把说话人并进正文，用于没有独立名字字段的格式。"""
+
+    if line.speaker is None:
+        return line.text
+    return template.format(speaker=line.speaker, text=line.text)
+
+
+def open_text(path: str) -> TextIO:
+    """统一使用 UTF-8 + LF 与较大的写缓冲。"""
+
+    return open(path, "w", encoding="utf-8", newline="\n", buffering=WRITE_BUFFER_BYTES)
+
+
+def zip_info(name: str, *, compress: bool = True) -> zipfile.ZipInfo:
+    """固定时间戳的 zip 条目，保证同参数输出逐字节一致。"""
+
+    info = zipfile.ZipInfo(name, date_time=ZIP_DATE_TIME)
+    info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    return info
+
+
+def write_zip_text(archive: zipfile.ZipFile, name: str, content: str) -> None:
+    """写入一个小型文本条目。"""
+
+    archive.writestr(zip_info(name), content.encode("utf-8"))
+
+
+def open_zip_text(
+    archive: zipfile.ZipFile, name: str, *, force_zip64: bool = False
+) -> TextIO:
+    """以流的方式写入大型 zip 条目。"""
+
+    raw = archive.open(zip_info(name), "w", force_zip64=force_zip64)
+    return io.TextIOWrapper(
+        io.BufferedWriter(raw, WRITE_BUFFER_BYTES), encoding="utf-8", newline="\n"
+    )
+
+
+def write_txt(
+    path: str, lines: Iterator[FixtureLine], file_index: int, config: FixtureConfig
+) -> None:
+    """一行一条。"""
+
+    with open_text(path) as f:
+        for line in lines:
+            f.write(inline_speaker(line))
+            f.write("\n")
+
+
+def format_srt_time(ms: int) -> str:
+    """毫秒转 SRT 时间码。"""
+
+    hours, rest = divmod(ms, 3_600_000)
+    minutes, rest = divmod(rest, 60_000)
+    seconds, millis = divmod(rest, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{millis:03d}"
+
+
+def write_srt(
+    path: str, lines: Iterator[FixtureLine], file_index: int, config: FixtureConfig
+) -> None:
+    """序号 + 时间轴 + 正文，块间空行。"""
+
+    rng = random.Random(file_index)
+    at_ms = 0
+    with open_text(path) as f:
+        for number, line in enumerate(lines, start=1):
+            start_ms = at_ms + rng.randint(*SRT_GAP_MS)
+            at_ms = start_ms + rng.randint(*SRT_CUE_MS)
+            f.write(
+                f"{number}\n{format_srt_time(start_ms)} --> {format_srt_time(at_ms)}\n"
+                f"{inline_speaker(line, '{speaker}：{text}')}\n\n"
+            )
+
+
+def write_renpy(
+    path: str, lines: Iterator[FixtureLine], file_index: int, config: FixtureConfig
+) -> None:
+    """Ren'Py 翻译模板：每行一个 translate 块，目标行先照抄模板行。"""
+
+    script = f"game/script_{file_index:05d}.rpy"
+    with open_text(path) as f:
+        for number, line in enumerate(lines):
+            statement = f'"{line.text}"'
+            if line.speaker is not None:
+                statement = f'"{line.speaker}" {statement}'
+            f.write(
+                f"# {script}:{number * 2 + 1}\n"
+                f"translate {RENPY_LANGUAGE} scene_{file_index:05d}_{number:08x}:\n\n"
+                f"    # {statement}\n"
+                f"    {statement}\n\n"
+            )
+
+
+def write_epub(
+    path: str, lines: Iterator[FixtureLine], file_index: int, config: FixtureConfig
+) -> None:
+    """每 EPUB_LINES_PER_CHAPTER 行一个 XHTML 章节，OPF 在全部章节写完后补上。"""
+
+    chapters: list[str] = []
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr(zip_info("mimetype", compress=False), b"application/epub+zip")
+        f: TextIO | None = None
+        try:
+            for number, line in enumerate(lines):
+                if number % EPUB_LINES_PER_CHAPTER == 0:
+                    if f is not None:
+                        f.write("</body>\n</html>\n")
+                        f.close()
+                    chapters.append(f"chapter_{len(chapters):05d}.xhtml")
+                    f = open_zip_text(archive, f"OEBPS/{chapters[-1]}")
+                    f.write(
+                        '<?xml version="1.0" encoding="utf-8"?>\n'
+                        '<html xmlns="http://www.w3.org/1999/xhtml">\n'
+                        f"<head><title>{len(chapters)}</title></head>\n<body>\n"
+                        f"<h1>{len(chapters)}</h1>\n"
+                    )
+                f.write(f"<p>{escape(inline_speaker(line))}</p>\n")
+            if f is not None:
+                f.write("</body>\n</html>\n")
+        finally:
+            if f is not None:
+                f.close()
+
+        manifest = "".join(
+            f'<item id="c{index}" href="{name}" media-type="application/xhtml+xml"/>'
+            for index, name in enumerate(chapters)
+        )
+        spine = "".join(
+            f'<itemref idref="c{index}"/>' for index in range(len(chapters))
+        )
+        write_zip_text(
+            archive,
+            "META-INF/container.xml",
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+            '<rootfiles><rootfile full-path="OEBPS/content.opf" '
+            'media-type="application/oebps-package+xml"/></rootfiles></container>\n',
+        )
+        write_zip_text(
+            archive,
+            "OEBPS/content.opf",
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<package version="3.0" xmlns="http://www.idpf.org/2007/opf" unique-identifier="id">'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            f'<dc:identifier id="id">scale-fixture-{file_index:05d}</dc:identifier>'
+            f"<dc:title>Scale Fixture {file_index:05d}</dc:title><dc:language>ja</dc:language>"
+            f"</metadata><manifest>{manifest}</manifest><spine>{spine}</spine></package>\n",
+        )
+
+
+def write_trans_map(
+    f: TextIO, file_key: str, rows: list[tuple[str, str]], first: bool
+) -> None:
+    """写出 project.files 中的一个地图条目；rows 为 (原文, context 地址)。"""
+
+    f.write("" if first else ",")
+    f.write(json.dumps(file_key, ensure_ascii=False))
+    f.write(':{"data":[')
+    f.write(",".join(json.dumps([src, ""], ensure_ascii=False) for src, _ in rows))
+    f.write('],"tags":[')
+    f.write(",".join("[]" for _ in rows))
+    f.write('],"context":[')
+    f.write(",".join(json.dumps([address]) for _, address in rows))
+    f.write('],"parameters":[')
+    f.write(",".join("[]" for _ in rows))
+    f.write("]}")
+
+
+def write_trans(
+    path: str, lines: Iterator[FixtureLine], file_index: int, config: FixtureConfig
+) -> None:
+    """RPG Maker MZ 风格的 .trans，每 TRANS_LINES_PER_MAP 条台词一个地图文件。"""
+
+    with open_text(path) as f:
+        f.write('{"project":{"gameEngine":"rmmz","gameTitle":')
+        f.write(json.dumps(f"Scale Fixture {file_index:05d}"))
+        f.write(',"indexOriginal":0,"indexTranslation":1,"files":{')
+        rows: list[tuple[str, str]] = []
+        map_count = 0
+        for number, line in enumerate(lines):
+            if number % TRANS_LINES_PER_MAP == 0 and rows:
+                write_trans_map(
+                    f, f"data/Map{map_count + 1:03d}.json", rows, map_count == 0
+                )
+                map_count += 1
+                rows = []
+            event = (number % TRANS_LINES_PER_MAP) // TRANS_LINES_PER_EVENT + 1
+            commands = f"Map{map_count + 1:03d}/events/{event}/pages/0/list"
+            # 101 显示文字（名字框在 parameters/4）后接 401 文本行。
+            command = (number % TRANS_LINES_PER_EVENT) * 2 + 1
+            if line.speaker is not None:
+                rows.append((line.speaker, f"{commands}/{command}/parameters/4"))
+            rows.append((line.text, f"{commands}/{command + 1}/parameters/0"))
+        if rows:
+            write_trans_map(
+                f, f"data/Map{map_count + 1:03d}.json", rows, map_count == 0
+            )
+        f.write("}}}\n")
+
+
+XLSX_CONTENT_TYPES: str = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    "</Types>\n"
+)
+XLSX_ROOT_RELS: str = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>\n'
+)
+XLSX_WORKBOOK: str = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Sheet" sheetId="1" r:id="rId1"/></sheets></workbook>\n'
+)
+XLSX_WORKBOOK_RELS: str = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/></Relationships>\n'
+)
+
+
+def write_xlsx(
+    path: str, lines: Iterator[FixtureLine], file_index: int, config: FixtureConfig
+) -> None:
+    """双列表格：A 列原文、B 列留空；单元格用 inlineStr，避免为共享字符串表缓存全部文本。"""
+
+    with zipfile.ZipFile(path, "w") as archive:
+        write_zip_text(archive, "[Content_Types].xml", XLSX_CONTENT_TYPES)
+        write_zip_text(archive, "_rels/.rels", XLSX_ROOT_RELS)
+        write_zip_text(archive, "xl/workbook.xml", XLSX_WORKBOOK)
+        write_zip_text(archive, "xl/_rels/workbook.xml.rels", XLSX_WORKBOOK_RELS)
+        # 只有最坏情况下可能越过 4 GiB 时才强制 zip64，保持常规尺寸文件的兼容性。
+        worst_case = XLSX_MAX_ROWS * (config.max_chars * 4 + 128)
+        with open_zip_text(
+            archive, "xl/worksheets/sheet1.xml", force_zip64=worst_case > ZIP64_LIMIT
+        ) as f:
+            f.write(
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<cols><col min="1" max="2" width="64" customWidth="1"/></cols><sheetData>'
+            )
+            for row, line in enumerate(lines, start=1):
+                f.write(
+                    f'<row r="{row}"><c r="A{row}" t="inlineStr"><is>'
+                    f'<t xml:space="preserve">{escape(inline_speaker(line))}</t>'
+                    "</is></c></row>"
+                )
+            f.write("</sheetData></worksheet>\n")
+
+
+WRITERS: dict[str, Callable[[str, Iterator[FixtureLine], int, FixtureConfig], None]] = {
+    "txt": write_txt,
+    "srt": write_srt,
+    "renpy": write_renpy,
+    "epub": write_epub,
+    "trans": write_trans,
+    "xlsx": write_xlsx,
+}
+
+
+def file_line_counts(config: FixtureConfig) -> Iterator[int]:
+    """按 --lines-per-file 切分总行数；XLSX 额外受单表行数上限约束。"""
+
+    per_file = config.lines_per_file or config.lines
+    if config.format == "xlsx":
+        per_file = min(per_file, XLSX_MAX_ROWS)
+    remaining = config.lines
+    while remaining > 0:
+        count = min(per_file, remaining)
+        remaining -= count
+        yield count
+
+
+def generate(config: FixtureConfig, output_dir: str) -> dict[str, object]:
+    """生成整个夹具工程并返回汇总。"""
+
+    os.makedirs(output_dir, exist_ok=True)
+    source = LineSource(config)
+    writer = WRITERS[config.format]
+    extension = FILE_EXTENSIONS[config.format]
+    paths: list[str] = []
+    for file_index, count in enumerate(file_line_counts(config)):
+        path = os.path.join(output_dir, f"{config.prefix}_{file_index:05d}{extension}")
+        writer(path, source.take(count), file_index, config)
+        paths.append(path)
+    return {
+        "format": config.format,
+        "output": os.path.abspath(output_dir),
+        "files": len(paths),
+        "lines": source.generated,
+        "bytes": sum(os.path.getsize(path) for path in paths),
+        "mean_chars": round(source.chars / source.generated, 2)
+        if source.generated
+        else 0.0,
+        "speaker_lines": source.speaker_lines,
+        "duplicate_lines": source.duplicates,
+        "seed": config.seed,
+    }
+
+
+def ratio(value: str) -> float:
+    """0～1 的比例参数。"""
+
+    try:
+        parsed = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid ratio: {value}") from None
+    if not 0.0 <= parsed <= 1.0:
+        raise argparse.ArgumentTypeError(f"Ratio must be within [0, 1]: {value}")
+    return parsed
+
+
+def parse_args(argv: list[str] | None = None) -> tuple[FixtureConfig, str]:
+    """解析命令行参数。"""
+
+    parser = argparse.ArgumentParser(
+        description="Generate deterministic large-project fixtures for scale tests"
+    )
+    parser.add_argument("--format", required=True, choices=FORMATS)
+    parser.add_argument("--output", required=True, help="Output directory")
+    parser.add_argument("--lines", type=int, default=100_000)
+    parser.add_argument(
+        "--lines-per-file",
+        type=int,
+        default=0,
+        help="Split into files of this many lines (0 = single file)",
+    )
+    parser.add_argument("--seed", type=int, default=12345)
+    parser.add_argument("--mean-chars", type=float, default=24.0)
+    parser.add_argument("--length-sigma", type=float, default=0.6)
+    parser.add_argument("--max-chars", type=int, default=400)
+    parser.add_argument("--speaker-ratio", type=ratio, default=0.4)
+    parser.add_argument("--speakers", type=int, default=12)
+    parser.add_argument("--duplicate-ratio", type=ratio, default=0.05)
+    parser.add_argument("--cjk-ratio", type=ratio, default=0.9)
+    parser.add_argument("--prefix", default="fixture", help="Output file name prefix")
+    args = parser.parse_args(argv)
+    if args.lines <= 0:
+        parser.error("--lines must be positive")
+    if args.lines_per_file < 0:
+        parser.error("--lines-per-file must not be negative")
+    if args.mean_chars < 1 or args.max_chars < 1 or args.length_sigma < 0:
+        parser.error("--mean-chars/--max-chars must be >= 1 and --length-sigma >= 0")
+    if args.speakers < 0:
+        parser.error("--speakers must not be negative")
+    return FixtureConfig(
+        format=args.format,
+        lines=args.lines,
+        lines_per_file=args.lines_per_file,
+        seed=args.seed,
+        mean_chars=args.mean_chars,
+        length_sigma=args.length_sigma,
+        max_chars=args.max_chars,
+        speaker_ratio=args.speaker_ratio,
+        speakers=args.speakers,
+        duplicate_ratio=args.duplicate_ratio,
+        cjk_ratio=args.cjk_ratio,
+        prefix=args.prefix,
+    ), args.output
+
+
+def main() -> None:
+    """脚本入口。"""
+
+    config, output_dir = parse_args()
+    summary = generate(config, output_dir)
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
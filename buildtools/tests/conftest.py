@@ -0,0 +1,11 @@
+"""buildtools 脚本测试的公共配置：把 buildtools 加进导入路径，并提供 mock 服务 fixture。"""
+
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import mock_llm_api_server
+
+# 默认无抖动；需要其他配置时用 indirect 参数化传 dict 覆盖字段
+mock_llm_server = mock_llm_api_server.make_pytest_fixture()
@@ -0,0 +1,70 @@
+"""测试共用的请求构造与原始 HTTP 收发工具。"""
+
+import json
+import socket
+
+
+def build_jsonline_prompt(count: int) -> str:
+    """生成带 count 行 JSONLINE 输入块的翻译提示词。"""
+
+    rows = "".join(
+        json.dumps({str(i): f"原文{i}"}, ensure_ascii=False) + "\n"
+        for i in range(count)
+    )
+    return "Input:\n```jsonline\n" + rows + "```\n"
+
+
+def build_chat_body(count: int = 3, **fields: object) -> bytes:
+    """生成最小的 chat 请求体，fields 覆盖或追加顶层字段。"""
+
+    body = {
+        "model": "mock-llm",
+        "messages": [{"role": "user", "content": build_jsonline_prompt(count)}],
+        **fields,
+    }
+    return json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+
+def send_raw(port: int, data: bytes, *, half_close: bool = False) -> bytes:
+    """直接写原始 HTTP 字节并读到连接关闭，用于覆盖 HTTP 客户端不会发的请求形状。"""
+
+    with socket.create_connection(("127.0.0.1", port), timeout=10) as sock:
+        sock.sendall(data)
+        if half_close:
+            sock.shutdown(socket.SHUT_WR)
+        parts: list[bytes] = []
+        while chunk := sock.recv(65536):
+            parts.append(chunk)
+    return b"".join(parts)
+
+
+def split_response(raw: bytes) -> tuple[int, dict[str, str], bytes]:
+    """拆出状态码、header 与原始 body（chunked 时未解码）。"""
+
+    head, _, body = raw.partition(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return int(lines[0].split()[1]), headers, body
+
+
+def split_chunked(body: bytes) -> list[bytes]:
+    """把 chunked 响应体拆成各个数据块，忽略 trailer。"""
+
+    pieces: list[bytes] = []
+    while body:
+        size_line, _, body = body.partition(b"\r\n")
+        size = int(size_line.split(b";")[0], 16)
+        if size == 0:
+            break
+        pieces.append(body[:size])
+        body = body[size + 2 :]
+    return pieces
+
+
+def decode_chunked(body: bytes) -> bytes:
+    """解开 chunked 响应体。"""
+
+    return b"".join(split_chunked(body))
@@ -0,0 +1,224 @@
+"""Files 与 Batch API 的完整生命周期：上传、处理、取消、失败与结果下载。"""
+
+import json
+import time
+import urllib.error
+import urllib.request
+import uuid
+from typing import Any
+
+import mock_llm_api_server as server
+import pytest
+from support import build_jsonline_prompt
+
+FAST_BATCH = {"batch_min_duration_s": 0.0}
+TERMINAL_STATUSES = ("completed", "failed", "cancelled", "expired")
+
+
+def batch_line(custom_id: str, rows: int = 2) -> str:
+    """一行 batch 输入 JSONL。"""
+
+    return json.dumps(
+        {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": "mock-llm",
+                "messages": [{"role": "user", "content": build_jsonline_prompt(rows)}],
+            },
+        },
+        ensure_ascii=False,
+    )
+
+
+def request_json(
+    url: str,
+    *,
+    method: str = "GET",
+    body: Any = None,
+    headers: dict[str, str] | None = None,
+) -> Any:
+    """发送请求并解析 JSON 响应；body 为 bytes 时原样发送，否则按 JSON 编码。"""
+
+    data = (
+        body if isinstance(body, bytes) or body is None else json.dumps(body).encode()
+    )
+    request = urllib.request.Request(
+        url,
+        data=data,
+        method=method,
+        headers=headers or ({"Content-Type": "application/json"} if data else {}),
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def upload_batch_file(base_url: str, lines: list[str]) -> dict[str, Any]:
+    """以 multipart 上传 purpose=batch 的 JSONL 文件。"""
+
+    boundary = uuid.uuid4().hex
+    content = "\n".join(lines) + "\n"
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="purpose"\r\n\r\n'
+        "batch\r\n"
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="input.jsonl"\r\n'
+        "Content-Type: application/jsonl\r\n\r\n"
+        f"{content}\r\n"
+        f"--{boundary}--\r\n"
+    ).encode()
+    return request_json(
+        f"{base_url}/files",
+        method="POST",
+        body=body,
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+    )
+
+
+def create_batch(base_url: str, lines: list[str]) -> dict[str, Any]:
+    """上传输入文件并创建 batch。"""
+
+    file_id = upload_batch_file(base_url, lines)["id"]
+    return request_json(
+        f"{base_url}/batches",
+        method="POST",
+        body={
+            "input_file_id": file_id,
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h",
+        },
+    )
+
+
+def wait_for_terminal(
+    base_url: str, batch_id: str, timeout_s: float = 10.0
+) -> dict[str, Any]:
+    """轮询 batch 直到进入终态。"""
+
+    deadline = time.monotonic() + timeout_s
+    while True:
+        job = request_json(f"{base_url}/batches/{batch_id}")
+        if job["status"] in TERMINAL_STATUSES or time.monotonic() > deadline:
+            return job
+        time.sleep(0.05)
+
+
+def download_jsonl(base_url: str, file_id: str) -> list[dict[str, Any]]:
+    """下载输出文件并逐行解析。"""
+
+    url = f"{base_url}/files/{file_id}/content"
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return [json.loads(line) for line in response.read().splitlines() if line]
+
+
+@pytest.mark.parametrize("mock_llm_server", [FAST_BATCH], indirect=True)
+def test_batch_completes_with_output_file(
+    mock_llm_server: server.MockServerThread,
+) -> None:
+    """正常 batch 依次推进到 completed，输出文件按 custom_id 给出非流式响应。"""
+
+    base_url = mock_llm_server.base_url
+    job = create_batch(base_url, [batch_line(f"req-{i}", rows=i + 1) for i in range(5)])
+    assert job["status"] == "validating"
+
+    job = wait_for_terminal(base_url, job["id"])
+    assert job["status"] == "completed"
+    assert job["request_counts"] == {"total": 5, "completed": 5, "failed": 0}
+    assert job["in_progress_at"] is not None
+    assert job["finalizing_at"] is not None
+    assert job["error_file_id"] is None
+
+    outputs = {
+        row["custom_id"]: row for row in download_jsonl(base_url, job["output_file_id"])
+    }
+    assert sorted(outputs) == [f"req-{i}" for i in range(5)]
+    response = outputs["req-3"]["response"]
+    assert response["status_code"] == 200
+    content = response["body"]["choices"][0]["message"]["content"]
+    assert server.count_jsonline_lines([content]) == 4
+
+    listed = request_json(f"{base_url}/batches")
+    assert [item["id"] for item in listed["data"]] == [job["id"]]
+    assert mock_llm_server.stats()["batches"]["batches"] == {"completed": 1}
+
+
+@pytest.mark.parametrize("mock_llm_server", [FAST_BATCH], indirect=True)
+def test_invalid_input_fails_whole_batch(
+    mock_llm_server: server.MockServerThread,
+) -> None:
+    """任一行不合法时整批 failed，errors 带 1 起始的行号，不产生输出文件。"""
+
+    base_url = mock_llm_server.base_url
+    job = create_batch(base_url, [batch_line("ok"), "{not json", batch_line("ok")])
+
+    job = wait_for_terminal(base_url, job["id"])
+    assert job["status"] == "failed"
+    assert job["failed_at"] is not None
+    assert job["output_file_id"] is None
+    assert sorted(error["line"] for error in job["errors"]["data"]) == [2, 3]
+
+
+@pytest.mark.parametrize(
+    "mock_llm_server",
+    [{**FAST_BATCH, "batch_capacity_rps": 5.0}],
+    indirect=True,
+)
+def test_cancel_keeps_completed_part(mock_llm_server: server.MockServerThread) -> None:
+    """处理中取消后以 cancelled 结束，已完成的请求留在输出文件里；终态不能再取消。"""
+
+    base_url = mock_llm_server.base_url
+    job = create_batch(base_url, [batch_line(f"req-{i}") for i in range(50)])
+    time.sleep(0.5)
+
+    cancelling = request_json(f"{base_url}/batches/{job['id']}/cancel", method="POST")
+    assert cancelling["status"] == "cancelling"
+
+    job = wait_for_terminal(base_url, job["id"])
+    assert job["status"] == "cancelled"
+    completed = job["request_counts"]["completed"]
+    assert 0 < completed < 50
+    assert len(download_jsonl(base_url, job["output_file_id"])) == completed
+
+    with pytest.raises(urllib.error.HTTPError) as error:
+        request_json(f"{base_url}/batches/{job['id']}/cancel", method="POST")
+    assert error.value.code == 409
+
+
+@pytest.mark.parametrize("mock_llm_server", [FAST_BATCH], indirect=True)
+def test_worker_error_fails_batch(
+    mock_llm_server: server.MockServerThread, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """逐行生成抛出意外异常时 batch 以 failed 结束，不会停在 in_progress。"""
+
+    def explode(*args: object, **kwargs: object) -> None:
+        raise RuntimeError("worker exploded")
+
+    monkeypatch.setattr(server, "run_batch_lines", explode)
+    base_url = mock_llm_server.base_url
+    job = create_batch(base_url, [batch_line("req")])
+
+    job = wait_for_terminal(base_url, job["id"])
+    assert job["status"] == "failed"
+    assert job["failed_at"] is not None
+    assert job["errors"]["data"][0]["code"] == "server_error"
+
+
+def test_file_lifecycle(mock_llm_server: server.MockServerThread) -> None:
+    """上传的文件可以列出、读取元数据和删除，删除后返回 404。"""
+
+    base_url = mock_llm_server.base_url
+    stored = upload_batch_file(base_url, [batch_line("req")])
+
+    assert stored["purpose"] == "batch"
+    assert [item["id"] for item in request_json(f"{base_url}/files")["data"]] == [
+        stored["id"]
+    ]
+    assert request_json(f"{base_url}/files/{stored['id']}")["bytes"] == stored["bytes"]
+
+    deleted = request_json(f"{base_url}/files/{stored['id']}", method="DELETE")
+    assert deleted["deleted"] is True
+    with pytest.raises(urllib.error.HTTPError) as error:
+        request_json(f"{base_url}/files/{stored['id']}")
+    assert error.value.code == 404
@@ -0,0 +1,309 @@
+"""ChatBodyScanner 与缓冲解析的等价性，以及 chunked 请求体的端到端读取。"""
+
+import json
+import time
+
+import mock_llm_api_server as server
+import pytest
+from support import (
+    build_chat_body,
+    build_jsonline_prompt,
+    decode_chunked,
+    send_raw,
+    split_response,
+)
+
+FEED_SIZES = (1, 3, 64, None)
+
+EXAMPLE_BLOCK = '输出格式示例：\n```jsonline\n{"<序号>":"<译文>"}\n```\n'
+
+PROMPT_SHAPES: dict[str, tuple[str, list[dict[str, object]]]] = {
+    "translation_string": (
+        server.TASK_TRANSLATION,
+        [
+            {"role": "system", "content": "你是翻译助手。\n" + EXAMPLE_BLOCK},
+            {"role": "user", "content": build_jsonline_prompt(5)},
+        ],
+    ),
+    "translation_parts": (
+        server.TASK_TRANSLATION,
+        [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "Input:\n```json"},
+                    {"type": "image_url", "image_url": {"url": "data:,"}},
+                    {"text": 'line\n{"0":"a\\"b"}\n', "type": "text"},
+                    {"type": "text", "text": '{"1":"\\u3042\\ud83d\\ude00"}\n```'},
+                ],
+            },
+        ],
+    ),
+    "translation_parts_typed_late": (
+        server.TASK_TRANSLATION,
+        [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "Input:\n```jsonl"},
+                    {"text": "\n```\n"},
+                    {"text": 'ine\n{"0":"x"}\n', "type": "text"},
+                    {"type": "image_url", "text": "\n```\n", "image_url": {}},
+                    {"text": "\n```\n", "type": "input_audio"},
+                    {"type": "text", "text": '{"1":"y"}\n```'},
+                ],
+            },
+        ],
+    ),
+    "translation_crlf_and_history": (
+        server.TASK_TRANSLATION,
+        [
+            {
+                "role": "user",
+                "content": "Input:\r\n```jsonline\r\n" + '{"0":"旧"}\r\n```\r\n',
+            },
+            {"role": "assistant", "content": '```jsonline\n{"0":"old"}\n```'},
+            {"role": "user", "content": build_jsonline_prompt(2).replace("\n", "\r\n")},
+        ],
+    ),
+    "translation_last_message_fallback": (
+        server.TASK_TRANSLATION,
+        [{"role": "tool", "content": build_jsonline_prompt(3)}],
+    ),
+    "analysis": (
+        server.TASK_ANALYSIS,
+        [
+            {"role": "system", "content": "从内容文本中提取术语"},
+            {
+                "role": "user",
+                "content": "示例\n输入：\n圣女艾琳在教堂祈祷。\n霜之哀伤正在发光。",
+            },
+        ],
+    ),
+    "sakura": (
+        server.TASK_SAKURA,
+        [
+            {"role": "system", "content": "你是一个轻小说翻译模型"},
+            {
+                "role": "user",
+                "content": "将下面的日文文本翻译成中文：\n「おはよう」\n今日は晴れ。",
+            },
+        ],
+    ),
+}
+
+
+def scan_in_pieces(
+    body: bytes, feed_size: int | None, **kwargs: object
+) -> server.ChatRequestPayload:
+    """按固定大小切块喂给扫描器；None 表示整体一次喂入。"""
+
+    scanner = server.ChatBodyScanner(**kwargs)
+    step = feed_size or len(body)
+    for start in range(0, len(body), step):
+        scanner.feed(body[start : start + step])
+    return scanner.finish()
+
+
+def reply_content(request: server.HttpRequest, task: str) -> str:
+    """固定种子、无抖动地生成非流式响应，返回正文。"""
+
+    config = server.MockServerConfig(
+        min_jitter_s=0.0, max_jitter_s=0.0, seed=7, task=task
+    )
+    reply = server.build_chat_reply(request, config=config)
+    return json.loads(reply.messages[0])["choices"][0]["message"]["content"]
+
+
+def make_request(
+    body: bytes, payload: server.ChatRequestPayload | None = None
+) -> server.HttpRequest:
+    """构造 chat 请求；带 payload 时模拟流式扫描路径（不保留 body）。"""
+
+    return server.HttpRequest(
+        method="POST",
+        target="/v1/chat/completions",
+        version="HTTP/1.1",
+        headers={},
+        body=b"" if payload is not None else body,
+        payload=payload,
+    )
+
+
+@pytest.mark.parametrize("feed_size", FEED_SIZES)
+@pytest.mark.parametrize("shape", sorted(PROMPT_SHAPES))
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_scanner_matches_buffered_parse(
+    shape: str, feed_size: int | None, ensure_ascii: bool
+) -> None:
+    """任意切块位置（含转义与多字节 UTF-8 中间）下，扫描结果与缓冲解析生成同样的响应。"""
+
+    task, messages = PROMPT_SHAPES[shape]
+    body = json.dumps(
+        {"model": "m", "temperature": 0.3, "messages": messages},
+        ensure_ascii=ensure_ascii,
+    ).encode("utf-8")
+
+    buffered = server.load_chat_request_payload(body, track_prefixes=True)
+    scanned = scan_in_pieces(body, feed_size, task=task, track_prefixes=True)
+
+    assert scanned.body_digest == buffered.body_digest
+    assert scanned.prefix_chain == buffered.prefix_chain
+    assert scanned.data["temperature"] == 0.3
+    assert len(scanned.data["messages"]) == len(messages)
+    assert reply_content(make_request(body, scanned), task) == reply_content(
+        make_request(body), task
+    )
+
+
+@pytest.mark.parametrize("feed_size", FEED_SIZES)
+def test_only_text_typed_parts_are_prompt(feed_size: int | None) -> None:
+    """没有 type 或 type 不是 text 的片段不算正文，type 出现在 text 之后也照样识别。"""
+
+    task, messages = PROMPT_SHAPES["translation_parts_typed_late"]
+    body = json.dumps({"model": "m", "messages": messages}).encode("utf-8")
+
+    scanned = scan_in_pieces(body, feed_size, task=task)
+    content = reply_content(make_request(body, scanned), task)
+
+    assert server.count_jsonline_lines([content]) == 2
+    buffered = server.load_chat_request_payload(body)
+    assert server.extract_jsonline_block(scanned.request_text) == (
+        server.extract_jsonline_block(buffered.request_text)
+    )
+
+
+def scan_prompt_text(text: str, feed_size: int) -> str:
+    """按固定大小把正文喂给翻译任务的 PromptTextScanner，返回提取结果。"""
+
+    scanner = server.PromptTextScanner(task=server.TASK_TRANSLATION)
+    for start in range(0, len(text), feed_size):
+        scanner.feed(text[start : start + feed_size])
+    return scanner.finish()
+
+
+@pytest.mark.parametrize("feed_size", [1, 2, 5])
+def test_prompt_scanner_line_breaks_across_pieces(feed_size: int) -> None:
+    """\r\n 被切在两段之间、单独的 \r 与 Unicode 换行符都和整体 splitlines 一致。"""
+
+    text = '说明\r\n```jsonline\r\n{"0":"a"}\r\r\n{"1":"b"}\u2028{"2":"c"}\n```\r'
+
+    scanned = scan_prompt_text(text, feed_size)
+
+    assert server.extract_jsonline_block(scanned) == server.extract_jsonline_block(text)
+
+
+def test_prompt_scanner_long_line_is_linear() -> None:
+    """没有换行的超长行按 4 KiB 切块喂入，耗时随长度线性增长且结果不变。"""
+
+    value = "あ" * (4 * 1024 * 1024)
+    text = "```jsonline\n" + json.dumps({"0": value}, ensure_ascii=False) + "\n```\n"
+
+    started = time.perf_counter()
+    scanned = scan_prompt_text(text, 4096)
+    elapsed = time.perf_counter() - started
+
+    assert server.extract_jsonline_block(scanned) == server.extract_jsonline_block(text)
+    assert elapsed < 2.0
+
+
+@pytest.mark.parametrize("shape", sorted(PROMPT_SHAPES))
+def test_auto_task_classification_matches(shape: str) -> None:
+    """auto 模式下两条路径按 system prompt 或用户正文得出同一任务。"""
+
+    task, messages = PROMPT_SHAPES[shape]
+    body = json.dumps({"model": "m", "messages": messages}, ensure_ascii=False).encode(
+        "utf-8"
+    )
+
+    buffered = server.load_chat_request_payload(body, server.TaskClassifier())
+    scanned = scan_in_pieces(
+        body, 5, task=server.TASK_AUTO, classifier=server.TaskClassifier()
+    )
+
+    assert buffered.task == task
+    assert scanned.task == task
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b'{"messages": [{"role": "user", "content": "x"}]',
+        b'{"messages": [{"role": "user", "content": "x"]}',
+        b'{"messages": [1, 2,]}',
+        b'["not", "an", "object"]',
+        b'{"model": tru}',
+        b'{"messages": "\xff"}',
+    ],
+)
+def test_invalid_json_rejected_by_both_paths(body: bytes) -> None:
+    """语法错误在两条路径上都转成 400。"""
+
+    with pytest.raises(server.HttpError) as buffered:
+        server.load_chat_request_payload(body)
+    with pytest.raises(server.HttpError) as scanned:
+        scan_in_pieces(body, 2, task=server.TASK_TRANSLATION)
+
+    assert buffered.value.status == 400
+    assert scanned.value.status == 400
+
+
+def encode_chunked(body: bytes, sizes: tuple[int, ...]) -> bytes:
+    """按循环使用的块大小编码 chunked 请求体，带一个扩展参数和空 trailer。"""
+
+    out = bytearray()
+    start = 0
+    index = 0
+    while start < len(body):
+        size = sizes[index % len(sizes)]
+        piece = body[start : start + size]
+        out += f"{len(piece):x};ext=1\r\n".encode() + piece + b"\r\n"
+        start += size
+        index += 1
+    return bytes(out + b"0\r\n\r\n")
+
+
+@pytest.mark.parametrize(
+    "mock_llm_server",
+    [{"stream_ingest_threshold": 0}, {"stream_ingest_threshold": -1}],
+    indirect=True,
+)
+def test_chunked_request_body(mock_llm_server: server.MockServerThread) -> None:
+    """chunked 请求体无论走流式扫描还是整体解析，都按输入行数返回译文。"""
+
+    body = build_chat_body(12)
+    head = b"POST /v1/chat/completions HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n"
+    raw = send_raw(mock_llm_server.port, head + encode_chunked(body, (1, 7, 300)))
+
+    status, _, response_body = split_response(raw)
+    content = json.loads(response_body)["choices"][0]["message"]["content"]
+    assert status == 200
+    assert server.count_jsonline_lines([content]) == 12
+
+
+def test_malformed_chunk_size_rejected(
+    mock_llm_server: server.MockServerThread,
+) -> None:
+    """块大小不是十六进制时返回 400。"""
+
+    head = b"POST /v1/chat/completions HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n"
+    raw = send_raw(mock_llm_server.port, head + b"zz\r\n{}\r\n0\r\n\r\n")
+
+    assert split_response(raw)[0] == 400
+
+
+def test_streaming_response_is_chunked(
+    mock_llm_server: server.MockServerThread,
+) -> None:
+    """流式请求以 chunked SSE 返回，最后一条是 [DONE]。"""
+
+    body = build_chat_body(4, stream=True)
+    head = f"POST /v1/chat/completions HTTP/1.1\r\nHost: x\r\nContent-Length: {len(body)}\r\n\r\n"
+    status, headers, raw_body = split_response(
+        send_raw(mock_llm_server.port, head.encode() + body)
+    )
+
+    events = decode_chunked(raw_body).decode("utf-8").split("\n\n")
+    assert status == 200
+    assert headers["transfer-encoding"] == "chunked"
+    assert [event for event in events if event][-1] == "data: [DONE]"
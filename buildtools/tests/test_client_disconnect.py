@@ -0,0 +1,140 @@
+"""客户端断开的判定与统计：关闭与重置都算离开，半关闭需显式开启，后续字节不影响响应。"""
+
+import json
+import pathlib
+import socket
+import struct
+import time
+
+import mock_llm_api_server as server
+import pytest
+from support import build_chat_body, send_raw, split_response
+
+SLOW_JITTER = {"min_jitter_s": 2.0, "max_jitter_s": 2.0}
+
+
+def chat_request(body: bytes) -> bytes:
+    """带 Content-Length 的 chat 请求原始字节。"""
+
+    head = f"POST /v1/chat/completions HTTP/1.1\r\nHost: x\r\nContent-Length: {len(body)}\r\n\r\n"
+    return head.encode() + body
+
+
+def reset_connection(sock: socket.socket) -> None:
+    """SO_LINGER=0 后关闭，让内核发 RST 而不是 FIN。"""
+
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+    sock.close()
+
+
+def wait_for_abandoned(
+    mock: server.MockServerThread, key: str, timeout_s: float = 1.5
+) -> int:
+    """轮询 /health 快照，直到 abandoned[key] 非零或超时。"""
+
+    deadline = time.monotonic() + timeout_s
+    while True:
+        count = mock.stats()["abandoned"][key]
+        if count or time.monotonic() > deadline:
+            return count
+        time.sleep(0.02)
+
+
+@pytest.mark.parametrize("mock_llm_server", [{"allow_half_close": True}], indirect=True)
+def test_half_closed_client_answered_when_allowed(
+    mock_llm_server: server.MockServerThread,
+) -> None:
+    """--allow-half-close 时，发完请求后 shutdown(SHUT_WR) 的客户端照常收到完整响应。"""
+
+    raw = send_raw(
+        mock_llm_server.port, chat_request(build_chat_body(3)), half_close=True
+    )
+
+    status, _, body = split_response(raw)
+    assert status == 200
+    assert json.loads(body)["object"] == "chat.completion"
+    assert mock_llm_server.stats()["abandoned"] == {
+        "before_first_byte": 0,
+        "mid_stream": 0,
+    }
+
+
+@pytest.mark.parametrize("mock_llm_server", [SLOW_JITTER], indirect=True)
+def test_half_close_counts_as_gone_by_default(
+    mock_llm_server: server.MockServerThread,
+) -> None:
+    """默认配置下请求读完后的 EOF 即视为离开，不再睡满抖动。"""
+
+    started = time.monotonic()
+    raw = send_raw(
+        mock_llm_server.port, chat_request(build_chat_body(3)), half_close=True
+    )
+
+    assert raw == b""
+    assert time.monotonic() - started < 1.0
+    assert wait_for_abandoned(mock_llm_server, "before_first_byte") == 1
+
+
+def test_bytes_after_request_do_not_cancel_response(
+    mock_llm_server: server.MockServerThread,
+) -> None:
+    """请求之后紧跟的字节（如流水线里的下一个请求）不会被当成断开信号。"""
+
+    request = chat_request(build_chat_body(3))
+    raw = send_raw(mock_llm_server.port, request + request)
+
+    assert split_response(raw)[0] == 200
+    assert mock_llm_server.stats()["abandoned"]["before_first_byte"] == 0
+
+
+def test_reset_during_jitter_cancels_request(tmp_path: pathlib.Path) -> None:
+    """抖动期间连接被重置时立即取消，记为首字节前离开并写入访问日志。"""
+
+    access_log = tmp_path / "access.jsonl"
+    config = server.MockServerConfig(**SLOW_JITTER, access_log=str(access_log))
+    with server.MockServerThread(config) as mock:
+        sock = socket.create_connection(("127.0.0.1", mock.port))
+        sock.sendall(chat_request(build_chat_body(3)))
+        time.sleep(0.1)
+        started = time.monotonic()
+        reset_connection(sock)
+
+        assert wait_for_abandoned(mock, "before_first_byte") == 1
+        assert time.monotonic() - started < 1.0
+
+    record = json.loads(access_log.read_text(encoding="utf-8").splitlines()[0])
+    assert record["disconnect_reason"] == "client_disconnect"
+    assert record["first_byte_ms"] is None
+
+
+@pytest.mark.parametrize("mock_llm_server", [SLOW_JITTER], indirect=True)
+def test_close_during_jitter_cancels_request(
+    mock_llm_server: server.MockServerThread,
+) -> None:
+    """抖动期间普通 close()（只发 FIN）同样立即取消，记为首字节前离开。"""
+
+    sock = socket.create_connection(("127.0.0.1", mock_llm_server.port))
+    sock.sendall(chat_request(build_chat_body(3)))
+    time.sleep(0.1)
+    started = time.monotonic()
+    sock.close()
+
+    assert wait_for_abandoned(mock_llm_server, "before_first_byte") == 1
+    assert time.monotonic() - started < 1.0
+    assert mock_llm_server.stats()["abandoned"]["mid_stream"] == 0
+
+
+@pytest.mark.parametrize(
+    "mock_llm_server",
+    [{"min_jitter_s": 1.0, "max_jitter_s": 1.0, "stream_chunk_lines": 1}],
+    indirect=True,
+)
+def test_close_mid_stream_counted(mock_llm_server: server.MockServerThread) -> None:
+    """流式中途关闭的客户端在下一次写回时被确认离开，记为 mid_stream。"""
+
+    sock = socket.create_connection(("127.0.0.1", mock_llm_server.port))
+    sock.sendall(chat_request(build_chat_body(40, stream=True)))
+    assert sock.recv(64).startswith(b"HTTP/1.1 200")
+    sock.close()
+
+    assert wait_for_abandoned(mock_llm_server, "mid_stream", timeout_s=3.0) == 1
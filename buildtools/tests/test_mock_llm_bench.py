@@ -0,0 +1,151 @@
+"""基准结果库的显著性检验、逐项对比与 compare 子命令的退出码。"""
+
+import pathlib
+import random
+from typing import Any
+
+import mock_llm_bench as bench
+import pytest
+
+
+def make_record(
+    label: str, latencies: list[float], throughput_rps: float
+) -> dict[str, Any]:
+    """构造一条最小结果库记录；两条延迟指标共用同一组样本。"""
+
+    return {
+        "id": f"{label}-{random.Random(label).getrandbits(32):08x}",
+        "label": label,
+        "environment": {},
+        "metrics": {
+            "throughput_rps": throughput_rps,
+            "throughput_lines_per_s": throughput_rps * 20,
+        },
+        "samples": {"total_ms": latencies, "ttfb_ms": latencies},
+    }
+
+
+def latency_samples(center: float, seed: int, count: int = 200) -> list[float]:
+    """围绕 center 的正态延迟样本。"""
+
+    rng = random.Random(seed)
+    return [rng.gauss(center, center * 0.05) for _ in range(count)]
+
+
+def test_mann_whitney_known_value() -> None:
+    """每侧 3 条且完全分开时，单侧 p 值约 0.04（正态近似加连续性校正）。"""
+
+    assert bench.mann_whitney_greater([4.0, 5.0, 6.0], [1.0, 2.0, 3.0]) == (
+        pytest.approx(0.0404, abs=1e-3)
+    )
+
+
+@pytest.mark.parametrize(
+    ("candidate", "baseline", "expected"),
+    [
+        ([], [1.0, 2.0], 1.0),
+        ([1.0, 2.0], [], 1.0),
+        ([5.0] * 10, [5.0] * 10, 1.0),
+    ],
+)
+def test_mann_whitney_degenerate_inputs(
+    candidate: list[float], baseline: list[float], expected: float
+) -> None:
+    """空样本或全部并列时方差为零，返回不显著的 1.0。"""
+
+    assert bench.mann_whitney_greater(candidate, baseline) == expected
+
+
+def test_mann_whitney_direction() -> None:
+    """候选明显偏大时 p 值很小，明显偏小时接近 1。"""
+
+    slower = latency_samples(120.0, seed=1)
+    faster = latency_samples(100.0, seed=2)
+
+    assert bench.mann_whitney_greater(slower, faster) < 1e-6
+    assert bench.mann_whitney_greater(faster, slower) > 0.999
+
+
+def test_compare_flags_latency_and_throughput_regression() -> None:
+    """延迟中位数显著变差、单次吞吐降幅超过阈值时都判为回归；吞吐不足 3 次不做检验。"""
+
+    baseline = [make_record("base", latency_samples(100.0, seed=1), 500.0)]
+    candidate = [make_record("cand", latency_samples(120.0, seed=2), 400.0)]
+
+    comparisons = {
+        item.metric: item
+        for item in bench.compare_results(
+            baseline, candidate, alpha=0.01, threshold=0.05
+        )
+    }
+
+    assert set(comparisons) == {
+        "total_ms.p50",
+        "ttfb_ms.p50",
+        "throughput_rps",
+        "throughput_lines_per_s",
+    }
+    assert comparisons["total_ms.p50"].regression
+    assert comparisons["total_ms.p50"].change == pytest.approx(0.2, abs=0.03)
+    assert comparisons["throughput_rps"].regression
+    assert comparisons["throughput_rps"].p_value is None
+
+
+def test_compare_tolerates_noise_and_small_changes() -> None:
+    """同分布的重复压测不算回归；多次吞吐未显著下降时即使超过阈值也不算。"""
+
+    baseline = [
+        make_record("base", latency_samples(100.0, seed=i), rps)
+        for i, rps in enumerate((500.0, 420.0, 520.0))
+    ]
+    candidate = [
+        make_record("cand", latency_samples(100.0, seed=10 + i), rps)
+        for i, rps in enumerate((450.0, 510.0, 430.0))
+    ]
+
+    comparisons = bench.compare_results(baseline, candidate, alpha=0.01, threshold=0.05)
+
+    assert not any(item.regression for item in comparisons)
+    throughput = next(item for item in comparisons if item.metric == "throughput_rps")
+    assert throughput.change < -0.05
+    assert throughput.p_value is not None
+
+
+def run_compare(store: pathlib.Path, baseline: str, candidate: str) -> int:
+    """按命令行方式执行 compare 子命令，返回退出码。"""
+
+    args = bench.parse_args(
+        [
+            "--store",
+            str(store),
+            "compare",
+            "--baseline",
+            baseline,
+            "--candidate",
+            candidate,
+        ]
+    )
+    return args.handler(args)
+
+
+def test_compare_command_exit_codes(
+    tmp_path: pathlib.Path, capsys: pytest.CaptureFixture[str]
+) -> None:
+    """有回归时退出码为 1，无回归为 0，找不到记录为 2。"""
+
+    store = tmp_path / "results.jsonl"
+    bench.append_result(
+        str(store), make_record("main", latency_samples(100.0, seed=1), 500.0)
+    )
+    bench.append_result(
+        str(store), make_record("same", latency_samples(100.0, seed=2), 500.0)
+    )
+    bench.append_result(
+        str(store), make_record("slow", latency_samples(130.0, seed=3), 350.0)
+    )
+
+    assert run_compare(store, "main", "same") == 0
+    assert "REGRESSION" not in capsys.readouterr().out
+    assert run_compare(store, "main", "latest") == 1
+    assert "REGRESSION" in capsys.readouterr().out
+    assert run_compare(store, "main", "missing") == 2
@@ -0,0 +1,155 @@
+"""前缀缓存：最长前缀命中、LRU 淘汰、TTL 过期，以及 usage 里的 cached_tokens。"""
+
+import json
+import time
+from typing import Any
+
+import mock_llm_api_server as server
+import pytest
+from support import build_jsonline_prompt, send_raw, split_response
+
+SYSTEM_PROMPT = "你是翻译助手，逐行翻译输入的 JSONLINE，保持序号不变。\n" * 20
+
+
+def chain(*steps: tuple[str, int]) -> tuple[tuple[bytes, int], ...]:
+    """用可读名字构造前缀链；摘要只需互不相同。"""
+
+    return tuple((name.encode(), tokens) for name, tokens in steps)
+
+
+def make_cache(**overrides: Any) -> server.PrefixCache:
+    """默认预算 1000 token、门槛 64、不过期。"""
+
+    options = {"max_tokens": 1000, "ttl_s": 0.0, "min_tokens": 64, **overrides}
+    return server.PrefixCache(**options)
+
+
+def test_longest_shared_prefix_hits() -> None:
+    """命中取最长的已缓存前缀；模型不同互不共享。"""
+
+    cache = make_cache()
+    system_then_a = chain(("system", 100), ("a", 300))
+
+    assert cache.admit("m", system_then_a) == 0
+    assert cache.admit("m", system_then_a) == 300
+    assert cache.admit("m", chain(("system", 100), ("b", 250))) == 100
+    assert cache.admit("other", system_then_a) == 0
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["cached_tokens"]) == (2, 2, 400)
+
+
+def test_prefixes_outside_token_limits_not_cached() -> None:
+    """不足门槛或单条超过预算的前缀不写入，也不会命中。"""
+
+    cache = make_cache(max_tokens=500)
+    request = chain(("short", 10), ("still_short", 63), ("huge", 600))
+
+    cache.admit("m", request)
+
+    assert cache.admit("m", request) == 0
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["tokens"] == 0
+
+
+def test_lru_eviction_keeps_recently_used() -> None:
+    """超出预算时淘汰最久未用的前缀，刚命中的前缀被保留。"""
+
+    cache = make_cache(max_tokens=700)
+    first, second, third = chain(("a", 300)), chain(("b", 300)), chain(("c", 300))
+
+    cache.admit("m", first)
+    cache.admit("m", second)
+    assert cache.admit("m", first) == 300
+    cache.admit("m", third)
+
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["tokens"] == 600
+    assert cache.admit("m", first) == 300
+    assert cache.admit("m", second) == 0
+
+
+def test_idle_prefixes_expire() -> None:
+    """空闲超过 TTL 的前缀在下次访问前清掉，计入 expirations。"""
+
+    cache = make_cache(ttl_s=10.0)
+    request = chain(("system", 100))
+    cache.admit("m", request)
+
+    with cache.lock:
+        cache.expire(time.monotonic() + 11.0)
+
+    stats = cache.stats()
+    assert (stats["entries"], stats["tokens"], stats["expirations"]) == (0, 0, 1)
+    assert cache.admit("m", request) == 0
+
+
+def chat_request(user_rows: int) -> server.HttpRequest:
+    """带长 system prompt 的非流式翻译请求。"""
+
+    body = json.dumps(
+        {
+            "model": "m",
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": build_jsonline_prompt(user_rows)},
+            ],
+        },
+        ensure_ascii=False,
+    ).encode("utf-8")
+    return server.HttpRequest(
+        method="POST",
+        target="/v1/chat/completions",
+        version="HTTP/1.1",
+        headers={},
+        body=body,
+    )
+
+
+def test_usage_and_prefill_delay_follow_cache_hits() -> None:
+    """第二个同 system prompt 的请求在 usage 里报告命中，预填充耗时按未命中部分计算。"""
+
+    config = server.MockServerConfig(
+        min_jitter_s=0.0,
+        max_jitter_s=0.0,
+        seed=3,
+        prefix_cache_tokens=10_000,
+        prefill_tokens_per_s=1000.0,
+    )
+    cache = server.PrefixCache(max_tokens=10_000, ttl_s=0.0, min_tokens=64)
+
+    replies = [
+        server.build_chat_reply(chat_request(rows), config=config, prefix_cache=cache)
+        for rows in (3, 4)
+    ]
+    usages = [json.loads(reply.messages[0])["usage"] for reply in replies]
+
+    cached = usages[1]["prompt_tokens_details"]["cached_tokens"]
+    assert usages[0]["prompt_tokens_details"]["cached_tokens"] == 0
+    assert cached == len(SYSTEM_PROMPT) // 4
+    assert usages[1]["cache_read_input_tokens"] == cached
+    for reply, usage in zip(replies, usages, strict=True):
+        uncached = (
+            usage["prompt_tokens"] - usage["prompt_tokens_details"]["cached_tokens"]
+        )
+        assert reply.delays_s[0] == pytest.approx(uncached / 1000.0)
+
+
+@pytest.mark.parametrize(
+    "mock_llm_server", [{"prefix_cache_tokens": 10_000}], indirect=True
+)
+def test_health_reports_prefix_cache(mock_llm_server: server.MockServerThread) -> None:
+    """经 HTTP 发出的重复请求在 /health 的 prefix_cache 里计为命中。"""
+
+    body = chat_request(2).body
+    head = f"POST /v1/chat/completions HTTP/1.1\r\nHost: x\r\nContent-Length: {len(body)}\r\n\r\n"
+    for _ in range(2):
+        status, _, _ = split_response(
+            send_raw(mock_llm_server.port, head.encode() + body)
+        )
+        assert status == 200
+
+    stats = mock_llm_server.stats()["prefix_cache"]
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+    assert stats["cached_tokens"] > 0
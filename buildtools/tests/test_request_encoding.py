@@ -0,0 +1,177 @@
+"""请求体 gzip/deflate 解码与响应压缩协商。"""
+
+import json
+import zlib
+
+import mock_llm_api_server as server
+import pytest
+from support import build_chat_body, send_raw, split_chunked, split_response
+
+INGEST_PATHS = [{"stream_ingest_threshold": 0}, {"stream_ingest_threshold": -1}]
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """按 Content-Encoding 名称压缩；x-gzip 同 gzip，raw-deflate 为不带 zlib 头的裸流。"""
+
+    wbits = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}.get(
+        encoding.removeprefix("x-"), -zlib.MAX_WBITS
+    )
+    compressor = zlib.compressobj(6, zlib.DEFLATED, wbits)
+    return compressor.compress(data) + compressor.flush()
+
+
+def post(
+    port: int,
+    body: bytes,
+    headers: dict[str, str],
+    *,
+    chunk_size: int | None = None,
+) -> tuple[int, dict[str, str], bytes]:
+    """发送 chat 请求；chunk_size 给出时按 chunked 编码分块发送。"""
+
+    lines = ["POST /v1/chat/completions HTTP/1.1", "Host: x"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    if chunk_size is None:
+        lines.append(f"Content-Length: {len(body)}")
+        payload = body
+    else:
+        lines.append("Transfer-Encoding: chunked")
+        pieces = [body[i : i + chunk_size] for i in range(0, len(body), chunk_size)]
+        payload = b"".join(
+            f"{len(piece):x}\r\n".encode() + piece + b"\r\n" for piece in pieces
+        )
+        payload += b"0\r\n\r\n"
+    head = ("\r\n".join(lines) + "\r\n\r\n").encode()
+    return split_response(send_raw(port, head + payload))
+
+
+@pytest.mark.parametrize("mock_llm_server", INGEST_PATHS, indirect=True)
+@pytest.mark.parametrize("encoding", ["gzip", "x-gzip", "deflate", "raw-deflate"])
+@pytest.mark.parametrize("chunk_size", [None, 5])
+def test_compressed_request_body(
+    mock_llm_server: server.MockServerThread, encoding: str, chunk_size: int | None
+) -> None:
+    """压缩请求体在两条读取路径上都解出原始 JSON，并统计请求方向的压缩量。"""
+
+    body = build_chat_body(20)
+    header = "deflate" if encoding == "raw-deflate" else encoding
+    status, _, response_body = post(
+        mock_llm_server.port,
+        compress(body, encoding),
+        {"Content-Encoding": header},
+        chunk_size=chunk_size,
+    )
+
+    content = json.loads(response_body)["choices"][0]["message"]["content"]
+    assert status == 200
+    assert server.count_jsonline_lines([content]) == 20
+    request_stats = mock_llm_server.stats()["compression"]["request"]
+    assert request_stats[header.removeprefix("x-")]["raw_bytes"] == len(body)
+
+
+@pytest.mark.parametrize("mock_llm_server", INGEST_PATHS, indirect=True)
+def test_truncated_gzip_body_rejected(
+    mock_llm_server: server.MockServerThread,
+) -> None:
+    """压缩流没有结束标记时返回 400，而不是按残缺 JSON 处理。"""
+
+    data = compress(build_chat_body(5), "gzip")
+    status, _, _ = post(
+        mock_llm_server.port, data[: len(data) // 2], {"Content-Encoding": "gzip"}
+    )
+
+    assert status == 400
+
+
+def test_unsupported_request_encoding(
+    mock_llm_server: server.MockServerThread,
+) -> None:
+    """br 等未实现的编码返回 415。"""
+
+    status, _, _ = post(
+        mock_llm_server.port, build_chat_body(), {"Content-Encoding": "br"}
+    )
+
+    assert status == 415
+
+
+@pytest.mark.parametrize(
+    "mock_llm_server", [{"max_body_bytes": 64 * 1024}], indirect=True
+)
+def test_decompressed_size_limit(mock_llm_server: server.MockServerThread) -> None:
+    """解压后的大小同样受 --max-body-bytes 约束。"""
+
+    bomb = compress(b'{"pad": "' + b"a" * (1024 * 1024) + b'"}', "gzip")
+    status, _, _ = post(mock_llm_server.port, bomb, {"Content-Encoding": "gzip"})
+
+    assert len(bomb) < 64 * 1024
+    assert status == 413
+
+
+@pytest.mark.parametrize(
+    ("accept", "expected"),
+    [
+        ("gzip", "gzip"),
+        ("deflate, gzip;q=0", "deflate"),
+        ("gzip;q=0, deflate;q=0", None),
+        ("*", "gzip"),
+        ("*;q=0", None),
+        ("br", None),
+        ("", None),
+    ],
+)
+def test_negotiate_response_encoding(accept: str, expected: str | None) -> None:
+    """按 Accept-Encoding 选择编码，q=0 视为拒绝。"""
+
+    assert server.negotiate_response_encoding(accept) == expected
+
+
+@pytest.mark.parametrize(
+    "mock_llm_server",
+    [{"response_compression": True, "compress_min_bytes": 0}],
+    indirect=True,
+)
+def test_compressed_response(mock_llm_server: server.MockServerThread) -> None:
+    """开启响应压缩后按 Accept-Encoding 返回 gzip，不接受时返回明文。"""
+
+    body = build_chat_body(10)
+    status, headers, raw = post(mock_llm_server.port, body, {"Accept-Encoding": "gzip"})
+    plain_status, plain_headers, plain = post(mock_llm_server.port, body, {})
+
+    decoded = json.loads(zlib.decompress(raw, 16 + zlib.MAX_WBITS))
+    assert status == 200
+    assert headers["content-encoding"] == "gzip"
+    assert headers["content-length"] == str(len(raw))
+    assert (
+        server.count_jsonline_lines([decoded["choices"][0]["message"]["content"]]) == 10
+    )
+    assert plain_status == 200
+    assert "content-encoding" not in plain_headers
+    assert json.loads(plain)["object"] == "chat.completion"
+
+
+@pytest.mark.parametrize(
+    "mock_llm_server",
+    [{"sse_compression": True, "compress_min_bytes": 0, "stream_chunk_lines": 2}],
+    indirect=True,
+)
+def test_compressed_sse_decodes_incrementally(
+    mock_llm_server: server.MockServerThread,
+) -> None:
+    """压缩 SSE 的每个 chunk 都以 SYNC_FLUSH 结尾，逐块解压即可拿到完整事件。"""
+
+    body = build_chat_body(6, stream=True)
+    status, headers, raw = post(
+        mock_llm_server.port, body, {"Accept-Encoding": "deflate"}
+    )
+
+    decompressor = zlib.decompressobj()
+    events: list[str] = []
+    for piece in split_chunked(raw):
+        text = decompressor.decompress(piece).decode("utf-8")
+        assert text.endswith("\n\n")
+        events.extend(event for event in text.split("\n\n") if event)
+    assert status == 200
+    assert headers["content-encoding"] == "deflate"
+    assert decompressor.eof
+    assert events[-1] == "data: [DONE]"
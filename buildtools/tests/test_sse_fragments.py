@@ -0,0 +1,174 @@
+"""SSE 字节级分片：各模式的切分位置、重组一致性、等待分配与端到端分块。"""
+
+import random
+
+import mock_llm_api_server as server
+import pytest
+from support import send_raw, split_chunked, split_response
+
+MESSAGE = (
+    'data: {"choices":[{"delta":{"content":"勇者\\"は\\"剣を抜いた"}}]}\n\n'.encode()
+)
+
+
+def inside_json_string(message: bytes, offset: int) -> bool:
+    """offset 之前的前缀停在某个字符串字面量内部，且两侧各至少有一个字符。"""
+
+    in_string = False
+    escaped = False
+    opened_at = -1
+    for pos in range(message.find(b"{"), offset):
+        byte = message[pos]
+        if escaped:
+            escaped = False
+        elif byte == 0x5C and in_string:
+            escaped = True
+        elif byte == 0x22:
+            in_string = not in_string
+            opened_at = pos
+    # 切点处是未转义的引号时右侧只剩闭合引号，不算字符串内部
+    closing = not escaped and message[offset] == 0x22
+    return in_string and offset - opened_at >= 2 and not closing
+
+
+def fragment_config(*modes: tuple[str, float]) -> server.MockServerConfig:
+    """只设置分片模式的配置。"""
+
+    return server.MockServerConfig(sse_fragments=modes)
+
+
+def test_byte_mode_splits_everywhere() -> None:
+    """byte 模式在每个字节之间切开。"""
+
+    offsets = server.choose_fragment_offsets(
+        MESSAGE, server.FRAGMENT_BYTE, random.Random(0)
+    )
+
+    assert offsets == list(range(1, len(MESSAGE)))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_utf8_mode_cuts_inside_characters(seed: int) -> None:
+    """utf8 模式的每个切点都落在多字节字符中间，前半段单独解码必然失败。"""
+
+    offsets = server.choose_fragment_offsets(
+        MESSAGE, server.FRAGMENT_UTF8, random.Random(seed)
+    )
+
+    assert 1 <= len(offsets) <= server.SSE_FRAGMENT_MAX_SPLITS
+    assert offsets == sorted(set(offsets))
+    for offset in offsets:
+        assert MESSAGE[offset] & 0xC0 == 0x80
+        with pytest.raises(UnicodeDecodeError):
+            MESSAGE[:offset].decode("utf-8")
+
+
+def test_utf8_mode_skips_ascii_messages() -> None:
+    """没有多字节字符的消息没有可切位置。"""
+
+    ascii_message = b'data: {"choices":[]}\n\n'
+
+    assert (
+        server.choose_fragment_offsets(
+            ascii_message, server.FRAGMENT_UTF8, random.Random(0)
+        )
+        == []
+    )
+
+
+def test_json_string_offsets_stay_inside_literals() -> None:
+    """候选切点都在字符串字面量内部（含转义序列中间），空串与单字符串没有切点。"""
+
+    offsets = server.json_string_offsets(MESSAGE)
+
+    assert offsets
+    assert all(inside_json_string(MESSAGE, offset) for offset in offsets)
+    assert server.json_string_offsets(b'data: {"ab":"","c":"x"}\n\n') == [9]
+    assert server.json_string_offsets(b"data: [DONE]\n\n") == []
+
+
+@pytest.mark.parametrize("mode", server.SSE_FRAGMENT_MODES)
+def test_short_messages_not_split(mode: str) -> None:
+    """不足两个字节的消息任何模式都不切。"""
+
+    assert server.choose_fragment_offsets(b"x", mode, random.Random(0)) == []
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_mode_offsets(seed: int) -> None:
+    """random 模式给出 1~4 个互不相同的升序切点，都在消息内部。"""
+
+    offsets = server.choose_fragment_offsets(
+        MESSAGE, server.FRAGMENT_RANDOM, random.Random(seed)
+    )
+
+    assert 1 <= len(offsets) <= server.SSE_FRAGMENT_MAX_SPLITS
+    assert offsets == sorted(set(offsets))
+    assert all(0 < offset < len(MESSAGE) for offset in offsets)
+
+
+@pytest.mark.parametrize("mode", server.SSE_FRAGMENT_MODES)
+def test_fragments_reassemble_with_first_delay(mode: str) -> None:
+    """分片拼回原消息；首片保留原等待，其余片等待为零，并按模式计数。"""
+
+    messages = [MESSAGE, b"data: [DONE]\n\n"]
+    trace = server.RequestTrace()
+    token = server.REQUEST_TRACE.set(trace)
+    try:
+        pieces, delays = server.fragment_sse_messages(
+            messages, [0.5, 0.25], fragment_config((mode, 1.0)), random.Random(1)
+        )
+    finally:
+        server.REQUEST_TRACE.reset(token)
+
+    assert b"".join(pieces) == b"".join(messages)
+    assert len(pieces) == len(delays)
+    assert sum(delays) == pytest.approx(0.75)
+    assert delays[0] == 0.5
+    done_start = len(pieces) - delays[::-1].index(0.25) - 1
+    assert b"".join(pieces[done_start:]) == messages[1]
+    hit_messages, extra_writes = trace.sse_fragments[mode]
+    assert extra_writes == len(pieces) - len(messages)
+    # [DONE] 既没有多字节字符也没有 JSON 字符串
+    ascii_only = mode in (server.FRAGMENT_UTF8, server.FRAGMENT_JSON_STRING)
+    assert hit_messages == (1 if ascii_only else 2)
+
+
+def test_first_hit_mode_wins_even_without_offsets() -> None:
+    """命中的第一个模式找不到切点时原样写出，不会退到后面的模式。"""
+
+    ascii_message = b'data: {"choices":[]}\n\n'
+
+    pieces, delays = server.fragment_sse_messages(
+        [ascii_message],
+        [0.1],
+        fragment_config((server.FRAGMENT_UTF8, 1.0), (server.FRAGMENT_RANDOM, 1.0)),
+        random.Random(0),
+    )
+
+    assert (pieces, delays) == ([ascii_message], [0.1])
+
+
+@pytest.mark.parametrize(
+    "mock_llm_server",
+    [{"sse_fragments": ((server.FRAGMENT_BYTE, 1.0),), "stream_chunk_lines": 2}],
+    indirect=True,
+)
+def test_byte_fragments_become_single_byte_chunks(
+    mock_llm_server: server.MockServerThread,
+) -> None:
+    """逐字节分片时每个 HTTP chunk 只带一个字节，拼接后仍是完整的 SSE 流。"""
+
+    body = b'{"model":"m","stream":true,"messages":[{"role":"user","content":"hi"}]}'
+    head = f"POST /v1/chat/completions HTTP/1.1\r\nHost: x\r\nContent-Length: {len(body)}\r\n\r\n"
+    status, _, raw = split_response(
+        send_raw(mock_llm_server.port, head.encode() + body)
+    )
+
+    chunks = split_chunked(raw)
+    assert status == 200
+    assert {len(chunk) for chunk in chunks} == {1}
+    assert b"".join(chunks).endswith(b"data: [DONE]\n\n")
+    assert (
+        mock_llm_server.stats()["sse_fragments"][server.FRAGMENT_BYTE]["messages"] > 0
+    )
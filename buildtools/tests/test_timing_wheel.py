@@ -0,0 +1,42 @@
+"""时间轮等待：零等待不进轮子，正等待向上取整到 tick 并成批唤醒。"""
+
+import asyncio
+import time
+
+import mock_llm_api_server as server
+import pytest
+
+
+@pytest.mark.parametrize("delay_s", [0.0, -1.0])
+def test_zero_pause_skips_wheel(delay_s: float) -> None:
+    """零或负等待立即返回，不会被轮子推迟到下一个 tick。"""
+
+    async def run() -> tuple[float, dict[str, object]]:
+        timer = server.TimingWheel(asyncio.get_running_loop(), tick_s=1.0)
+        started = time.monotonic()
+        for _ in range(10):
+            await server.pause(delay_s, timer)
+        return time.monotonic() - started, timer.stats()
+
+    elapsed, stats = asyncio.run(run())
+
+    assert elapsed < 0.1
+    assert stats["pending"] == 0
+    assert stats["ticks"] == 0
+
+
+def test_positive_pause_rounds_up_to_tick() -> None:
+    """正等待至少等到下一个 tick，同一 tick 到期的等待者一次唤醒。"""
+
+    async def run() -> tuple[float, dict[str, object]]:
+        timer = server.TimingWheel(asyncio.get_running_loop(), tick_s=0.05)
+        started = time.monotonic()
+        await asyncio.gather(*(server.pause(0.001, timer) for _ in range(100)))
+        return time.monotonic() - started, timer.stats()
+
+    elapsed, stats = asyncio.run(run())
+
+    assert elapsed >= 0.04
+    assert stats["wakeups"] == 100
+    assert stats["max_batch"] == 100
+    assert stats["pending"] == 0
@@ -0,0 +1,97 @@
+"""脚本化工具调用：按本回合已完成的轮次选步，用户追问后从头开始。"""
+
+import json
+from typing import Any
+
+import mock_llm_api_server as server
+import pytest
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "lookup",
+            "parameters": {"type": "object", "properties": {"q": {"type": "string"}}},
+        },
+    }
+]
+
+
+def tool_round(call_id: str) -> list[dict[str, Any]]:
+    """一轮完整的工具调用：assistant 发起调用，tool 返回结果。"""
+
+    return [
+        {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {
+                    "id": call_id,
+                    "type": "function",
+                    "function": {"name": "lookup", "arguments": "{}"},
+                }
+            ],
+        },
+        {"role": "tool", "tool_call_id": call_id, "content": "ok"},
+    ]
+
+
+@pytest.mark.parametrize(
+    ("messages", "expected"),
+    [
+        ([{"role": "user", "content": "q"}], 0),
+        ([{"role": "user", "content": "q"}, *tool_round("a"), *tool_round("b")], 2),
+        (
+            [
+                {"role": "user", "content": "q1"},
+                *tool_round("a"),
+                *tool_round("b"),
+                {"role": "assistant", "content": "answer"},
+                {"role": "user", "content": "q2"},
+                *tool_round("c"),
+            ],
+            1,
+        ),
+        ([{"role": "system", "content": "s"}, *tool_round("a")], 1),
+        ("not a list", 0),
+    ],
+)
+def test_count_completed_tool_rounds(messages: Any, expected: int) -> None:
+    """只数最后一条 user 消息之后的 tool_calls；没有 user 消息时数全部历史。"""
+
+    assert server.count_completed_tool_rounds(messages) == expected
+
+
+def tool_reply(messages: list[dict[str, Any]]) -> dict[str, Any]:
+    """两步脚本下生成非流式响应，返回 choices[0].message。"""
+
+    config = server.MockServerConfig(
+        min_jitter_s=0.0,
+        max_jitter_s=0.0,
+        seed=1,
+        tool_script=({"tool_calls": [{}]},) * 2,
+    )
+    body = json.dumps({"model": "m", "tools": TOOLS, "messages": messages}).encode()
+    request = server.HttpRequest(
+        method="POST",
+        target="/v1/chat/completions",
+        version="HTTP/1.1",
+        headers={},
+        body=body,
+    )
+    reply = server.build_chat_reply(request, config=config)
+    return json.loads(reply.messages[0])["choices"][0]["message"]
+
+
+def test_follow_up_question_restarts_script() -> None:
+    """上一问的脚本走完后，用户追问时重新从第一步发起工具调用。"""
+
+    first = [{"role": "user", "content": "q1"}, *tool_round("a"), *tool_round("b")]
+    follow_up = [
+        *first,
+        {"role": "assistant", "content": "answer"},
+        {"role": "user", "content": "q2"},
+    ]
+
+    assert tool_reply(first).get("tool_calls") is None
+    assert len(tool_reply(follow_up)["tool_calls"]) == 1
@@ -0,0 +1,85 @@
+"""卸载线程池的分流计数，以及工作线程共享对象的计数一致性。"""
+
+import concurrent.futures
+import json
+import pathlib
+import random
+
+import mock_llm_api_server as server
+import pytest
+from support import build_chat_body, send_raw, split_response
+
+
+def post_chat(port: int, rows: int) -> int:
+    """发送一个非流式 chat 请求，返回状态码。"""
+
+    body = build_chat_body(rows)
+    head = f"POST /v1/chat/completions HTTP/1.1\r\nHost: x\r\nContent-Length: {len(body)}\r\n\r\n"
+    return split_response(send_raw(port, head.encode() + body))[0]
+
+
+@pytest.mark.parametrize(
+    ("mock_llm_server", "expected"),
+    [
+        ({"offload_threshold_bytes": 1024 * 1024}, {"inline": 3, "offloaded": 0}),
+        ({"offload_threshold_bytes": 0}, {"inline": 0, "offloaded": 3}),
+    ],
+    indirect=["mock_llm_server"],
+)
+def test_offload_split_counts(
+    mock_llm_server: server.MockServerThread, expected: dict[str, int]
+) -> None:
+    """按阈值分流，inline 与 offloaded 各自只在实际执行路径上计数。"""
+
+    for rows in (1, 5, 20):
+        assert post_chat(mock_llm_server.port, rows) == 200
+
+    stats = mock_llm_server.stats()["offload"]
+    assert {key: stats[key] for key in expected} == expected
+    assert stats["in_flight"] == 0
+
+
+def test_should_offload_is_side_effect_free() -> None:
+    """should_offload 只做判断，反复调用不会改动计数。"""
+
+    state = server.ServerState(server.MockServerConfig())
+    pool = server.OffloadPool(state, workers=1, max_queue=1, threshold_bytes=100)
+    try:
+        assert [pool.should_offload(size) for size in (0, 99, 100, 5000)] == [
+            False,
+            False,
+            True,
+            True,
+        ]
+        assert pool.stats()["inline"] == 0
+        assert pool.stats()["offloaded"] == 0
+    finally:
+        pool.close()
+        state.close()
+
+
+def test_corpus_counters_under_threads(tmp_path: pathlib.Path) -> None:
+    """多个线程并发查找语料时，精确与就近命中计数之和等于查找次数。"""
+
+    corpus_path = tmp_path / "corpus.jsonl"
+    records = [{"src": f"原文{i}", "dst": f"dst {i}"} for i in range(50)]
+    corpus_path.write_text(
+        "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records),
+        encoding="utf-8",
+    )
+    corpus = server.ResponseCorpus(str(corpus_path))
+
+    def lookup_many(seed: int) -> None:
+        rng = random.Random(seed)
+        for i in range(2000):
+            corpus.lookup(f"原文{i % 50}" if i % 2 else f"未收录{i}", rng)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lookup_many, range(8)))
+        stats = corpus.stats()
+    finally:
+        corpus.close()
+
+    assert stats["exact_hits"] == 8 * 1000
+    assert stats["nearest_hits"] == 8 * 1000